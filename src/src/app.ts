@@ -33,30 +33,42 @@ server.listen(port, function() {
 });
 
 //Relay messages coming from javascript client to python process and vice versa
+//Connected client sockets by session id (the socket id)
+const sessions: { [sessionId: string]: socketio.Socket } = {};
+
+//Call callback and send back message to the client session it is addressed to (or all clients),
+//if new message from python process received
+//(data is a json string for text messages and an object for binary messages)
+const callback = (updateType: string, data: any, sessionId: string | undefined) => {
+    //console.log("sending back: " + updateType + " message")
+    if (sessionId === undefined) {
+        sockethandler.emit(updateType, data);
+    }
+    else if (sessions[sessionId]) {
+        sessions[sessionId].emit(updateType, data);
+    }
+};
+//Start the python process once, it serves the sessions of all clients
+pyCaller.init(pythonPath, callback)
+.then(() => {
+    console.log("Script finished");
+})
+.catch((err) => {
+    console.log("Error in python script: " + err);
+});
+
 sockethandler.on("connection", (socket) => {
     console.log("client connected!");
 
-    //Call callback and send back message to client, if new message from python process received
-    const callback = (data: any) => {
-        var splitData = data.split(" ");
-        if(splitData && splitData.length > 1){
-            //console.log("sending back: " + splitData[0] + " message")
-            socket.emit(splitData[0], splitData[1]);
-        }
-        else{
-            socket.emit("data", data);
-        }
-    };
-    //Start python process and initialize input and ouput reading/processing
-    pyCaller.init(pythonPath, callback)
-    .then(() => {
-        console.log("Script finished");
-    })
-    .catch((err) => {
-        console.log("Error in python script: " + err);
+    sessions[socket.id] = socket;
+    pyCaller.sendMessage("open 1 " + socket.id + "\n");
+    socket.on("disconnect", () => {
+        delete sessions[socket.id];
+        pyCaller.sendMessage("close 1 " + socket.id + "\n");
     });
-    //Socket Middleware to relay any message coming to this server socket from client to the python script process
-    socket.use((socket,next) => {
-        pyCaller.sendMessage(socket[0] + " " + socket[1]);
+    //Socket Middleware to relay any message coming to this server socket from client to the python script process,
+    //tagged with the session id of the client ("type data sessionid")
+    socket.use((packet,next) => {
+        pyCaller.sendMessage(packet[0] + " " + String(packet[1]).trim() + " " + socket.id + "\n");
     })
 });
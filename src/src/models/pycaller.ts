@@ -2,8 +2,15 @@ import { ChildProcessWithoutNullStreams, spawn } from "child_process";
 
 export class PyCaller {
 
+    // First byte of a binary frame sent by PythonMessenger, text messages never start with it
+    private static readonly binaryFrameMarker = 0;
+
     private childprocess: ChildProcessWithoutNullStreams;
     private client: any = null;
+    // Received stdout data which does not yet form a complete message (newline terminated text or binary frame)
+    private outputBuffer: Buffer = Buffer.alloc(0);
+    // Let the python process send data as binary frames instead of json text messages (opt-in, set before init)
+    public binaryProtocol: boolean = false;
     constructor() {
         console.log("PyCaller constructed");
     }
@@ -15,7 +22,11 @@ export class PyCaller {
             exectype = "python";
         }
         console.log("Spawning python process: " + scriptlocation);
-        this.childprocess = spawn(exectype, [scriptlocation]);
+        const args = [scriptlocation];
+        if (this.binaryProtocol) {
+            args.push("--binary");
+        }
+        this.childprocess = spawn(exectype, args);
         this.childprocess.stdin.setDefaultEncoding("utf-8");
 
         return this.handleScriptProcess(this.childprocess, callback);
@@ -29,16 +40,18 @@ export class PyCaller {
         this.childprocess.stdin.uncork();
     }
 
-    // Send data to callback if any new data was written to the python subprocesses stdout or stderr
+    // Send (message type, data, session id) to callback if any new data was written to the python subprocesses
+    // stdout or stderr
     private handleScriptProcess(childprocess: ChildProcessWithoutNullStreams, callback: any): Promise<void> {
         return new Promise<void>((resolve, reject) => {
             childprocess.stderr.on("data", (data: any) => {
                 return reject(data.toString("utf8"));
             });
-            childprocess.stdout.on("data", (data: any) => {
-                console.log("PYTHON: " + data.toString("utf8"));
+            childprocess.stdout.on("data", (data: Buffer) => {
                 // console.log("Received data from python")
-                callback(data.toString("utf8"));
+                // A chunk can contain several messages or only part of one
+                this.outputBuffer = Buffer.concat([this.outputBuffer, data]);
+                this.decodeMessages(callback);
             });
             /*childprocess.stdout.on("close", (code: any) => {
                 // fast cast to int
@@ -54,4 +67,83 @@ export class PyCaller {
         });
     }
 
+    // Call callback (type, data, session id) for every complete message in the output buffer and keep the
+    // incomplete rest
+    // Text messages ("type json [sessionid]") are passed on as json string, binary frames as decoded object
+    // The session id is undefined for messages addressed to all sessions
+    private decodeMessages(callback: any): void {
+        while (this.outputBuffer.length > 0) {
+            if (this.outputBuffer[0] === PyCaller.binaryFrameMarker) {
+                // Marker (1 byte) + payload length (uint32)
+                if (this.outputBuffer.length < 5) {
+                    return;
+                }
+                const frameLength = 5 + this.outputBuffer.readUInt32LE(1);
+                if (this.outputBuffer.length < frameLength) {
+                    return;
+                }
+                const frame = this.outputBuffer.slice(5, frameLength);
+                this.outputBuffer = this.outputBuffer.slice(frameLength);
+
+                const message = this.decodeBinaryFrame(frame);
+                console.log("PYTHON: " + message.type + " (binary, " + frameLength + " bytes)");
+                callback(message.type, message.data, message.session);
+            } else {
+                const messageEnd = this.outputBuffer.indexOf(10);
+                if (messageEnd < 0) {
+                    return;
+                }
+                const message = this.outputBuffer.toString("utf8", 0, messageEnd);
+                this.outputBuffer = this.outputBuffer.slice(messageEnd + 1);
+
+                console.log("PYTHON: " + message);
+                // "type json [sessionid]"
+                const messageParts = message.split(" ");
+                if (messageParts.length > 1) {
+                    callback(messageParts[0], messageParts[1], messageParts[2]);
+                } else if (message.length > 0) {
+                    callback("data", message);
+                }
+            }
+        }
+    }
+
+    // Decode binary frame payload (after marker and length) into message type and data object
+    // Layout: keyword length (uint16), keyword, header length (uint32), header json, little endian array buffers
+    private decodeBinaryFrame(frame: Buffer): { type: string, data: any, session: string | undefined } {
+        const keywordLength = frame.readUInt16LE(0);
+        const type = frame.toString("utf8", 2, 2 + keywordLength);
+        let offset = 2 + keywordLength;
+        const headerLength = frame.readUInt32LE(offset);
+        offset += 4;
+        const header = JSON.parse(frame.toString("utf8", offset, offset + headerLength));
+        offset += headerLength;
+
+        const data = header.data;
+        header.arrays.forEach((array: any) => {
+            const readValue = array.dtype === "int32" ?
+                (valueOffset: number) => frame.readInt32LE(valueOffset) :
+                (valueOffset: number) => frame.readFloatLE(valueOffset);
+            // One dimensional arrays become a list, two dimensional arrays a list of rows
+            const rowCnt: number = array.shape[0];
+            const columnCnt: number = array.shape.length > 1 ? array.shape[1] : 0;
+            const values: any[] = new Array(rowCnt);
+            for (let i = 0; i < rowCnt; i++) {
+                if (columnCnt === 0) {
+                    values[i] = readValue(offset);
+                    offset += 4;
+                } else {
+                    const row: number[] = new Array(columnCnt);
+                    for (let j = 0; j < columnCnt; j++) {
+                        row[j] = readValue(offset);
+                        offset += 4;
+                    }
+                    values[i] = row;
+                }
+            }
+            data[array.name] = values;
+        });
+        return { data, session: header.session, type };
+    }
+
 }
@@ -180,17 +180,45 @@ window.onload = function(){
         console.log("Connected to server socket");
 
         var network = null;
+        //Sequence number of the latest layout received, older layouts are dropped
+        var lastLayoutSeq = 0;
+        var frameAnimationMsec = 100;
+
+        //Text messages are relayed as json string, binary messages as already decoded object
+        var parseMessageData = function(data){
+            if(typeof data === "string"){
+                return JSON.parse(data);
+            }
+            return data;
+        };
 
         socket.on('create',(data)=>{
             console.log("Create: data received from server: ")// + data)
             //console.log(data);
-            network = networkGenerator.generateNetworkFromString(data);
+            network = networkGenerator.generateNetworkFromJSON(parseMessageData(data));
             networkDrawer.drawNetwork(network);
             redraw();
         });
+        //Intermediate layout of a running optimization
+        socket.on('fframe',(data)=>{
+            var frame = parseMessageData(data);
+            if(frame["seq"] <= lastLayoutSeq){
+                return;
+            }
+            lastLayoutSeq = frame["seq"];
+            var newNetwork = networkGenerator.generateNetworkFromJSON(frame);
+            networkDrawer.animateToNetwork(newNetwork,frameAnimationMsec)
+        });
         socket.on('fupdate',(data)=>{
             console.log("FUpdate: data received from server: ")// + data)
-            var newNetwork = networkGenerator.generateNetworkFromString(data);
+            var update = parseMessageData(data);
+            if(update["seq"] !== undefined){
+                if(update["seq"] <= lastLayoutSeq){
+                    return;
+                }
+                lastLayoutSeq = update["seq"];
+            }
+            var newNetwork = networkGenerator.generateNetworkFromJSON(update);
             networkDrawer.animateToNetwork(newNetwork,1000)
             //networkDrawer.drawNetwork(network);
             //redraw();
@@ -198,7 +226,7 @@ window.onload = function(){
         socket.on('update',(data)=>{
             console.log("Update: data received from server ")// + data)
             //console.log(data);
-            var dataJSON = JSON.parse(data);
+            var dataJSON = parseMessageData(data);
             for(var i = 0; i < dataJSON["indices"].length; i++){
                 var index = dataJSON["indices"][i]
                 var newPos = dataJSON["nodes"][i]
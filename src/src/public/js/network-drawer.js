@@ -108,6 +108,11 @@ export class NetworkDrawer{
 		var self = this;
 		var nodeDiffs =  []
 
+		//Continue from the current positions if a previous animation is still running
+		if(this.animationInterval){
+			clearInterval(this.animationInterval)
+		}
+
 		for(var i = 0; i < self.network.nodes.length; i++){
 			var x = newNetwork.nodes[i].center.x - self.network.nodes[i].center.x
 			var y = newNetwork.nodes[i].center.y - self.network.nodes[i].center.y
@@ -121,7 +126,7 @@ export class NetworkDrawer{
 		var timeoutFraction = timeout/timeMsec
 
 		//Setup drawing in refreshrate intervals
-		var animationInterval = setInterval(function(){
+		this.animationInterval = setInterval(function(){
 			console.log("Call Interval")
 			for(var i = 0; i < self.network.nodes.length; i++){
 				self.network.nodes[i].center.x += timeoutFraction * nodeDiffs[i][0]
@@ -131,7 +136,8 @@ export class NetworkDrawer{
 
 			timePassed += timeout
 			if(timePassed >=timeMsec){
-				clearInterval(animationInterval)
+				clearInterval(self.animationInterval)
+				self.animationInterval = null
 			}
 
 		},timeout)
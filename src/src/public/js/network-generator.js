@@ -10,9 +10,12 @@ export class NetworkGenerator{
 
     //Parse a string containing network information and create a Network instance from it 
     generateNetworkFromString(networkRepr){
-        var newNetwork = new Network();
+        return this.generateNetworkFromJSON(JSON.parse(networkRepr));
+    }
 
-        var network = JSON.parse(networkRepr);
+    //Create a Network instance from parsed network information
+    generateNetworkFromJSON(network){
+        var newNetwork = new Network();
 
         //Parse Node Data
         if(network["nodes"]){
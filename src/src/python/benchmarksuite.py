@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+from networkgenerator import NetworkGenerator
+from networkoptimizer import NetworkOptimizer
+
+class BenchmarkSuite:
+    """Micro benchmarks of the optimizer and generator hot paths on fixed seed networks of several scales,
+    measuring time and peak memory per call and comparing them against a stored baseline"""
+
+    #Optimizer settings of the constraint sets a scale can enable
+    constraintSets = {
+        "structural": {"structuralConstraintsEnabled": True,"overlapPreventionEnabled": False,"crossingMaximEnabled": False},
+        "default": {"structuralConstraintsEnabled": True,"overlapPreventionEnabled": True,"crossingMaximEnabled": False},
+        "all": {"structuralConstraintsEnabled": True,"overlapPreventionEnabled": True,"crossingMaximEnabled": True}
+    }
+
+    def __init__(self,seed=1,repeats=10,warmupSteps=5,optimizerSettings=None):
+        """
+        :param seed: (int) seed of the generated networks and of the initial optimizer gradients
+        :param repeats: (int) amount of timed calls per benchmark
+        :param warmupSteps: (int) optimization steps performed before the optimizer benchmarks, so lens state exists
+        :param optimizerSettings: (dict) NetworkOptimizer attributes set in addition to the constraint set (e.g. reuseStepBuffers)
+        """
+        self.seed = seed
+        self.repeats = repeats
+        self.warmupSteps = warmupSteps
+        self.optimizerSettings = optimizerSettings or {}
+        self.networkGenerator = NetworkGenerator()
+        #Generated networks by (nodes, edges)
+        self.networks = {}
+
+    def measure(self,function,setup=None):
+        """Time repeated calls of function, then record the peak memory allocated during one more call
+
+        :param function: ()=>any call to be measured
+        :param setup: ()=>None called before each call, not measured
+        :return: (dict) "time" median and "minTime" fastest call in seconds, "peakMemory" bytes allocated at most during a call
+        """
+        times = []
+        for repeat in range(0,self.repeats):
+            if(setup is not None):
+                setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+        if(setup is not None):
+            setup()
+        #Tracing slows allocations down, so memory is measured separately from time
+        tracemalloc.start()
+        function()
+        _, peakMemory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {"time": float(np.median(times)),"minTime": float(np.min(times)),"peakMemory": int(peakMemory),"repeats": self.repeats}
+
+    def getNetwork(self,nodeCnt,edgeCnt):
+        """Generate (once) the fixed seed network of a scale"""
+        key = (nodeCnt,edgeCnt)
+        if(key not in self.networks):
+            self.networks[key] = self.networkGenerator.generateNetwork(nodeCnt,edgeCnt,0,900,0,900,seed=self.seed)
+        return self.networks[key]
+
+    def createOptimizer(self,scale):
+        """Initialize an optimizer on the network of a scale with the lens at the center and perform the warmup steps
+
+        :param scale: (dict) "nodes", "edges", "radius", "constraints" (see constraintSets)
+        """
+        optimizer = NetworkOptimizer()
+        for name, value in dict(self.constraintSets[scale["constraints"]],**self.optimizerSettings).items():
+            setattr(optimizer,name,value)
+
+        np.random.seed(self.seed)
+        optimizer.initOptimization(self.getNetwork(scale["nodes"],scale["edges"]),[450.0,450.0],scale["radius"])
+        for stepIndex in range(0,self.warmupSteps):
+            optimizer.step()
+        return optimizer
+
+    def runScale(self,scale):
+        """Run all benchmarks of a scale, benchmarks of disabled constraints are skipped
+
+        :param scale: (dict) see createOptimizer
+        :return: (dict) benchmark name -> measurement (see measure)
+        """
+        results = {}
+        optimizer = self.createOptimizer(scale)
+        connPositions = optimizer.lastConnPositions
+
+        results["step"] = self.measure(optimizer.step)
+
+        if(optimizer.overlapPreventionEnabled or optimizer.crossingMaximEnabled):
+            #Measure the incremental update step performs after its first extraction
+            def continueFocalState():
+                optimizer.focalStateStep = optimizer.stepCnt - 1
+            results["extractFocalEdges"] = self.measure(lambda: optimizer.extractFocalEdges(connPositions[0],connPositions[1]),continueFocalState)
+
+        if(optimizer.overlapPreventionEnabled):
+            results["calculateOverlapLoss"] = self.measure(lambda: optimizer.calculateOverlapLoss(connPositions[0],connPositions[1]))
+        if(optimizer.crossingMaximEnabled):
+            results["calculateEdgeCrossLoss"] = self.measure(lambda: optimizer.calculateEdgeCrossLoss(connPositions[0],connPositions[1]))
+        return results
+
+    def run(self,scales,log=None):
+        """Run the benchmarks of all scales and the generator benchmark of each network size
+
+        :param scales: [dict] scales (see createOptimizer)
+        :param log: (str)=>None called with a line per finished benchmark
+        :return: (dict) {"meta": {...}, "results": {"<benchmark> <scale>": measurement with its "scale"}}
+        """
+        results = {}
+
+        def addResults(label,scale,measurements):
+            for name, measurement in measurements.items():
+                measurement["scale"] = scale
+                results[name + " " + label] = measurement
+                if(log is not None):
+                    log(self.formatResult(name + " " + label,measurement))
+
+        generatedSizes = set()
+        for scale in scales:
+            size = (scale["nodes"],scale["edges"])
+            if(size not in generatedSizes):
+                generatedSizes.add(size)
+                sizeScale = {"nodes": scale["nodes"],"edges": scale["edges"]}
+                generate = lambda: self.networkGenerator.generateNetwork(scale["nodes"],scale["edges"],0,900,0,900,seed=self.seed)
+                addResults(self.scaleLabel(sizeScale),sizeScale,{"generateNetwork": self.measure(generate)})
+
+            addResults(self.scaleLabel(scale),scale,self.runScale(scale))
+
+        meta = {
+            "seed": self.seed,
+            "repeats": self.repeats,
+            "warmupSteps": self.warmupSteps,
+            "optimizerSettings": self.optimizerSettings,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        return {"meta": meta,"results": results}
+
+    def scaleLabel(self,scale):
+        """Get the name suffix of the benchmarks of a scale, e.g. "nodes=1000 edges=1000 radius=200 constraints=all" """
+        return " ".join("{}={}".format(name,scale[name]) for name in ("nodes","edges","radius","constraints") if name in scale)
+
+    def formatResult(self,name,measurement):
+        """Format a measurement as one line of the benchmark log"""
+        return "{:<70} {:>10.3f} ms {:>10.3f} ms min {:>10.1f} KiB".format(name,measurement["time"] * 1000,measurement["minTime"] * 1000,measurement["peakMemory"] / 1024)
+
+    def compare(self,results,baseline,tolerance=0.25,minTimeDifference=0.0005):
+        """Compare results against baseline results of the same benchmarks
+
+        :param results: (dict) results of run
+        :param baseline: (dict) results of an earlier run
+        :param tolerance: (float) fraction by which the fastest call time or the peak memory may grow before it is a regression
+        :param minTimeDifference: (float) seconds a call has to be slower at least (timer noise of very short calls)
+        :return: [dict] regressions {"name","metric","baseline","current","ratio"}, benchmarks missing in the baseline are skipped
+        """
+        regressions = []
+        for name, measurement in results["results"].items():
+            baselineMeasurement = baseline["results"].get(name)
+            if(baselineMeasurement is None):
+                continue
+
+            for metric in ("minTime","peakMemory"):
+                current = measurement[metric]
+                previous = baselineMeasurement[metric]
+                if(current <= previous * (1 + tolerance)):
+                    continue
+                if(metric == "minTime" and current - previous < minTimeDifference):
+                    continue
+                regressions.append({"name": name,"metric": metric,"baseline": previous,"current": current,"ratio": current / max(previous,1e-12)})
+        return regressions
+
+    @classmethod
+    def createScales(cls,nodeCnts,edgeFactor,radii,constraints):
+        """Build the scales of all combinations of node counts, lens radii and constraint sets
+
+        :param nodeCnts: [int] amount of nodes of the networks
+        :param edgeFactor: (float) edges per node
+        :param radii: [float] lens radii
+        :param constraints: [str] constraint set names (see constraintSets)
+        """
+        return [{"nodes": nodeCnt,"edges": int(nodeCnt * edgeFactor),"radius": radius,"constraints": constraint}
+            for nodeCnt in nodeCnts for radius in radii for constraint in constraints]
+
+def main(arguments):
+    """Run the benchmarks, write the results as JSON and compare them against the baseline (exit code 1 on regressions)"""
+    benchmarkDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),"benchmarks")
+
+    parser = argparse.ArgumentParser(description="Benchmark the optimizer and generator hot paths")
+    parser.add_argument("--nodes",type=int,nargs="+",default=[1000,10000],help="node counts of the benchmark networks")
+    parser.add_argument("--edge-factor",type=float,default=1.5,help="edges per node")
+    parser.add_argument("--radii",type=float,nargs="+",default=[200],help="lens radii")
+    parser.add_argument("--constraints",nargs="+",default=["structural","default","all"],choices=sorted(BenchmarkSuite.constraintSets))
+    parser.add_argument("--reuse-step-buffers",action="store_true",help="benchmark the optimizer with reuseStepBuffers enabled")
+    parser.add_argument("--dtype",default="float64",choices=["float32","float64"],help="float type of the optimizer arrays")
+    parser.add_argument("--solver",default="heuristic",choices=["heuristic","momentum","adam"],help="step rule of the optimizer")
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--repeats",type=int,default=10)
+    parser.add_argument("--output",default=os.path.join(benchmarkDir,"results.json"))
+    parser.add_argument("--baseline",default=os.path.join(benchmarkDir,"baseline.json"))
+    parser.add_argument("--save-baseline",action="store_true",help="store the results as new baseline")
+    parser.add_argument("--tolerance",type=float,default=0.25,help="allowed growth of time and memory before flagging a regression")
+    args = parser.parse_args(arguments)
+
+    optimizerSettings = {"reuseStepBuffers": True} if args.reuse_step_buffers else {}
+    if(args.dtype != "float64"):
+        optimizerSettings["dtype"] = args.dtype
+    if(args.solver != "heuristic"):
+        optimizerSettings["solver"] = args.solver
+    suite = BenchmarkSuite(seed=args.seed,repeats=args.repeats,optimizerSettings=optimizerSettings)
+    scales = BenchmarkSuite.createScales(args.nodes,args.edge_factor,args.radii,args.constraints)
+    results = suite.run(scales,log=print)
+
+    outputPaths = [args.output] + ([args.baseline] if args.save_baseline else [])
+    for outputPath in outputPaths:
+        os.makedirs(os.path.dirname(os.path.abspath(outputPath)),exist_ok=True)
+        with open(outputPath,"w") as outputFile:
+            json.dump(results,outputFile,indent=2)
+    print("Results written to " + " and ".join(outputPaths))
+
+    if(args.save_baseline or not os.path.exists(args.baseline)):
+        return 0
+
+    with open(args.baseline,"r") as baselineFile:
+        baseline = json.load(baselineFile)
+    for setting in ("seed","optimizerSettings"):
+        if(baseline["meta"].get(setting) != results["meta"][setting]):
+            print("Baseline was recorded with different {}: {} (now {})".format(setting,baseline["meta"].get(setting),results["meta"][setting]))
+    regressions = suite.compare(results,baseline,args.tolerance)
+    for regression in regressions:
+        print("REGRESSION {name}: {metric} {baseline:.6g} -> {current:.6g} ({ratio:.2f}x)".format(**regression))
+    print("{} regressions against {}".format(len(regressions),args.baseline))
+    return 1 if len(regressions) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
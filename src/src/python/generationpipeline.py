@@ -0,0 +1,279 @@
+import os
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+import numpy as np
+from networkgenerator import NetworkGenerator
+from graphstore import GraphStore
+
+class GenerationPipeline:
+    """Deterministic generation of large clustered networks in chunks of nodes. Every chunk draws from its own
+    np.random.Generator spawned from one seed, so the result only depends on the seed and the chunk size and not on
+    the amount of processes the chunks are generated on. Chunks are written directly into preallocated shared memory
+    or .npy files on disk."""
+
+    def __init__(self,seed=None,chunkSize=1 << 16,processCnt=1,dtype=np.float64):
+        """Set up the seed sequence chunk seeds are spawned from
+
+        :param seed: (int) root seed, None for fresh entropy (see self.seedSequence.entropy to repeat the run)
+        :param chunkSize: (int) amount of nodes generated per chunk (changes the result)
+        :param processCnt: (int) amount of worker processes, 1 to generate in this process
+        :param dtype: float type of the node positions (np.float32 halves their size, see NetworkOptimizer.dtype)
+        """
+        self.seedSequence = np.random.SeedSequence(seed)
+        self.chunkSize = chunkSize
+        self.processCnt = processCnt
+        self.dtype = dtype
+        self.networkGenerator = NetworkGenerator()
+
+    def generate(self,nodeCnt,edgeCnt,xStart,xEnd,yStart,yEnd,closerSamplingIterations=30,clusterCenters=4,windowSize=500,arrayPath=None,storePath=None):
+        """Generate a network with normally distributed node clusters and edges to the closest of randomly sampled
+        candidates (as NetworkGenerator.generateNetwork with the "sampled" edge model). Edges of different chunks are
+        selected independently, an edge repeated in the opposite direction across chunks is removed afterwards.
+
+        :param nodeCnt: (int) Amount of nodes to be generated (exactly)
+        :param edgeCnt: (int) Amount of edges to be generated (spread evenly over the nodes, see NetworkGenerator.genEdges)
+        :param xStart,xEnd,yStart,yEnd: (int) Bounds of the data space for generation
+        :param closerSamplingIterations: (int) Amount of end node candidates per node
+        :param clusterCenters: (int) Amount of clusters centers to be generated
+        :param windowSize: (int) Data range around cluster (radius) center in which cluster nodes are generated
+        :param arrayPath: (str) directory to create the network arrays in as .npy files (nodes.npy, edges.npy, nodeclusters.npy),
+        None to keep them in memory
+        :param storePath: (str) directory to additionally write the network to as memory mapped GraphStore
+        :return: network ({"nodes":np.array((nodes,2),dtype=self.dtype),"edges":np.array((edges,2),dtype=int),"nodeclusters":np.array((nodes),dtype=int)}),
+        arrays are memory maps if arrayPath is set
+        """
+        layoutSeed, nodeSeed, edgeSeed = self.seedSequence.spawn(3)
+        chunkStarts = list(range(0,nodeCnt,self.chunkSize))
+        nodeSeeds = nodeSeed.spawn(len(chunkStarts))
+        edgeSeeds = edgeSeed.spawn(len(chunkStarts))
+
+        partition, centers = self.networkGenerator.genClusterLayout(clusterCenters,[xStart,xEnd,yStart,yEnd],np.random.default_rng(layoutSeed))
+        #First node of each cluster, rounded so that all nodeCnt nodes belong to a cluster
+        clusterOffsets = np.round(np.concatenate(([0],np.cumsum(partition[:,0]))) * nodeCnt).astype(np.int64)
+        layout = {"clusterOffsets": clusterOffsets,"centers": centers,"windowSize": windowSize}
+
+        #Most edges of a node (see NetworkGenerator.distributeEdges)
+        maxEdgeCnt = max(min(-(-edgeCnt // max(nodeCnt,1)),closerSamplingIterations),1)
+        arrays = ChunkArrays(arrayPath,shared=self.processCnt > 1)
+        try:
+            nodes = arrays.create("nodes",(nodeCnt,2),self.dtype)
+            nodeclusters = arrays.create("nodeclusters",(nodeCnt,),np.int32)
+            targets = arrays.create("targets",(nodeCnt,maxEdgeCnt),np.int64)
+
+            nodeTasks = [("nodes",arrays.descriptors(),start,min(start + self.chunkSize,nodeCnt),seed,layout)
+                for start, seed in zip(chunkStarts,nodeSeeds)]
+            edgeParameters = {"edgeCnt": edgeCnt,"candidateCnt": closerSamplingIterations}
+            edgeTasks = [("edges",arrays.descriptors(),start,min(start + self.chunkSize,nodeCnt),seed,edgeParameters)
+                for start, seed in zip(chunkStarts,edgeSeeds)]
+            #Edge chunks sample end nodes from all nodes, so they start after all node chunks are done
+            self.runTasks([nodeTasks,edgeTasks])
+
+            edges = self.collectEdges(targets,arrays)
+            network = arrays.result({"nodes": nodes,"edges": edges,"nodeclusters": nodeclusters})
+        finally:
+            arrays.release()
+
+        if(storePath is not None):
+            GraphStore.write(storePath,network["nodes"],network["edges"],network["nodeclusters"])
+        return network
+
+    def runTasks(self,phases):
+        """Run chunk tasks (see runChunkTask) on a process pool, or in this process if processCnt is 1
+
+        :param phases: (list) lists of tasks, the tasks of a phase start after all tasks of the previous phase are done
+        """
+        if(self.processCnt <= 1):
+            for tasks in phases:
+                for task in tasks:
+                    runChunkTask(task)
+            return
+
+        #Same start method as the optimization pool, workers import this module fresh
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.processCnt,mp_context=context) as processPool:
+            for tasks in phases:
+                for _ in processPool.map(runChunkTask,tasks):
+                    pass
+
+    def collectEdges(self,targets,arrays):
+        """Compact the selected end nodes of all chunks to an edge list, dropping edges that already exist in the
+        opposite direction from a node of an earlier chunk
+
+        :param targets: np.array((nodes,edgesPerNode),dtype=int) end nodes of each node, -1 for none
+        :param arrays: (ChunkArrays) allocator of the edges array
+        :return: np.array((edges,2),dtype=int) start, end node indices
+        """
+        nodeCnt = targets.shape[0]
+
+        def chunkEdges(start):
+            rows = np.asarray(targets[start:start + self.chunkSize])
+            startIndices = np.repeat(np.arange(start,start + rows.shape[0]),rows.shape[1])
+            return startIndices, rows.ravel()
+
+        def keptMask(start):
+            startIndices, endIndices = chunkEdges(start)
+            keep = endIndices >= 0
+            #Within a chunk, repeated edges were already avoided during the selection
+            crossing = np.nonzero(keep & (endIndices < start))[0]
+            keep[crossing] = ~np.any(np.asarray(targets[endIndices[crossing]]) == startIndices[crossing,None],axis=1)
+            return keep
+
+        #Bit packed, so the kept edges are only looked up once without holding a second copy of all edges
+        keptMasks = []
+        edgeCnt = 0
+        for start in range(0,nodeCnt,self.chunkSize):
+            keep = keptMask(start)
+            edgeCnt += int(np.count_nonzero(keep))
+            keptMasks.append(np.packbits(keep))
+        edges = arrays.create("edges",(edgeCnt,2),np.int64)
+        edgeOffset = 0
+        for chunkIndex, start in enumerate(range(0,nodeCnt,self.chunkSize)):
+            startIndices, endIndices = chunkEdges(start)
+            keep = np.unpackbits(keptMasks[chunkIndex])[:startIndices.shape[0]].astype(bool)
+            startIndices = startIndices[keep]
+            endIndices = endIndices[keep]
+            edges[edgeOffset:edgeOffset + startIndices.shape[0],0] = startIndices
+            edges[edgeOffset:edgeOffset + startIndices.shape[0],1] = endIndices
+            edgeOffset += startIndices.shape[0]
+        return edges
+
+class ChunkArrays:
+    """Preallocated arrays chunk tasks write into: plain arrays, shared memory blocks (for worker processes) or .npy
+    files on disk. Workers attach to them through descriptors."""
+
+    def __init__(self,path=None,shared=False):
+        """
+        :param path: (str) directory to create .npy files in, None to allocate in memory
+        :param shared: (bool) allocate in shared memory (if path is None), so worker processes can write into the arrays
+        """
+        self.path = path
+        self.shared = shared
+        self.arrays = {}
+        self.blocks = {}
+        self.arrayDescriptors = {}
+        if(path is not None):
+            os.makedirs(path,exist_ok=True)
+
+    def create(self,name,shape,dtype):
+        """Allocate a zero initialized array (shared memory and new files are zero filled)
+
+        :param name: (str) array name (file name without .npy)
+        :return: writable np.array (or memory map)
+        """
+        dtype = np.dtype(dtype)
+        if(self.path is not None):
+            filePath = os.path.join(self.path,name + ".npy")
+            array = np.lib.format.open_memmap(filePath,mode='w+',dtype=dtype,shape=shape)
+            self.arrayDescriptors[name] = ("file",filePath)
+        elif(self.shared):
+            #Size 0 blocks are not allowed
+            block = shared_memory.SharedMemory(create=True,size=max(int(np.prod(shape)) * dtype.itemsize,1))
+            array = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+            self.blocks[name] = block
+            self.arrayDescriptors[name] = ("shared",block.name,shape,dtype.str)
+        else:
+            array = np.zeros(shape,dtype=dtype)
+        self.arrays[name] = array
+        return array
+
+    def descriptors(self):
+        """Get the picklable descriptions of the arrays needed by attachArray
+
+        :return: (dict) name -> descriptor, arrays of this process for in process tasks
+        """
+        if(self.path is None and not self.shared):
+            return self.arrays
+        return dict(self.arrayDescriptors)
+
+    def result(self,network):
+        """Get the network arrays to be returned, copied out of shared memory (which is released afterwards)"""
+        if(self.path is not None):
+            for array in network.values():
+                array.flush()
+        if(self.shared and self.path is None):
+            return {name: np.array(array) for name, array in network.items()}
+        return network
+
+    def release(self):
+        """Free shared memory blocks and remove the temporary targets file"""
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+        if(self.path is not None and "targets" in self.arrayDescriptors):
+            os.remove(self.arrayDescriptors["targets"][1])
+
+#Arrays attached by this worker process, by descriptor
+attachedArrays = {}
+
+def attachArray(descriptor):
+    """Attach to an array created by ChunkArrays.create in another process (kept attached for later tasks)
+
+    :param descriptor: (tuple) see ChunkArrays.descriptors
+    :return: writable np.array (or memory map)
+    """
+    if(descriptor not in attachedArrays):
+        if(descriptor[0] == "file"):
+            attachedArrays[descriptor] = (np.load(descriptor[1],mmap_mode='r+'),None)
+        else:
+            _, blockName, shape, dtype = descriptor
+            block = shared_memory.SharedMemory(name=blockName)
+            attachedArrays[descriptor] = (np.ndarray(shape,dtype=dtype,buffer=block.buf),block)
+    return attachedArrays[descriptor][0]
+
+def generateNodeChunk(arrays,start,end,seed,layout):
+    """Place the nodes start to end around the center of the cluster they belong to
+
+    :param arrays: (dict) "nodes", "nodeclusters" arrays of all nodes
+    :param seed: (np.random.SeedSequence) seed of the chunk
+    :param layout: (dict) "clusterOffsets" first node of each cluster, "centers" cluster centers, "windowSize"
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.searchsorted(layout["clusterOffsets"],np.arange(start,end),side='right') - 1
+
+    angle = rng.random(end - start) * 2 * np.pi
+    length = rng.normal(size=end - start) * (layout["windowSize"] / 2)
+
+    arrays["nodes"][start:end,0] = layout["centers"][labels,0] + np.cos(angle) * length
+    arrays["nodes"][start:end,1] = layout["centers"][labels,1] + np.sin(angle) * length
+    arrays["nodeclusters"][start:end] = labels
+
+def generateEdgeChunk(arrays,start,end,seed,parameters):
+    """Select the end nodes of the nodes start to end among randomly sampled candidates (see NetworkGenerator.genEdges),
+    only avoiding edges repeated within the chunk
+
+    :param arrays: (dict) "nodes" positions of all nodes, "targets" end nodes of all nodes
+    :param seed: (np.random.SeedSequence) seed of the chunk
+    :param parameters: (dict) "edgeCnt", "candidateCnt"
+    """
+    networkGenerator = NetworkGenerator()
+    nodePositions = arrays["nodes"]
+    targets = arrays["targets"]
+    nodeCnt = nodePositions.shape[0]
+    if(nodeCnt < 2):
+        targets[start:end] = -1
+        return
+
+    rng = np.random.default_rng(seed)
+    chunkIndices = np.arange(start,end)
+    nodeEdgeCnts = networkGenerator.distributeEdges(chunkIndices,nodeCnt,parameters["edgeCnt"],parameters["candidateCnt"])
+    candidates = networkGenerator.sampleCandidates(chunkIndices,nodeCnt,parameters["candidateCnt"],rng)
+    rankedCandidates = networkGenerator.rankCandidates(nodePositions,chunkIndices,candidates)
+
+    chunkTargets = np.full((end - start,targets.shape[1]),-1,dtype=np.int64)
+    networkGenerator.selectEdgeTargets(rankedCandidates,chunkIndices,nodeEdgeCnts,chunkTargets,targetsStart=start)
+    targets[start:end] = chunkTargets
+
+def runChunkTask(task):
+    """Process pool task generating the nodes or edges of one chunk
+
+    :param task: (tuple) kind ("nodes" or "edges"), array descriptors (see ChunkArrays.descriptors), start, end, seed, parameters
+    """
+    kind, descriptors, start, end, seed, parameters = task
+    arrays = {name: descriptor if isinstance(descriptor,np.ndarray) else attachArray(descriptor) for name, descriptor in descriptors.items()}
+    if(kind == "nodes"):
+        generateNodeChunk(arrays,start,end,seed,parameters)
+    else:
+        generateEdgeChunk(arrays,start,end,seed,parameters)
@@ -0,0 +1,263 @@
+import os
+import numpy as np
+from spatialgrid import expandRanges
+
+class GraphStore:
+    """Network stored as memory mapped .npy files (node coordinates, cluster ids and CSR adjacency), so graphs larger than
+    the available memory can be explored by reading windows of them"""
+
+    #Rows processed at once while writing or scanning the store
+    chunkSize = 1 << 20
+
+    #Arrays of a store and the files holding them
+    arrayFiles = {
+        "nodes": "nodes.npy",
+        "nodeclusters": "nodeclusters.npy",
+        "nodeIds": "nodeids.npy",
+        "edgeOffsets": "edgeoffsets.npy",
+        "edgeTargets": "edgetargets.npy",
+        "inEdgeOffsets": "inedgeoffsets.npy",
+        "edgeSources": "edgesources.npy"
+    }
+
+    def __init__(self,arrays):
+        """Use open, write or fromNetwork to construct a GraphStore
+
+        :param arrays: (dict) np.arrays or memory maps of the store (see arrayFiles)
+        """
+        self.nodes = arrays["nodes"]
+        self.nodeclusters = arrays["nodeclusters"]
+        #External id of each node (e.g. dataset ids)
+        self.nodeIds = arrays["nodeIds"]
+        #Outgoing edges: targets of node i are edgeTargets[edgeOffsets[i]:edgeOffsets[i+1]]
+        self.edgeOffsets = arrays["edgeOffsets"]
+        self.edgeTargets = arrays["edgeTargets"]
+        #Incoming edges: sources of node i are edgeSources[inEdgeOffsets[i]:inEdgeOffsets[i+1]]
+        self.inEdgeOffsets = arrays["inEdgeOffsets"]
+        self.edgeSources = arrays["edgeSources"]
+
+        self.nodeCnt = self.nodes.shape[0]
+        self.edgeCnt = self.edgeTargets.shape[0]
+        #Lookup table from external ids to node indices, built on first use
+        self.idOrder = None
+
+    @classmethod
+    def open(cls,path):
+        """Open an existing store read only (see write)
+
+        :param path: (str) directory of the store
+        """
+        return cls({name: np.load(os.path.join(path,fileName),mmap_mode='r') for name, fileName in cls.arrayFiles.items()})
+
+    @classmethod
+    def write(cls,path,nodes,edges,nodeclusters=None,nodeIds=None):
+        """Write a network to a store, edges are sorted into CSR order chunk wise, so nodes and edges may be memory maps themselves
+
+        :param path: (str) directory of the store, created if missing
+        :param nodes: np.array((nodes,2)) node positions
+        :param edges: np.array((edges,2),dtype=int) start, end node indices of the edges
+        :param nodeclusters: np.array((nodes),dtype=int) cluster id of each node, defaults to 0
+        :param nodeIds: np.array((nodes),dtype=int) external id of each node, defaults to the node index
+        :return: GraphStore opened on the written files
+        """
+        os.makedirs(path,exist_ok=True)
+
+        def createArray(name,dtype,shape):
+            return np.lib.format.open_memmap(os.path.join(path,cls.arrayFiles[name]),mode='w+',dtype=dtype,shape=shape)
+
+        arrays = cls.buildArrays(nodes,edges,nodeclusters,nodeIds,createArray)
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        return cls.open(path)
+
+    @classmethod
+    def fromNetwork(cls,nodes,edges,nodeclusters=None,nodeIds=None):
+        """Build a store in memory (see write)"""
+        return cls(cls.buildArrays(nodes,edges,nodeclusters,nodeIds,lambda name, dtype, shape: np.empty(shape,dtype=dtype)))
+
+    @classmethod
+    def buildArrays(cls,nodes,edges,nodeclusters,nodeIds,createArray):
+        """Fill the arrays of a store chunk wise
+
+        :param createArray: (name,dtype,shape)=>array allocating the array of a store entry
+        :return: (dict) arrays of the store (see arrayFiles)
+        """
+        nodes = np.asarray(nodes)
+        edges = np.asarray(edges).reshape((-1,2))
+        nodeCnt = nodes.shape[0]
+
+        arrays = {
+            "nodes": createArray("nodes",np.float64,(nodeCnt,2)),
+            "nodeclusters": createArray("nodeclusters",np.int32,(nodeCnt,)),
+            "nodeIds": createArray("nodeIds",np.int64,(nodeCnt,))
+        }
+        for start in range(0,nodeCnt,cls.chunkSize):
+            end = min(start + cls.chunkSize,nodeCnt)
+            arrays["nodes"][start:end] = nodes[start:end]
+            arrays["nodeclusters"][start:end] = 0 if nodeclusters is None else np.asarray(nodeclusters[start:end])
+            arrays["nodeIds"][start:end] = np.arange(start,end) if nodeIds is None else np.asarray(nodeIds[start:end])
+
+        arrays["edgeOffsets"] = createArray("edgeOffsets",np.int64,(nodeCnt + 1,))
+        arrays["edgeTargets"] = createArray("edgeTargets",np.int64,(edges.shape[0],))
+        cls.buildCSR(edges,0,arrays["edgeOffsets"],arrays["edgeTargets"])
+        arrays["inEdgeOffsets"] = createArray("inEdgeOffsets",np.int64,(nodeCnt + 1,))
+        arrays["edgeSources"] = createArray("edgeSources",np.int64,(edges.shape[0],))
+        cls.buildCSR(edges,1,arrays["inEdgeOffsets"],arrays["edgeSources"])
+        return arrays
+
+    @classmethod
+    def buildCSR(cls,edges,rowColumn,offsets,values):
+        """Fill CSR offsets and values of the edges grouped by one of their nodes, with a chunked counting sort
+        (edges keep their order within a row)
+
+        :param edges: np.array((edges,2),dtype=int) start, end node indices of the edges
+        :param rowColumn: (int) 0 to group edges by start node (values are end nodes), 1 to group by end node
+        :param offsets: np.array((nodes+1),dtype=int) filled with the first value position of each row
+        :param values: np.array((edges),dtype=int) filled with the values of all rows
+        """
+        nodeCnt = offsets.shape[0] - 1
+        edgeCnt = edges.shape[0]
+        counts = np.zeros(nodeCnt,dtype=np.int64)
+        for start in range(0,edgeCnt,cls.chunkSize):
+            counts += np.bincount(edges[start:start + cls.chunkSize,rowColumn],minlength=nodeCnt)
+
+        offsets[0] = 0
+        np.cumsum(counts,out=offsets[1:])
+
+        #Next free position of each row
+        cursors = np.array(offsets[:-1])
+        for start in range(0,edgeCnt,cls.chunkSize):
+            chunk = np.asarray(edges[start:start + cls.chunkSize])
+            order = np.argsort(chunk[:,rowColumn],kind='stable')
+            rows = chunk[order,rowColumn]
+            #Rank of each edge within its row inside this chunk
+            ranks = np.arange(rows.shape[0]) - np.searchsorted(rows,rows,side='left')
+            values[cursors[rows] + ranks] = chunk[order,1 - rowColumn]
+            cursors += np.bincount(rows,minlength=nodeCnt)
+
+    def lookupNodeIds(self,ids):
+        """Get the node indices of external node ids
+
+        :param ids: np.array(dtype=int) external ids (see nodeIds)
+        :return: np.array(ids.shape,dtype=int) node indices, -1 for unknown ids
+        """
+        if(self.idOrder is None):
+            self.idOrder = np.argsort(self.nodeIds,kind='stable')
+            self.sortedIds = np.asarray(self.nodeIds)[self.idOrder]
+
+        ids = np.asarray(ids)
+        if(self.nodeCnt == 0):
+            return np.full(ids.shape,-1,dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sortedIds,ids),self.nodeCnt - 1)
+        return np.where(self.sortedIds[positions] == ids,self.idOrder[positions],-1)
+
+    def findNodesInRect(self,minCorner,maxCorner):
+        """Find the nodes inside an axis aligned rectangle, scanning the node coordinates chunk wise
+
+        :param minCorner: [x,y] lower bounds of the rectangle
+        :param maxCorner: [x,y] upper bounds of the rectangle
+        :return: np.array((nodes),dtype=int) sorted indices of the nodes inside
+        """
+        nodeIndices = [np.zeros(0,dtype=np.int64)]
+        for start in range(0,self.nodeCnt,self.chunkSize):
+            chunk = self.nodes[start:start + self.chunkSize]
+            inside = np.all((chunk >= minCorner) & (chunk <= maxCorner),axis=1)
+            nodeIndices.append(np.flatnonzero(inside) + start)
+        return np.concatenate(nodeIndices)
+
+    def getNeighbors(self,nodeIndices,outgoing=True,incoming=True):
+        """Get the nodes connected to any of the nodes, reading only their CSR rows
+
+        :param nodeIndices: np.array((nodes),dtype=int) indices of the nodes
+        :param outgoing: (bool) include end nodes of edges starting at the nodes
+        :param incoming: (bool) include start nodes of edges ending at the nodes
+        :return: np.array((neighbors),dtype=int) sorted unique indices of the neighbors
+        """
+        nodeIndices = np.asarray(nodeIndices,dtype=np.int64)
+        neighbors = [np.zeros(0,dtype=np.int64)]
+        if(outgoing):
+            neighbors.append(self.readRows(self.edgeOffsets,self.edgeTargets,nodeIndices)[1])
+        if(incoming):
+            neighbors.append(self.readRows(self.inEdgeOffsets,self.edgeSources,nodeIndices)[1])
+        return np.unique(np.concatenate(neighbors))
+
+    def readRows(self,offsets,values,rowIndices):
+        """Read CSR rows
+
+        :return: position in rowIndices of the row each value belongs to, values of the rows
+        """
+        starts = np.asarray(offsets[rowIndices])
+        counts = np.asarray(offsets[rowIndices + 1]) - starts
+        owners, positions = expandRanges(starts,counts)
+        return owners, np.asarray(values[positions])
+
+    def subgraph(self,nodeIndices):
+        """Load the subgraph induced by a set of nodes into memory
+
+        :param nodeIndices: np.array((nodes),dtype=int) indices of the nodes in the store
+        :return: network ({"nodes","edges","nodeclusters","nodeIndices"}) of np.arrays, edges index into the subgraph nodes,
+        nodeIndices maps subgraph nodes to store nodes
+        """
+        nodeIndices = np.unique(np.asarray(nodeIndices,dtype=np.int64))
+        owners, targets = self.readRows(self.edgeOffsets,self.edgeTargets,nodeIndices)
+
+        #Keep edges ending inside the subgraph
+        targetPositions = np.minimum(np.searchsorted(nodeIndices,targets),max(nodeIndices.shape[0] - 1,0))
+        inside = nodeIndices[targetPositions] == targets if nodeIndices.shape[0] > 0 else np.zeros(0,dtype=bool)
+
+        return {
+            "nodes": np.asarray(self.nodes[nodeIndices]),
+            "edges": np.stack((owners[inside],targetPositions[inside]),axis=1),
+            "nodeclusters": np.asarray(self.nodeclusters[nodeIndices]),
+            "nodeIndices": nodeIndices
+        }
+
+    def window(self,minCorner,maxCorner):
+        """Load the subgraph of the nodes inside an axis aligned rectangle (see subgraph and findNodesInRect)"""
+        return self.subgraph(self.findNodesInRect(minCorner,maxCorner))
+
+    def expandHops(self,startIndices,hops,maxNodes=None,outgoing=True,incoming=True,rng=None):
+        """Breadth first expansion from start nodes to all nodes at most hops edges away
+
+        :param startIndices: np.array((starts),dtype=int) node indices to start from
+        :param hops: (int) max amount of edges between a start node and a selected node
+        :param maxNodes: (int) node budget, the expansion stops once it is reached (the last hop is truncated), None for no budget
+        :param outgoing: (bool) follow edges from start to end node
+        :param incoming: (bool) follow edges from end to start node
+        :param rng: np.random.Generator selecting which nodes of the last hop are kept if it exceeds the budget,
+        None to keep the lowest indices
+        :return: np.array((nodes),dtype=int) sorted indices of the selected nodes
+        """
+        if(maxNodes is None):
+            maxNodes = self.nodeCnt
+        visited = np.zeros(self.nodeCnt,dtype=bool)
+        frontier = np.unique(np.asarray(startIndices,dtype=np.int64))[0:maxNodes]
+        visited[frontier] = True
+        selectedCnt = frontier.shape[0]
+
+        for hop in range(0,hops):
+            if(selectedCnt >= maxNodes or frontier.shape[0] == 0):
+                break
+            neighbors = self.getNeighbors(frontier,outgoing,incoming)
+            frontier = neighbors[~visited[neighbors]]
+            if(selectedCnt + frontier.shape[0] > maxNodes):
+                if(rng is not None):
+                    frontier = np.sort(rng.permutation(frontier)[0:maxNodes - selectedCnt])
+                else:
+                    frontier = frontier[0:maxNodes - selectedCnt]
+            visited[frontier] = True
+            selectedCnt += frontier.shape[0]
+
+        return np.flatnonzero(visited)
+
+    def sampleSubgraph(self,startCnt=5,hops=2,maxNodes=None,seed=None,outgoing=True,incoming=True):
+        """Load the subgraph around randomly chosen start nodes (see expandHops and subgraph)
+
+        :param startCnt: (int) amount of random start nodes
+        :param seed: (int) seed of the random start node selection, equal seeds select equal subgraphs
+        :return: network of the selected nodes (see subgraph)
+        """
+        rng = np.random.default_rng(seed)
+        startIndices = rng.choice(self.nodeCnt,size=min(startCnt,self.nodeCnt),replace=False)
+        return self.subgraph(self.expandHops(startIndices,hops,maxNodes,outgoing,incoming,rng))
@@ -0,0 +1,113 @@
+import collections
+import numpy as np
+
+class LayoutCache:
+    """Least recently used, memory bounded cache of optimized layouts keyed by quantized lens parameters"""
+
+    def __init__(self,maxBytes=64*1024*1024,positionQuantum=4.0,radiusQuantum=1.0,magnificationQuantum=0.1,blendDistance=40.0):
+        """Sets cache bounds and key quantization
+
+        :param maxBytes: (int) upper bound of memory used by cached layouts, least recently used layouts are evicted first
+        :param positionQuantum: (float) focal points closer than this (in data space) share a cache entry
+        :param radiusQuantum: (float) quantization step of the lens radius
+        :param magnificationQuantum: (float) quantization step of the magnification factor
+        :param blendDistance: (float) max distance of cached focal points to be blended on a cache miss
+        """
+        self.maxBytes = maxBytes
+        self.positionQuantum = positionQuantum
+        self.radiusQuantum = radiusQuantum
+        self.magnificationQuantum = magnificationQuantum
+        self.blendDistance = blendDistance
+
+        self.entries = collections.OrderedDict()
+        self.usedBytes = 0
+
+    def makeKey(self,focalPoint,radius,magnification,mode):
+        """Quantize lens parameters to a cache key
+
+        :param focalPoint: [x,y] focal point of the lens
+        :param radius: (int) radius of the lens
+        :param magnification: (float) magnification factor of the lens
+        :param mode: (str) optimization mode the layout was created with (e.g. "fishdown")
+        """
+        return (
+            int(round(focalPoint[0] / self.positionQuantum)),
+            int(round(focalPoint[1] / self.positionQuantum)),
+            int(round(radius / self.radiusQuantum)),
+            int(round(magnification / self.magnificationQuantum)),
+            mode
+        )
+
+    def get(self,focalPoint,radius,magnification,mode):
+        """Get the cached layout of the lens parameters
+
+        :return: np.array((nodes,2)) cached node positions or None on a cache miss
+        """
+        key = self.makeKey(focalPoint,radius,magnification,mode)
+        entry = self.entries.get(key)
+        if(entry is None):
+            return None
+
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self,focalPoint,radius,magnification,mode,layout):
+        """Store a copy of an optimized layout and evict least recently used layouts if over the memory bound
+
+        :param layout: np.array((nodes,2)) node positions optimized for the lens parameters
+        """
+        layout = np.array(layout,dtype=float)
+        if(layout.nbytes > self.maxBytes):
+            return
+
+        key = self.makeKey(focalPoint,radius,magnification,mode)
+        if(key in self.entries):
+            self.usedBytes -= self.entries.pop(key)[1].nbytes
+
+        self.entries[key] = (np.asarray(focalPoint,dtype=float),layout)
+        self.usedBytes += layout.nbytes
+
+        while(self.usedBytes > self.maxBytes):
+            _, (_, evictedLayout) = self.entries.popitem(last=False)
+            self.usedBytes -= evictedLayout.nbytes
+
+    def blend(self,focalPoint,radius,magnification,mode,blendCnt=2):
+        """Approximate the layout of lens parameters which are not cached, by inverse distance weighting the layouts
+        of the nearest cached focal points with the same radius, magnification and mode
+
+        :param blendCnt: (int) max amount of cached layouts to be blended
+        :return: np.array((nodes,2)) blended node positions or None if no cached focal point is within blendDistance
+        """
+        lensKey = self.makeKey(focalPoint,radius,magnification,mode)[2:]
+        focalPoint = np.asarray(focalPoint,dtype=float)
+
+        candidates = []
+        for key, (cachedFocalPoint, layout) in self.entries.items():
+            if(key[2:] != lensKey):
+                continue
+            distance = np.linalg.norm(cachedFocalPoint - focalPoint)
+            if(distance <= self.blendDistance):
+                candidates.append((distance,key,layout))
+
+        if(len(candidates) == 0):
+            return None
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        candidates = candidates[0:blendCnt]
+        if(candidates[0][0] == 0):
+            candidates = candidates[0:1]
+
+        weights = np.array([1.0 / max(distance,1e-9) for distance, _, _ in candidates])
+        weights = weights / np.sum(weights)
+
+        blended = np.zeros_like(candidates[0][2])
+        for weight, (_, key, layout) in zip(weights,candidates):
+            blended += weight * layout
+            self.entries.move_to_end(key)
+
+        return blended
+
+    def clear(self):
+        """Remove all cached layouts (e.g. after the network changed)"""
+        self.entries.clear()
+        self.usedBytes = 0
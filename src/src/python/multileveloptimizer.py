@@ -0,0 +1,202 @@
+import numpy as np
+from networkoptimizer import NetworkOptimizer
+
+class MultilevelOptimizer:
+    """Coarsen-and-refine optimization of large networks: nodes are collapsed level by level into supernodes
+    (pairs of nodes joined by their shortest edge within the same node cluster), the coarsest network is optimized first
+    and the displacement of each supernode is carried down to its nodes as starting layout of the next finer level.
+    The global structure settles on the small coarse networks, so the finer levels only have to refine it."""
+
+    def __init__(self,optimizer=None,minCoarseNodes=1000,maxLevels=10,minReduction=0.8,matchingRounds=4):
+        """
+        :param optimizer: NetworkOptimizer performing the optimization of each level (its settings apply to all levels)
+        :param minCoarseNodes: (int) stop coarsening once a level has at most this amount of nodes
+        :param maxLevels: (int) max amount of coarse levels
+        :param minReduction: (float) stop coarsening if a level keeps more than this fraction of the nodes of the finer level
+        :param matchingRounds: (int) rounds of matching the still unmatched nodes per level
+        """
+        self.optimizer = optimizer if optimizer is not None else NetworkOptimizer()
+        self.minCoarseNodes = minCoarseNodes
+        self.maxLevels = maxLevels
+        self.minReduction = minReduction
+        self.matchingRounds = matchingRounds
+
+        #Coarse levels (edges, clusters and mapping) of the last coarsened edges, matched again if other edges are optimized
+        self.coarseLevels = None
+        self.coarseLevelsEdges = None
+
+    def coarsen(self,network):
+        """Build the coarse levels of a network. The matching of the nodes is cached for the edges of the last network,
+        the positions of the supernodes are calculated from the node positions of each call
+
+        :param network: {"nodes"=[],"edges"=[],"nodeclusters"=[]} network to be coarsened, nodes are only matched within their cluster
+        :return: [{"network","mapping"}] levels from the finest (the network itself, mapping None) to the coarsest,
+        mapping np.array((finer nodes),dtype=int) is the supernode of each node of the next finer level
+        """
+        if(self.coarseLevels is None or self.coarseLevelsEdges is not network["edges"]):
+            coarseLevels = []
+            finer = network
+            while(len(coarseLevels) < self.maxLevels):
+                finerCnt = len(finer["nodes"])
+                if(finerCnt <= self.minCoarseNodes):
+                    break
+                coarse, mapping = self.coarsenLevel(finer)
+                if(len(coarse["nodes"]) > finerCnt * self.minReduction):
+                    break
+                coarseLevels.append({"network": coarse,"mapping": mapping})
+                finer = coarse
+
+            self.coarseLevels = coarseLevels
+            self.coarseLevelsEdges = network["edges"]
+
+        levels = [{"network": network,"mapping": None}]
+        nodePositions = np.asarray(network["nodes"],dtype=float)
+        for coarseLevel in self.coarseLevels:
+            coarse = dict(coarseLevel["network"])
+            nodePositions = self.calcCoarsePositions(nodePositions,coarseLevel["mapping"],len(coarse["nodes"]))
+            coarse["nodes"] = nodePositions
+            levels.append({"network": coarse,"mapping": coarseLevel["mapping"]})
+        return levels
+
+    def calcCoarsePositions(self,nodePositions,mapping,coarseCnt):
+        """Place each supernode at the mean position of its nodes
+
+        :param nodePositions: np.array((nodes,2)) positions of the nodes of the finer level
+        :param mapping: np.array((nodes),dtype=int) supernode of each node
+        :param coarseCnt: (int) amount of supernodes
+        :return: np.array((supernodes,2)) positions of the supernodes
+        """
+        memberCnts = np.bincount(mapping,minlength=coarseCnt)
+        coarsePositions = np.zeros((coarseCnt,2))
+        coarsePositions[:,0] = np.bincount(mapping,weights=nodePositions[:,0],minlength=coarseCnt) / memberCnts
+        coarsePositions[:,1] = np.bincount(mapping,weights=nodePositions[:,1],minlength=coarseCnt) / memberCnts
+        return coarsePositions
+
+    def coarsenLevel(self,network):
+        """Collapse matched node pairs into supernodes at the mean position of their nodes
+
+        :param network: {"nodes"=[],"edges"=[],"nodeclusters"=[]} network to be coarsened
+        :return: coarse network {"nodes": np.array((supernodes,2)),"edges": np.array((edges,2),dtype=int),"nodeclusters"},
+        np.array((nodes),dtype=int) supernode of each node
+        """
+        nodePositions = np.asarray(network["nodes"],dtype=float)
+        edges = np.asarray(network["edges"],dtype=np.int64).reshape(-1,2)
+        nodeclusters = network.get("nodeclusters")
+        if(nodeclusters is not None):
+            nodeclusters = np.asarray(nodeclusters).reshape(-1)
+
+        representatives = self.matchNodes(nodePositions,edges,nodeclusters)
+        isRepresentative = representatives == np.arange(nodePositions.shape[0])
+        coarseIndices = np.cumsum(isRepresentative) - 1
+        mapping = coarseIndices[representatives]
+        coarseCnt = int(np.count_nonzero(isRepresentative))
+
+        coarsePositions = self.calcCoarsePositions(nodePositions,mapping,coarseCnt)
+
+        #Edges between different supernodes, each connection only once
+        coarseEdges = mapping[edges]
+        coarseEdges = coarseEdges[coarseEdges[:,0] != coarseEdges[:,1]]
+        edgeKeys = np.unique(coarseEdges[:,0] * coarseCnt + coarseEdges[:,1])
+        coarseEdges = np.stack((edgeKeys // coarseCnt,edgeKeys % coarseCnt),axis=1)
+
+        coarse = {"nodes": coarsePositions,"edges": coarseEdges}
+        if(nodeclusters is not None):
+            coarse["nodeclusters"] = nodeclusters[isRepresentative]
+        return coarse, mapping
+
+    def matchNodes(self,nodePositions,edges,nodeclusters=None):
+        """Group nodes along short edges: in each round every unmatched node proposes to the neighbor at
+        its shortest edge to another unmatched node, nodes proposing to each other are matched (the shortest remaining
+        edge always is, so every round makes progress). Nodes left unmatched (e.g. leaves of matched nodes) join the pair
+        at their shortest edge.
+
+        :param nodePositions: np.array((nodes,2)) positions of the nodes
+        :param edges: np.array((edges,2),dtype=int) start, end node indices
+        :param nodeclusters: np.array((nodes),dtype=int) cluster of each node, only nodes of the same cluster are grouped
+        :return: np.array((nodes),dtype=int) lowest node index of the group of each node
+        """
+        nodeCnt = nodePositions.shape[0]
+        partners = np.full(nodeCnt,-1,dtype=np.int64)
+
+        candidates = edges[edges[:,0] != edges[:,1]]
+        if(nodeclusters is not None):
+            candidates = candidates[nodeclusters[candidates[:,0]] == nodeclusters[candidates[:,1]]]
+        differences = nodePositions[candidates[:,0]] - nodePositions[candidates[:,1]]
+        lengths = np.sum(differences * differences,axis=1)
+
+        #Both directions, so each node sees all of its edges
+        proposers = np.concatenate((candidates[:,0],candidates[:,1]))
+        targets = np.concatenate((candidates[:,1],candidates[:,0]))
+        lengths = np.concatenate((lengths,lengths))
+        order = np.lexsort((lengths,proposers))
+        proposers = proposers[order]
+        targets = targets[order]
+
+        def firstProposals(proposers,targets):
+            """Target of the first (shortest) entry of each proposer, -1 for nodes without entries"""
+            proposals = np.full(nodeCnt,-1,dtype=np.int64)
+            firstEntries = np.flatnonzero(np.diff(proposers,prepend=-1) != 0)
+            proposals[proposers[firstEntries]] = targets[firstEntries]
+            return proposals
+
+        remainingProposers = proposers
+        remainingTargets = targets
+        for matchingRound in range(0,self.matchingRounds):
+            unmatched = (partners[remainingProposers] < 0) & (partners[remainingTargets] < 0)
+            remainingProposers = remainingProposers[unmatched]
+            remainingTargets = remainingTargets[unmatched]
+            if(remainingProposers.shape[0] == 0):
+                break
+
+            proposals = firstProposals(remainingProposers,remainingTargets)
+            proposing = np.flatnonzero(proposals >= 0)
+            mutual = proposing[proposals[proposals[proposing]] == proposing]
+            if(mutual.shape[0] == 0):
+                break
+            partners[mutual] = proposals[mutual]
+
+        nodeIndices = np.arange(nodeCnt)
+        representatives = np.where(partners >= 0,np.minimum(nodeIndices,partners),nodeIndices)
+
+        joining = (partners[proposers] < 0) & (partners[targets] >= 0)
+        proposals = firstProposals(proposers[joining],targets[joining])
+        joiningNodes = np.flatnonzero(proposals >= 0)
+        representatives[joiningNodes] = representatives[proposals[joiningNodes]]
+        return representatives
+
+    def optimize(self,network,focalPoint,radius,maxSteps=None,stepCallback=None,cancelCallback=None):
+        """Optimize the coarsest level of a network, then each finer level starting at the positions of its nodes
+        displaced from the fisheye layout as their supernode was displaced (see NetworkOptimizer.optimize)
+
+        :param network: {"nodes"=[],"edges"=[],"nodeclusters"=[]} network to be optimized
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        :param maxSteps: (int) max amount of steps per level, defaults to optimizer.maxSteps
+        :param stepCallback: (nodePositions,stepCnt)=>None called after each step of the finest level
+        :param cancelCallback: ()=>bool called before each step, the optimization is aborted if it returns True
+        :return: np.array((nodes,2)) node positions of the finest level, [int] amount of steps of each level (finest first)
+        """
+        levels = self.coarsen(network)
+        stepCnts = [0] * len(levels)
+
+        coarseFisheyeOffsets = None
+        for levelIndex in range(len(levels) - 1,-1,-1):
+            level = levels[levelIndex]
+            self.optimizer.initOptimization(level["network"],focalPoint,radius)
+            if(coarseFisheyeOffsets is not None):
+                #Nodes keep the offset to their supernode they have in the fisheye layout, so nodes collapsed
+                #inside the lens are spread apart as far as the lens magnifies them
+                self.optimizer.setStartPositions(self.optimizer.fisheyePositions + coarseFisheyeOffsets)
+
+            callback = stepCallback if levelIndex == 0 else None
+            nodePositions, stepCnts[levelIndex] = self.optimizer.optimize(maxSteps,callback,cancelCallback)
+            if(nodePositions is None):
+                return None, stepCnts
+            nodePositions = np.array(nodePositions)
+
+            if(cancelCallback is not None and cancelCallback()):
+                return nodePositions if levelIndex == 0 else None, stepCnts
+            if(levelIndex > 0):
+                coarseFisheyeOffsets = (nodePositions - self.optimizer.fisheyePositions)[level["mapping"]]
+
+        return nodePositions, stepCnts
@@ -3,74 +3,73 @@ import numpy as np
 import math
 import os
 import re
+from graphstore import GraphStore
+from spatialgrid import SpatialGrid
 
 class NetworkGenerator:
     """A Genrator for generating new random networks"""
 
-    def genClusterNodes(self,numCluster,numPoints,windowSize=100,bounds=[0,900,0,900]):
+    def genClusterNodes(self,numCluster,numPoints,windowSize=100,bounds=[0,900,0,900],rng=None):
         """Generates normally distributed clusters of nodes
 
         :param numCluster: (int) Amount of clusters centers to be generated/chosen
         :param numPoints: (int) Amount of node centers (nodes) to be generated
         :param windowSize: (int) Data range around cluster (radius) center in which cluster nodes are generated
         :param bounds: (int[4]) [startx,endx,starty,endy] bounds of target data region in which the clusters are to be generated
+        :param rng: (np.random.Generator) random number source, None for the global np.random state
 
         :return: allpoints, allLabels np.array((numPoints,2)), (np.array((numPoints,1),dtype=int)) Genrated points positions as vector and 
         corresponding cluster ids as label vector
         """
+        rng = np.random if rng is None else rng
 
-        ranges = np.array([bounds[1] - bounds[0],bounds[3] - bounds[2]])
-        starts = np.array([bounds[0],bounds[2]])
-        
-        partition = (0.1 + np.abs(np.random.rand(numCluster,1))) / numCluster
-        factor = 1 / np.sum(partition)
-        #Percent of nodes per partition
-        partition = partition * factor
+        partition, clusterCenters = self.genClusterLayout(numCluster,bounds,rng)
+        pointsPerPartition = (partition[:,0] * numPoints).astype(int)
+        offsets = np.concatenate(([0],np.cumsum(pointsPerPartition)))
 
-        #Create Random Cluster centers in defined value range
-        clusterCenters = starts + np.random.rand(numCluster,2) * ranges
-
-        allpoints = None
-        allLabels = None
+        allpoints = np.zeros((offsets[-1],2))
+        allLabels = np.zeros(offsets[-1],dtype=int)
 
-        cnt = 0
-        for part, center in zip(partition,clusterCenters):
-            pointsPerPartition = int(part * numPoints)
+        for cnt in range(0,numCluster):
+            start = offsets[cnt]
+            end = offsets[cnt + 1]
 
             sprayangle = 1
 
             #Random angles from origin for each point of partition
-            angle = np.random.rand(pointsPerPartition,1)* sprayangle * 2 * math.pi
-            #print(angle)
+            angle = rng.random((end - start,1)) * sprayangle * 2 * math.pi
 
             #Length of displacement vectors based on windowSize
-            length = np.random.normal(size=(pointsPerPartition, 1)) * (windowSize/2)
-            #print(length)
+            length = rng.normal(size=(end - start,1)) * (windowSize/2)
 
-            normPoints = np.zeros((pointsPerPartition,2))
+            #Calculate displacement degree in each direction and point postitions
+            allpoints[start:end,0] = np.cos(angle)[:,0]
+            allpoints[start:end,1] = np.sin(angle)[:,0]
+            allpoints[start:end] = allpoints[start:end] * length + clusterCenters[cnt]
 
-            #Calculate displacement degree in each direction
-            normPoints[:,0] = np.cos(angle)[:,0]
-            normPoints[:,1] = np.sin(angle)[:,0]
+            allLabels[start:end] = cnt
 
-            #Calculate point postitions
-            points = normPoints * length + center
+        return allpoints, allLabels
 
-            labels = np.ones((pointsPerPartition)) * cnt
+    def genClusterLayout(self,numCluster,bounds,rng):
+        """Choose the share of nodes and the center of each cluster
 
-            if(allpoints is None):
-                allpoints = points
-                allLabels = labels
-            else:
-                allpoints = np.concatenate((allpoints, points), axis=0)
-                allLabels = np.concatenate((allLabels, labels), axis=0)
+        :param rng: (np.random.Generator) random number source (or the np.random module)
+        :return: partition np.array((numCluster,1)) share of the nodes of each cluster (sums up to 1), clusterCenters np.array((numCluster,2))
+        """
+        ranges = np.array([bounds[1] - bounds[0],bounds[3] - bounds[2]])
+        starts = np.array([bounds[0],bounds[2]])
 
-            cnt += 1
+        partition = (0.1 + np.abs(rng.random((numCluster,1)))) / numCluster
+        factor = 1 / np.sum(partition)
+        #Percent of nodes per partition
+        partition = partition * factor
 
-        #print(allpoints)
-        return allpoints, allLabels.astype(int)
+        #Create Random Cluster centers in defined value range
+        clusterCenters = starts + rng.random((numCluster,2)) * ranges
+        return partition, clusterCenters
 
-    def generateNetwork(self,nodeCnt,edgeCnt,xStart,xEnd,yStart,yEnd,closerSamplingIterations=30,clusterCenters=4):
+    def generateNetwork(self,nodeCnt,edgeCnt,xStart,xEnd,yStart,yEnd,closerSamplingIterations=30,clusterCenters=4,storePath=None,edgeModel="sampled",seed=None):
         """Generate Network with random nodes and connections with normal distribution node positions
 
         :param nodeCnt: (int) Amount of nodes to be generated
@@ -78,6 +77,10 @@ class NetworkGenerator:
         :param xStart,xEnd,yStart,yEnd: (int) Bounds of the data space for generation
         :param closerSamplingIterations: (int) Amount of other (possibly closer)edgeconnections to consider when selecting edge
         :param clusterCenters: (int) Amount of clusters centers to be generated
+        :param storePath: (str) directory to additionally write the network to as memory mapped GraphStore
+        :param edgeModel: (str) how edge end candidates are chosen, see genEdges
+        :param seed: (int) seed of a np.random.Generator used for all random draws, None to use the global np.random state
+        (see GenerationPipeline for generating large networks on several processes)
         :param bounds: (int[4]) [startx,endx,starty,endy] bounds of target data region in which the clusters are to be generated
 
         :return: nework ({"nodes":[],"edges":[],"nodeclusters":[]}) lists of nodes, edgeconnection indices and nodecluster ids
@@ -93,71 +96,322 @@ class NetworkGenerator:
 
         dataRect = {"x":xStart,"y":yStart,"w":xRange,"h":yRange}
 
-        nodePositions, network["nodeclusters"] = self.genClusterNodes(clusterCenters,nodeCnt,windowSize=500,bounds=[xStart,xEnd,yStart,yEnd])
+        rng = np.random if seed is None else np.random.default_rng(seed)
+        nodePositions, network["nodeclusters"] = self.genClusterNodes(clusterCenters,nodeCnt,windowSize=500,bounds=[xStart,xEnd,yStart,yEnd],rng=rng)
         network["nodeclusters"] = network["nodeclusters"].tolist()
 
-        for pos in nodePositions:
-            network["nodes"].append([int(pos[0]),int(pos[1])])
+        network["nodes"] = nodePositions.astype(int).tolist()
+
+        #Fewer nodes than requested may have been generated, keep the ratio of edges to nodes
+        edgeCnt = edgeCnt * nodePositions.shape[0] // max(nodeCnt,1)
+        edges = self.genEdges(nodePositions,edgeCnt,closerSamplingIterations,edgeModel,rng=rng)
+        network["edges"] = edges.tolist()
+
+        if(storePath is not None):
+            GraphStore.write(storePath,network["nodes"],network["edges"],network["nodeclusters"])
+
+        return network
+
+
+    def genEdges(self,nodePositions,edgeCnt,candidateCnt=30,edgeModel="sampled",chunkSize=10000,rng=None):
+        """Generate edges connecting each node to the closest of its candidate end nodes, for chunks of nodes at once.
+        An edge is not repeated in the opposite direction (unless a node has no other candidate).
 
+        :param nodePositions: np.array((nodes,2)) node positions
+        :param edgeCnt: (int) amount of edges, spread evenly over the nodes (at most candidateCnt edges per node)
+        :param candidateCnt: (int) amount of end node candidates per node
+        :param edgeModel: (str) "sampled": random candidates, mostly from nodes with close indices (nodes of the same cluster),
+        "knn": the candidateCnt nearest nodes (found with a spatial grid)
+        :param chunkSize: (int) amount of nodes processed at once
+        :param rng: (np.random.Generator) random number source, None for the global np.random state
+        :return: np.array((edges,2),dtype=int) start, end node indices, sorted by start node and then by end node distance
+        """
         nodeCnt = nodePositions.shape[0]
+        if(nodeCnt < 2 or edgeCnt <= 0):
+            return np.zeros((0,2),dtype=int)
+
+        nodeIndices = np.arange(nodeCnt)
+        nodeEdgeCnts = self.distributeEdges(nodeIndices,nodeCnt,edgeCnt,candidateCnt)
+        #End nodes of the edges of each node, -1 for unused slots
+        targets = np.full((nodeCnt,max(int(nodeEdgeCnts.max()),1)),-1,dtype=int)
+
+        if(edgeModel == "knn"):
+            nearestCandidates = self.findNearestCandidates(nodePositions,candidateCnt)
+
+        for start in range(0,nodeCnt,chunkSize):
+            chunkIndices = nodeIndices[start:start + chunkSize]
+            if(edgeModel == "knn"):
+                candidates = nearestCandidates[start:start + chunkSize]
+            else:
+                candidates = self.sampleCandidates(chunkIndices,nodeCnt,candidateCnt,rng)
+
+            rankedCandidates = self.rankCandidates(nodePositions,chunkIndices,candidates)
+            self.selectEdgeTargets(rankedCandidates,chunkIndices,nodeEdgeCnts[chunkIndices],targets)
 
-        edgesCnt = 0
+        startIndices = np.repeat(nodeIndices,targets.shape[1])
+        endIndices = targets.ravel()
+        return np.stack((startIndices,endIndices),axis=1)[endIndices >= 0]
 
-        connectedNodesIndexes = np.ones(nodeCnt) * (-1)
-        selEnds = np.zeros(closerSamplingIterations)
-        endindex = 0
+    def distributeEdges(self,nodeIndices,nodeCnt,edgeCnt,candidateCnt):
+        """Spread edgeCnt edges evenly over nodeCnt nodes
+
+        :param nodeIndices: np.array((nodes),dtype=int) indices of the nodes to get the amount of edges for
+        :return: np.array((nodes),dtype=int) amount of edges starting at each node (at most candidateCnt)
+        """
+        return np.minimum((nodeIndices + 1) * edgeCnt // nodeCnt - nodeIndices * edgeCnt // nodeCnt,candidateCnt)
+
+    def sampleCandidates(self,chunkIndices,nodeCnt,candidateCnt,rng=None):
+        """Draw random end node candidates, nodes with a low index draw mostly from nodes with a higher index and vice versa
+
+        :param chunkIndices: np.array((chunk),dtype=int) indices of the nodes to draw candidates for
+        :param rng: (np.random.Generator) random number source, None for the global np.random state
+        :return: np.array((chunk,candidateCnt),dtype=int) candidate end node indices
+        """
+        rng = np.random if rng is None else rng
         numbers = nodeCnt - 1
-        for i in range(0,nodeCnt):
-            leftprob = i/numbers
-            #rightprob = (numbers - i)/numbers
-            #roll = abs(random.random()) * 0.9999999
-            rolls = np.random.rand(closerSamplingIterations) * 0.9999999
-
-            leftvalues = (np.abs(np.random.rand(closerSamplingIterations)) * (i-1)).astype(int)
-            rightvalues = ((i+1) + np.abs(np.random.rand(closerSamplingIterations) * (numbers - i))).astype(int)
-            selEnds = np.where(rolls < leftprob, leftvalues, rightvalues)
-
-            powermat = np.power(nodePositions[selEnds] - nodePositions[i],2)
-            #print(powermat)
-            summat = np.sum(powermat,axis=1)
-            #print(summat)
-            lengths = np.sqrt(summat)
-            #minIndex = np.argmin(lengths)
-            minIndex = np.argsort(lengths)
-            #print(minIndex)
-            #print("REAL: " + str(np.argmin(lengths)))
-            selectedIndex = selEnds[minIndex[0]]
-            selMinIndex = 1
-            while connectedNodesIndexes[selectedIndex] == i and selMinIndex < minIndex.shape[0]:
-                #print("Selecting other")
-                selectedIndex = selEnds[minIndex[selMinIndex]]
-                selMinIndex += 1
-
-            #VERY low likelyhood of happening if closerAmount = 10 (so multiedges allowed in rare cases)
-            #if(selMinIndex == minIndex.shape[0]):
-            #    print("Out of candidates")
-
-            connectedNodesIndexes[selectedIndex] = i
-            connectedNodesIndexes[i] = selectedIndex
-
-            #print(selEnds)
-
-            network["edges"].append([i,int(selectedIndex)])
+        nodeIndices = chunkIndices[:,None]
+        #Same random stream as drawing rolls, left and right values for one node after the other
+        draws = rng.random((chunkIndices.shape[0],3,candidateCnt))
 
-        return network
+        leftprob = nodeIndices / numbers
+        rolls = draws[:,0] * 0.9999999
+        leftvalues = (np.abs(draws[:,1]) * (nodeIndices - 1)).astype(int)
+        rightvalues = ((nodeIndices + 1) + np.abs(draws[:,2] * (numbers - nodeIndices))).astype(int)
+        return np.where(rolls < leftprob,leftvalues,rightvalues)
+
+    def rankCandidates(self,nodePositions,chunkIndices,candidates):
+        """Order the end node candidates of each node by their distance to it
+
+        :param candidates: np.array((chunk,candidateCnt),dtype=int) candidate end nodes, -1 for none (ranked last)
+        :return: np.array((chunk,candidateCnt),dtype=int) candidates from the closest to the farthest
+        """
+        differences = nodePositions[candidates] - nodePositions[chunkIndices,None]
+        lengths = np.sqrt(np.sum(differences * differences,axis=2))
+        lengths[candidates < 0] = np.inf
+        return np.take_along_axis(candidates,np.argsort(lengths,axis=1),axis=1)
 
+    def findNearestCandidates(self,nodePositions,candidateCnt,chunkSize=10000):
+        """Find the candidateCnt nearest nodes of each node with a spatial grid. The search radius of a node starts
+        at the radius expected to hold candidateCnt nodes at the density around it and doubles while there are too few
+        nodes in range.
+
+        :return: np.array((nodes,candidateCnt),dtype=int) indices of the nearest nodes, -1 if there are not enough nodes
+        """
+        nodeCnt = nodePositions.shape[0]
+        candidates = np.full((nodeCnt,candidateCnt),-1,dtype=int)
+
+        extent = np.ptp(nodePositions,axis=0)
+        maxDistance = np.linalg.norm(extent)
+        #Local density from the cell of each node, of cells holding about candidateCnt nodes on average
+        cellSize = max(float(np.sqrt(max(extent[0] * extent[1],1e-9) * candidateCnt / nodeCnt)),1e-6)
+        cells = np.floor((nodePositions - nodePositions.min(axis=0)) / cellSize).astype(np.int64)
+        _, cellIndices, cellCounts = np.unique(cells,axis=0,return_inverse=True,return_counts=True)
+        nodeCellCounts = cellCounts[cellIndices.ravel()]
+        radius = max(float(np.sqrt(candidateCnt / np.pi / nodeCellCounts.max())) * cellSize,1e-6)
+        #Doublings of the smallest radius at which the search of each node starts
+        startLevels = np.floor(np.log2(nodeCellCounts.max() / nodeCellCounts) / 2).astype(int)
+
+        remaining = np.arange(nodeCnt)
+        level = 0
+        while(remaining.shape[0] > 0):
+            #Cells of half the radius, so the 5x5 cells around a node that are searched cover little more than the radius
+            grid = SpatialGrid(nodePositions,radius / 2)
+            searching = remaining[startLevels[remaining] <= level]
+            for start in range(0,searching.shape[0],chunkSize):
+                queryIndices = searching[start:start + chunkSize]
+                pairs = grid.findPairsWithin(radius,queryIndices)
+                left = pairs[:,0]
+                right = pairs[:,1]
+                #All nodes are in range once the radius exceeds the extent
+                complete = np.zeros(nodeCnt,dtype=bool)
+                complete[queryIndices] = (np.bincount(left,minlength=nodeCnt)[queryIndices] >= candidateCnt) | (radius > maxDistance)
+
+                lengths = np.linalg.norm(nodePositions[right] - nodePositions[left],axis=1)
+                #Pairs are closer than radius, so the length fraction orders the pairs of each node
+                order = np.argsort(left + lengths / (2 * radius))
+                left = left[order]
+                right = right[order]
+                ranks = np.arange(left.shape[0]) - np.searchsorted(left,left,side='left')
+                keep = complete[left] & (ranks < candidateCnt)
+                candidates[left[keep],ranks[keep]] = right[keep]
+
+            remaining = remaining[candidates[remaining,-1] < 0]
+            if(radius > maxDistance):
+                break
+            radius *= 2
+            level += 1
+
+        return candidates
+
+    def selectEdgeTargets(self,rankedCandidates,chunkIndices,nodeEdgeCnts,targets,targetsStart=0):
+        """Select the end nodes of a chunk of nodes: the first candidates by rank that are no duplicate and have no edge
+        to the node yet. As nodes only avoid edges of nodes with lower indices, the selection of a chunk is repeated
+        until it no longer changes.
+
+        :param rankedCandidates: np.array((chunk,candidates),dtype=int) candidate end nodes ordered by preference, -1 for none
+        :param chunkIndices: np.array((chunk),dtype=int) indices of the nodes of the chunk
+        :param nodeEdgeCnts: np.array((chunk),dtype=int) amount of edges of each node
+        :param targets: np.array((nodes,edgesPerNode),dtype=int) end nodes of all nodes (-1 for none), filled for the chunk
+        :param targetsStart: (int) node index of the first row of targets, edges of nodes without a row are not avoided
+        """
+        nodeIndices = chunkIndices[:,None]
+        #Candidates ranked higher before, next to each other when sorted by node index (stable keeps the rank order)
+        order = np.argsort(rankedCandidates,axis=1,kind='stable')
+        sortedCandidates = np.take_along_axis(rankedCandidates,order,axis=1)
+        duplicate = np.zeros(rankedCandidates.shape,dtype=bool)
+        np.put_along_axis(duplicate,order[:,1:],sortedCandidates[:,1:] == sortedCandidates[:,:-1],axis=1)
+        valid = (rankedCandidates >= 0) & (rankedCandidates != nodeIndices) & ~duplicate
+        candidateRows = rankedCandidates - targetsStart
+        hasRow = (candidateRows >= 0) & (candidateRows < targets.shape[0])
+        #Candidates with lower indices may already have an edge to the node
+        earlier = valid & hasRow & (rankedCandidates < nodeIndices)
+        candidateRows[~hasRow] = 0
+
+        chunkStart = chunkIndices[0] - targetsStart
+        chunkEnd = chunkStart + chunkIndices.shape[0]
+        for iteration in range(0,chunkIndices.shape[0] + 1):
+            repeated = earlier & np.any(targets[candidateRows] == nodeIndices[:,:,None],axis=2)
+            usable = valid & ~repeated
+            usableRanks = np.cumsum(usable,axis=1)
+            rows, columns = np.nonzero(usable & (usableRanks <= nodeEdgeCnts[:,None]))
+
+            chunkTargets = np.full((chunkIndices.shape[0],targets.shape[1]),-1,dtype=int)
+            chunkTargets[rows,usableRanks[rows,columns] - 1] = rankedCandidates[rows,columns]
+            #Without other candidates, connect to the last candidate even if the edge exists (rare)
+            noTarget = (nodeEdgeCnts > 0) & (chunkTargets[:,0] < 0)
+            chunkTargets[noTarget,0] = rankedCandidates[noTarget,-1]
+
+            if(np.array_equal(chunkTargets,targets[chunkStart:chunkEnd])):
+                break
+            targets[chunkStart:chunkEnd] = chunkTargets
 
     def readDatasetToNP(self,name):
-        
+        """Read the edges and nodes of a dataset in the data folder. Files are parsed once and afterwards loaded
+        from a binary cache next to them (see readCachedColumns).
+
+        :param name: (str) dataset name, files are read from data/<name>_edges.txt and data/<name>_nodes.txt
+        :return: edgesNp np.array((edges,2),dtype=int) ids of connected nodes, nodesNp np.array((nodes,3)) id, x, y of the nodes
+        """
         dirname = os.path.dirname(__file__)
         dirPath = "data"
         edgesPath  = os.path.join(dirname,dirPath,name + "_edges.txt")
         nodesPath  = os.path.join(dirname,dirPath,name + "_nodes.txt")
 
+        edgesNp = self.readCachedColumns(edgesPath,self.parseEdges)
+        #np.random.shuffle(edgesNp)
+        #print(edgesNp)
+        #edgesSlice = edgesNp[0:100]
+        #print(edgesSlice)
+
+        nodesNp = self.readCachedColumns(nodesPath,self.parseNodes)
+        #nodeSlice = nodesNp[0:100]
+        #print(nodeSlice)
+        return edgesNp, nodesNp
+
+    def readDatasetToStore(self,name):
+        """Open the memory mapped GraphStore of a dataset in data/<name>_graph, (re)written from the dataset files
+        if missing or older than them (see indexDataset).
+
+        :param name: (str) dataset name (see readDatasetToNP)
+        :return: GraphStore of the dataset
+        """
+        dirname = os.path.dirname(__file__)
+        dirPath = "data"
+        storePath = os.path.join(dirname,dirPath,name + "_graph")
+        sourcePaths = [os.path.join(dirname,dirPath,name + "_edges.txt"),os.path.join(dirname,dirPath,name + "_nodes.txt")]
+
+        storeFile = os.path.join(storePath,GraphStore.arrayFiles["edgeSources"])
+        if(os.path.exists(storeFile) and all(os.path.getmtime(storeFile) >= os.path.getmtime(path) for path in sourcePaths)):
+            return GraphStore.open(storePath)
+
+        edgesNp, nodesNp = self.readDatasetToNP(name)
+        return self.indexDataset(edgesNp,nodesNp,storePath)
+
+    def readCachedColumns(self,path,parse):
+        """Load the array of a text file from its .npz cache, or parse the text file and (re)create the cache
+        if the cache is missing or stale (the size or modification time of the text file changed)
+
+        :param path: (str) path of the text file
+        :param parse: (path)=>np.array function parsing the text file
+        :return: parsed array
+        """
+        cachePath = os.path.splitext(path)[0] + ".npz"
+        sourceStat = os.stat(path)
+        sourceKey = np.array([sourceStat.st_size,sourceStat.st_mtime_ns],dtype=np.int64)
+
+        if(os.path.exists(cachePath)):
+            with np.load(cachePath) as cache:
+                if(np.array_equal(cache["sourceKey"],sourceKey)):
+                    return cache["data"]
+
+        data = parse(path)
+        self.writeColumnsCache(cachePath,data,sourceKey)
+        return data
+
+    def writeColumnsCache(self,cachePath,data,sourceKey):
+        """Write the cache of a parsed text file (see readCachedColumns)
+
+        :param cachePath: (str) path of the .npz cache
+        :param data: np.array parsed content of the text file
+        :param sourceKey: np.array([size,mtime_ns]) of the text file the data was parsed from
+        """
+        #Write to a temporary file first, so readers never see a partially written cache
+        tempPath = cachePath + ".tmp.npz"
+        try:
+            np.savez(tempPath,data=data,sourceKey=sourceKey)
+            os.replace(tempPath,cachePath)
+        except OSError:
+            #Not writable, parse again on the next load
+            pass
+
+    def parseColumns(self,path):
+        """Parse a text file of tab or space separated numbers at once
+
+        :param path: (str) path of the text file
+        :return: np.array((rows,columns),dtype=float) or None if the rows do not all have the same amount of numeric columns
+        """
+        with open(path, 'r') as textFile:
+            text = textFile.read()
+
+        #Empty lines are skipped
+        columnCnts = np.array([len(line.split()) for line in text.splitlines()],dtype=int)
+        columnCnts = columnCnts[columnCnts > 0]
+        if(columnCnts.shape[0] == 0 or np.any(columnCnts != columnCnts[0])):
+            return None
+
+        try:
+            return np.array(text.split(),dtype=float).reshape((columnCnts.shape[0],columnCnts[0]))
+        except ValueError:
+            return None
+
+    def parseEdges(self,path):
+        """Parse an edges file with one "startid endid" line per edge
+
+        :return: np.array((edges,2),dtype=int)
+        """
+        columns = self.parseColumns(path)
+        if(columns is None or columns.shape[1] < 2):
+            return self.parseEdgesLines(path)
+        return columns[:,0:2].astype(int)
+
+    def parseNodes(self,path):
+        """Parse a nodes file with one "id x y" or "id _ x y" line per node
+
+        :return: np.array((nodes,3)) id, x, y of the nodes
+        """
+        columns = self.parseColumns(path)
+        if(columns is None or columns.shape[1] < 3):
+            return self.parseNodesLines(path)
+        if(columns.shape[1] > 3):
+            return columns[:,[0,2,3]]
+        return columns
+
+    def parseEdgesLines(self,path):
+        """Parse an edges file line by line (see parseEdges), for files with irregular lines"""
         edgesToRead = -1
         edgeList = []
         #edgesNp = np.array([])
-        with open(edgesPath, 'r') as edgesFile:
+        with open(path, 'r') as edgesFile:
 
             line = edgesFile.readline()
             edgecnt = 1
@@ -171,16 +425,14 @@ class NetworkGenerator:
                 line = edgesFile.readline()
                 edgecnt += 1
 
-        edgesNp = np.asarray(edgeList)
-        #np.random.shuffle(edgesNp)
-        #print(edgesNp)
-        #edgesSlice = edgesNp[0:100]
-        #print(edgesSlice)
+        return np.asarray(edgeList)
 
+    def parseNodesLines(self,path):
+        """Parse a nodes file line by line (see parseNodes), for files with irregular lines"""
         nodesToRead = -1
         nodesList = []
         #nodesNp = np.array([])
-        with open(nodesPath, 'r') as nodesFile:
+        with open(path, 'r') as nodesFile:
 
             line = nodesFile.readline()
             nodecnt = 1
@@ -201,10 +453,7 @@ class NetworkGenerator:
                 line = nodesFile.readline()
                 nodecnt += 1
 
-        nodesNp = np.asarray(nodesList)
-        #nodeSlice = nodesNp[0:100]
-        #print(nodeSlice)
-        return edgesNp, nodesNp
+        return np.asarray(nodesList)
 
     def firstLoginAsNode(self,nodesNp):
 
@@ -220,55 +469,56 @@ class NetworkGenerator:
 
         return np.asarray(newNodesList)
 
-    def selectNetRecursive(self,startEdges,newEdges,origEdges,connsCnt,maxNodes):
-        if(len(newEdges) >= maxNodes):
-            return
-
-        for edge in startEdges:
-            newEdges.append(edge)
-            if(len(newEdges) >= maxNodes):
-                return
-
-            selEdgeRows = origEdges[origEdges[:,0] == edge[0]]
-            newStartEdges = selEdgeRows[0:connsCnt]
-            self.selectNetRecursive(newStartEdges,newEdges,origEdges,connsCnt,maxNodes)
-            #print(selEdgeRows)
-
-
-    def extractSubnet(self,edgesNp,nodesNp):
-        np.random.shuffle(edgesNp)
-
-        startPointCnt = 4
-        maxConnectionsPerNode = 4
-        maxNodes = 40
-
-        newEdges = []
-        startEdges = edgesNp[0:startPointCnt]
-        edgesNp = edgesNp[startPointCnt:]
-        print(len(startEdges))
-        self.selectNetRecursive(startEdges,newEdges,edgesNp,maxConnectionsPerNode,maxNodes)
-        print(newEdges)
-        print(len(newEdges))
-
-    def extractSubnet2(self,edgesNp,nodesNp):
-        np.random.shuffle(nodesNp)
-        startNodes = nodesNp[0:5]
-
-        newNodes = []
-        newEdges = []
-        #for i in range(0,3):
-        for node in startNodes:
-            newNodes.append(node.tolist())
-            connections = edgesNp[edgesNp[:,0] == node[0]]
-            for edge in connections:
-                newEdges.append(edge.tolist())
-                endNode = nodesNp[nodesNp[:,0] == edge[1]]
-                newNodes.append(endNode.tolist())
+    def indexDataset(self,edgesNp,nodesNp,storePath=None):
+        """Build the GraphStore of a dataset (CSR adjacency index and node id lookup table), node ids of the dataset
+        are mapped to the row indices of nodesNp, edges to unknown ids are dropped
+
+        :param edgesNp: np.array((edges,2),dtype=int) ids of connected nodes (see readDatasetToNP)
+        :param nodesNp: np.array((nodes,3)) id, x, y of the nodes
+        :param storePath: (str) directory to write the store to, None to build it in memory
+        :return: GraphStore of the dataset
+        """
+        nodeIds = nodesNp[:,0].astype(np.int64)
+        idOrder = np.argsort(nodeIds,kind='stable')
+        sortedIds = nodeIds[idOrder]
+
+        edgesNp = np.asarray(edgesNp,dtype=np.int64).reshape((-1,2))
+        edgeIndices = np.minimum(np.searchsorted(sortedIds,edgesNp),max(sortedIds.shape[0] - 1,0))
+        knownEdges = np.all(sortedIds[edgeIndices] == edgesNp,axis=1)
+        edges = idOrder[edgeIndices[knownEdges]]
+
+        if(storePath is None):
+            return GraphStore.fromNetwork(nodesNp[:,1:3],edges,nodeIds=nodeIds)
+        return GraphStore.write(storePath,nodesNp[:,1:3],edges,nodeIds=nodeIds)
+
+    def extractSubnet(self,edgesNp,nodesNp,startCnt=4,hops=10,maxNodes=40,seed=None,datasetIndex=None):
+        """Sample a connected part of a dataset, by expanding breadth first along outgoing edges from random start nodes
+        (see GraphStore.expandHops)
+
+        :param edgesNp: np.array((edges,2),dtype=int) ids of connected nodes (see readDatasetToNP)
+        :param nodesNp: np.array((nodes,3)) id, x, y of the nodes
+        :param startCnt: (int) amount of random start nodes
+        :param hops: (int) max amount of edges between a start node and a selected node
+        :param maxNodes: (int) max amount of selected nodes, None for no limit
+        :param seed: (int) seed of the random start node selection
+        :param datasetIndex: GraphStore of the dataset (see indexDataset) to be reused between extractions, built if None
+        :return: newEdges np.array((edges,2),dtype=int) ids of connected selected nodes, newNodes np.array((nodes,3)) rows of the selected nodes
+        """
+        if(datasetIndex is None):
+            datasetIndex = self.indexDataset(edgesNp,nodesNp)
+
+        subnet = datasetIndex.sampleSubgraph(startCnt,hops,maxNodes,seed,incoming=False)
+        newNodes = nodesNp[subnet["nodeIndices"]]
+        newEdges = newNodes[:,0].astype(np.int64)[subnet["edges"]]
+        return newEdges, newNodes
+
+    def extractSubnet2(self,edgesNp,nodesNp,seed=None):
+        """Sample 5 random nodes and the end nodes of their edges (see extractSubnet)"""
+        newEdges, newNodes = self.extractSubnet(edgesNp,nodesNp,startCnt=5,hops=1,maxNodes=None,seed=seed)
 
         print("newNodes Length: " + str(len(newNodes)))
-        print(newNodes)
         print("newEdges Length: " + str(len(newEdges)))
-        print(newEdges)
+        return newEdges, newNodes
 
     def createNewDataset(self,name,edgesNp,nodesNp):
         
@@ -281,13 +531,15 @@ class NetworkGenerator:
         #print(nodesNp)
         self.extractSubnet2(edgesNp,nodesNp)
 
+        #Format whole columns converted to python numbers at once, repr writes the shortest float representation parsing back to the same value
+        edgeStarts = edgesNp[:,0].astype(int).tolist()
+        edgeEnds = edgesNp[:,1].astype(int).tolist()
         with open(edgesPath, 'w') as edgesFile:
-            for row in edgesNp:
-                edgesFile.write(str(int(row[0])) + " " + str(int(row[1])) + "\n")
+            edgesFile.write("".join(map("{} {}\n".format,edgeStarts,edgeEnds)))
 
+        nodeIds = nodesNp[:,0].astype(int).tolist()
         with open(nodesPath, 'w') as nodesFile:
-            for row in nodesNp:
-                nodesFile.write(str(int(row[0])) + " " + str(row[1]) + " " + str(row[2]) + "\n")
+            nodesFile.write("".join(map("{} {!r} {!r}\n".format,nodeIds,nodesNp[:,1].tolist(),nodesNp[:,2].tolist())))
 
     def readDataset(self):
 
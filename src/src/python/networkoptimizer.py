@@ -1,7 +1,15 @@
+import collections
 import numpy as np
+from spatialgrid import SpatialGrid, BoxGrid, expandRanges
+from phaseprofiler import PhaseProfiler, profiledPhase
 
 class NetworkOptimizer:
     """ Optimizes network positions using custom gradient descent"""
+
+    #Initial step size of the gradient solvers if learningRate is None: momentum steps are scaled by the loss gradient,
+    #Adam steps by about one pixel per coordinate
+    defaultLearningRates = {"momentum": 0.05,"adam": 1.0}
+
     def __init__(self):
         """Sets default variable settings"""
         self.gradFactor = 2.0
@@ -17,7 +25,53 @@ class NetworkOptimizer:
         self.structuralweight = 1.0
         self.readabilityweight = 3.0
         self.lossThreshold = 1
+        #Float type of the positions, gradients and losses (np.float32 halves memory and bandwidth on large networks,
+        #np.float64 for validation)
+        self.dtype = np.float64
+        #Reuse workspace buffers allocated in initOptimization, step then returns a view instead of a list
+        self.reuseStepBuffers = False
+
+        #Step rule: "heuristic" (move each coordinate by a velocity and flip its direction if its loss increased, see updateVelocity),
+        #"momentum" or "adam" (descend along the analytic gradient of the total loss with a backtracking line search, see gradientStep)
+        self.solver = "heuristic"
+        #Initial step size of the gradient solvers, None for the default of the solver
+        self.learningRate = None
+        self.momentum = 0.9
+        self.adamBeta1 = 0.9
+        self.adamBeta2 = 0.999
+        self.adamEpsilon = 1e-8
+        #Max halvings of the step size until the loss decreases, growth of the step size after each accepted step
+        self.lineSearchSteps = 8
+        self.stepSizeGrowth = 1.2
         self.network = None
+        #Edges the node to edge adjacency was built for
+        self.adjacencyEdges = None
+        #Nodes kept at their start position (see initActiveSetOptimization)
+        self.frozenNodeIndices = None
+
+        #Convergence detection of optimize
+        self.minSteps = 20
+        self.maxSteps = 400
+        self.convergenceWindow = 25
+        #Stop if the best total loss improved less than this fraction during the last convergenceWindow steps
+        self.minLossImprovement = 0.01
+        #Stop if less than this fraction of node coordinates is still moving
+        self.minActiveFraction = 0.05
+
+        #Continue from the last solution, gradients and velocities if initOptimization is called again for the same
+        #network with a lens that changed by at most warmStartTolerance (focal point shift and radius change relative
+        #to the radius, magnification change relative to the magnification)
+        self.warmStartEnabled = False
+        self.warmStartTolerance = 0.1
+        #Convergence detection of warm started optimizations, which start close to their optimum
+        self.warmStartMinSteps = 5
+        self.warmStartWindow = 5
+        self.warmStarted = False
+        #Lens and settings of the last initOptimization
+        self.lastLens = None
+
+        #Per phase timings and counters of the steps, disabled by default
+        self.profiler = PhaseProfiler()
 
     def initOptimization(self,network,focalPoint,radius):
         """Initializes optimization variables and initial gradient states, initial node positions and initial edge connections
@@ -28,14 +82,19 @@ class NetworkOptimizer:
         :param focalPoint: [int,int] focal point of target fisheye distortion
         :param radius: (int) radius of fisheye distortion boundary
         """
+        if(self.canWarmStart(network,focalPoint,radius)):
+            self.warmStart(focalPoint,radius)
+            return
+        self.warmStarted = False
 
         self.radius = radius
         self.focalPoint = focalPoint
+        self.frozenNodeIndices = None
 
-        self.fisheyePositions = self.calcFisheyePositions(network["nodes"],self.focalPoint,self.radius)
+        self.fisheyePositions = self.calcFisheyePositions(network["nodes"],self.focalPoint,self.radius).astype(self.dtype,copy=False)
         #print(self.fisheyePositions)
 
-        self.nodes = np.asarray(network["nodes"])
+        self.nodes = np.asarray(network["nodes"],dtype=self.dtype)
         self.edgeConns = np.asarray(network["edges"])
 
         self.edgesCnt = self.edgeConns.shape[0]
@@ -44,48 +103,59 @@ class NetworkOptimizer:
         # -------- Variable Initializations
         self.grad = (np.random.randint(0,2,size=(self.nodeCnt,2)) * 2) - 1
         #gradient direcations and initial values
-        self.grad = self.grad * self.gradFactor
+        self.grad = (self.grad * self.gradFactor).astype(self.dtype)
         #Gradient momentum
-        self.gradvelocity = np.ones((self.nodeCnt,2))
+        self.gradvelocity = np.ones((self.nodeCnt,2),dtype=self.dtype)
 
         #Terms to be minimized at node level
-        self.nodeLoss = np.zeros((self.nodeCnt,2))
+        self.nodeLoss = np.zeros((self.nodeCnt,2),dtype=self.dtype)
 
         #Edge connection Positions of original layout
-        self.origLConnPositions = np.zeros((self.edgesCnt,2))
-        self.origRConnPositions = np.zeros((self.edgesCnt,2))
+        self.origLConnPositions = np.zeros((self.edgesCnt,2),dtype=self.dtype)
+        self.origRConnPositions = np.zeros((self.edgesCnt,2),dtype=self.dtype)
 
         #Edge connection Positions before and after performing an optimization step
-        self.lastConnPositions = [np.zeros((self.edgesCnt,2)),np.zeros((self.edgesCnt,2))]
-        self.lastNodePositions = np.zeros((self.nodeCnt,2))
-        self.newNodePositions = np.zeros((self.nodeCnt,2))
+        self.lastConnPositions = [np.zeros((self.edgesCnt,2),dtype=self.dtype),np.zeros((self.edgesCnt,2),dtype=self.dtype)]
+        self.lastNodePositions = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+        self.newNodePositions = np.zeros((self.nodeCnt,2),dtype=self.dtype)
 
         #Edge connection Positions of the fisheye target layout
-        self.lFisheyeConnPositions = np.zeros((self.edgesCnt,2))
-        self.rFisheyeConnPositions = np.zeros((self.edgesCnt,2))
+        self.lFisheyeConnPositions = np.zeros((self.edgesCnt,2),dtype=self.dtype)
+        self.rFisheyeConnPositions = np.zeros((self.edgesCnt,2),dtype=self.dtype)
         # -----------------------------------------------
 
         # -------- Setting initial Values
-        cnt = 0
-        for edge in self.edgeConns:
-            startNodeId = int(edge[0])
-            startNode = self.nodes[startNodeId]
-            self.origLConnPositions[cnt,:] = startNode
-            self.lFisheyeConnPositions[cnt,:] = self.fisheyePositions[startNodeId]
-            cnt += 1
-
-        cnt = 0
-        for edge in self.edgeConns:
-            endNodeId = int(edge[1])
-            endNode = self.nodes[endNodeId]
-            self.origRConnPositions[cnt,:] = endNode
-            self.rFisheyeConnPositions[cnt,:] = self.fisheyePositions[endNodeId]
-            cnt += 1
+        #Node/edge incidence: index of the node each edge loss is summed onto and of the node at its other end
+        self.edgeStartIndices = self.edgeConns[:,0].astype(np.intp)
+        self.edgeEndIndices = self.edgeConns[:,1].astype(np.intp)
+        if(self.adjacencyEdges is not network["edges"] or self.nodeEdgeOffsets.shape[0] != self.nodeCnt + 1):
+            self.buildAdjacency()
+            self.adjacencyEdges = network["edges"]
+
+        #Focal region is rebuilt from scratch at the first extraction
+        self.stepCnt = 0
+        self.focalStateStep = -1
+
+        #State of the gradient solvers, allocated by their first step
+        self.lossGradient = None
+        self.gradMoment = None
+        self.gradSquareMoment = None
+        self.adamStepCnt = 0
+        self.stepSize = None
+
+        self.lossHistory = []
+        self.nodeLossHistory = collections.deque(maxlen=self.convergenceWindow + 1)
+
+        self.getEdgeConnPositions(self.nodes,self.edgeConns,out=[self.origLConnPositions,self.origRConnPositions])
+        self.getEdgeConnPositions(self.fisheyePositions,self.edgeConns,out=[self.lFisheyeConnPositions,self.rFisheyeConnPositions])
 
         self.network = network
 
         self.origOrientations,_ = self.calcOrientations(self.origLConnPositions,self.origRConnPositions)
 
+        if(self.reuseStepBuffers):
+            self.allocateStepBuffers()
+
         self.lastConnPositions[0] = self.origLConnPositions
         self.lastConnPositions[1] = self.origRConnPositions
         self.lastNodePositions = self.nodes
@@ -96,8 +166,74 @@ class NetworkOptimizer:
             self.lastConnPositions[1] = self.rFisheyeConnPositions
             self.lastNodePositions = self.fisheyePositions
 
+        self.lastLens = self.getLensState(focalPoint,radius)
         # -----------------------------------------------
 
+    def getLensState(self,focalPoint,radius):
+        """Get the lens and the settings a warm start depends on"""
+        return (np.array(focalPoint,dtype=float),float(radius),float(self.magnificationFactor),np.dtype(self.dtype),self.reuseStepBuffers)
+
+    def canWarmStart(self,network,focalPoint,radius):
+        """Check if initOptimization can continue the last optimization: warm starts are enabled, the network has
+        the same edges (array) and its nodes are the positions the last optimization ended at (e.g. its result sent
+        back as start layout), the settings are unchanged and the lens changed only slightly
+
+        :param network: {"nodes"=[],"edges"=[]} Network to be optimized
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        """
+        if(not self.warmStartEnabled or self.lastLens is None or self.network is None):
+            return False
+        if(network["edges"] is not self.network["edges"] or len(network["nodes"]) != self.nodeCnt):
+            return False
+        #Another layout (e.g. of a worker that optimized the session meanwhile or of an outdated request) starts over
+        if(not np.array_equal(np.asarray(network["nodes"]),self.lastNodePositions)):
+            return False
+
+        lastFocalPoint, lastRadius, lastMagnification, lastDtype, lastReuseStepBuffers = self.lastLens
+        if(lastDtype != np.dtype(self.dtype) or lastReuseStepBuffers != self.reuseStepBuffers or self.frozenNodeIndices is not None):
+            return False
+        focalShift = np.linalg.norm(np.asarray(focalPoint,dtype=float) - lastFocalPoint)
+        return (focalShift <= self.warmStartTolerance * lastRadius
+            and abs(radius - lastRadius) <= self.warmStartTolerance * lastRadius
+            and abs(self.magnificationFactor - lastMagnification) <= self.warmStartTolerance * lastMagnification)
+
+    def warmStart(self,focalPoint,radius):
+        """Move the fisheye targets to a new lens and keep the positions, gradients, velocities and losses of the last
+        optimization. The last losses were measured against the old targets, coordinates whose loss rises with the new
+        targets are sped up again by the next step.
+
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        """
+        self.radius = radius
+        self.focalPoint = focalPoint
+        self.warmStarted = True
+
+        #New arrays, the old targets might be the start positions (startAtFisheye)
+        self.fisheyePositions = self.calcFisheyePositions(self.nodes,focalPoint,radius).astype(self.dtype,copy=False)
+        self.lFisheyeConnPositions, self.rFisheyeConnPositions = self.getEdgeConnPositions(self.fisheyePositions,self.edgeConns)
+        self.fisheyeOrientations, self.fisheyeLengths = self.calcOrientations(self.lFisheyeConnPositions,self.rFisheyeConnPositions)
+
+        #The lens moved, rebuild the focal region at the next extraction
+        self.focalStateStep = None
+        #The step size shrinks to nothing once the old optimum is reached
+        self.lossGradient = None
+        self.stepSize = None
+        self.lossHistory = []
+        self.nodeLossHistory.clear()
+        self.lastLens = self.getLensState(focalPoint,radius)
+
+    def setStartPositions(self,nodePositions):
+        """Start the optimization initialized by initOptimization at other node positions than the original layout
+        (e.g. the displaced positions of a coarser level), the fisheye targets and original orientations stay unchanged
+
+        :param nodePositions: np.array((nodes,2)) positions the first step starts at
+        """
+        self.lastNodePositions = np.array(nodePositions,dtype=self.dtype)
+        self.lastConnPositions = self.getEdgeConnPositions(self.lastNodePositions,self.edgeConns)
+
+    @profiledPhase("crossingLoss")
     def calculateEdgeCrossLoss(self,stepLConnVec,stepRConnVec):
         """Detects edge crossings in focal area and increases node loss where there is a low angle between crossings.
         (edge1 counter-clockwise rotation, edge2 clockwise rotation)
@@ -106,55 +242,71 @@ class NetworkOptimizer:
         :param stepRConnVec: np.array((nodes,2)) Right hand side edgeconnection positions of step
         :return: edge losses at each crossing, indices to find edges in global context
         """
+        return self.calcCrossingEdgeLoss(stepLConnVec,stepRConnVec,self.focalEdgeIndices)
+
+    def calcCrossingEdgeLoss(self,stepLConnVec,stepRConnVec,focalEdgeIndices):
+        """Detects crossings among the given edges and calculates the loss of the crossing edges (see calcCrossingResiduals)
 
+        :param stepLConnVec: np.array((edges,2)) Left hand side edgeconnection positions of step
+        :param stepRConnVec: np.array((edges,2)) Right hand side edgeconnection positions of step
+        :param focalEdgeIndices: np.array((focaledges)) indices of the edges to be checked for crossings
+        :return: edge losses at each crossing, indices to find edges in global context
+        """
+        residuals, globalindices = self.calcCrossingResiduals(stepLConnVec,stepRConnVec,focalEdgeIndices)
+        return np.power(np.abs(residuals),2), globalindices
+
+    def getCrossingRotations(self,dtype):
+        """Get the rotations (row vector convention) of the target orientations of the first and the second edge of a crossing"""
+        alpha = np.pi/2
+        angle = (np.pi - alpha)/2
+        #rotationMat = np.array([[np.cos(angle),-np.sin(angle)],[np.sin(angle),np.cos(angle)]])
+        rotationMat = np.array([[np.cos(angle),-np.sin(angle)],[np.sin(angle),np.cos(angle)]],dtype=dtype)
+        counterRotMat = np.array([[np.cos(-angle),-np.sin(-angle)],[np.sin(-angle),np.cos(-angle)]],dtype=dtype)
+        return rotationMat, counterRotMat
+
+    def calcCrossingResiduals(self,stepLConnVec,stepRConnVec,focalEdgeIndices):
+        """Detects crossings between the given edges and calculates how far the crossing edges differ from their
+        orientations rotated apart (the loss is the square of the residuals)
+
+        :param stepLConnVec: np.array((edges,2)) Left hand side edgeconnection positions of step
+        :param stepRConnVec: np.array((edges,2)) Right hand side edgeconnection positions of step
+        :param focalEdgeIndices: np.array((focaledges)) indices of the edges to be checked for crossings
+        :return: np.array((2*crossings,2)) residuals of the first edges of all crossings followed by the second edges,
+        indices to find edges in global context
+        """
         #To Filter out connected edges
         minStartDistance = 0.05
         minEndDistance = 0.05
-        
-        directions = self.focalConnPositions[1] - self.focalConnPositions[0]
-
-        start2 = self.focalConnPositions[0]
-        dir2 = directions
-
-        #self.crossingsTable = np.zeros((directions.shape[0],directions.shape[0],2))
-        self.crossingsLookup = np.zeros((directions.shape[0],directions.shape[0]),dtype=bool)
-
-        inRangeStart = 0.0 + minStartDistance
-        inRangeEnd = 1.0 - minStartDistance
-
-        #iterations = 3
-        iterations = directions.shape[0]
-        for i in range(0,iterations):
 
-            start1 = self.focalConnPositions[0][i]
-            dir1 = directions[i]
+        focalStarts = stepLConnVec[focalEdgeIndices]
+        focalEnds = stepRConnVec[focalEdgeIndices]
 
-            dir12cross = np.cross(dir1,dir2)
+        #Only edges with overlapping bounding boxes can cross
+        crossingGrid = BoxGrid(np.minimum(focalStarts,focalEnds),np.maximum(focalStarts,focalEnds))
+        candidatePairs = crossingGrid.findOverlappingPairs()
 
-            start12cross = np.cross((start1 - start2),dir1)
+        start1 = focalStarts[candidatePairs[:,0]]
+        dir1 = focalEnds[candidatePairs[:,0]] - start1
+        start2 = focalStarts[candidatePairs[:,1]]
+        dir2 = focalEnds[candidatePairs[:,1]] - start2
 
-            np.seterr(divide='ignore', invalid='ignore')
-            u = dir12cross/start12cross
-            u = np.nan_to_num(u,-1000)
-            #print(u)
+        #Intersection parameters along both edges: start1 + t * dir1 == start2 + u * dir2
+        dir12cross = np.cross(dir1,dir2)
+        startDiff = start2 - start1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.cross(startDiff,dir2)/dir12cross
+            u = np.cross(startDiff,dir1)/dir12cross
 
-            incondition= (u >= inRangeStart) & (u <= inRangeEnd)
-            self.crossingsLookup[i,:] = incondition
+        incondition = (t >= minStartDistance) & (t <= 1.0 - minEndDistance) & (u >= minStartDistance) & (u <= 1.0 - minEndDistance)
+        crossingPairs = candidatePairs[incondition]
 
-        crossingsListIndices = np.argwhere(self.crossingsLookup)
+        leftEdges = focalEdgeIndices[crossingPairs[:,0]]
+        rightEdges = focalEdgeIndices[crossingPairs[:,1]]
 
-        globalEdgePairIndices = self.focalConnIndices[crossingsListIndices]
-        leftEdges = globalEdgePairIndices[:,0]
-        rightEdges = globalEdgePairIndices[:,1]
+        rotationMat, counterRotMat = self.getCrossingRotations(stepLConnVec.dtype)
 
-        alpha = np.pi/2
-        angle = (np.pi - alpha)/2
-        #rotationMat = np.array([[np.cos(angle),-np.sin(angle)],[np.sin(angle),np.cos(angle)]])
-        rotationMat = np.array([[np.cos(angle),-np.sin(angle)],[np.sin(angle),np.cos(angle)]])
-        counterRotMat = np.array([[np.cos(-angle),-np.sin(-angle)],[np.sin(-angle),np.cos(-angle)]])
-
-        leftCrossLConnPositions = stepLConnVec[leftEdges[:,0]]
-        leftCrossRConnPositions = stepLConnVec[leftEdges[:,1]]
+        leftCrossLConnPositions = stepLConnVec[leftEdges]
+        leftCrossRConnPositions = stepRConnVec[leftEdges]
         leftCrossOrientations, leftCrossLengths = self.calcOrientations(leftCrossLConnPositions,leftCrossRConnPositions)
         #print(leftCrossOrientations)
         #print(np.sin(angle) * leftCrossOrientations[0,0] + np.cos(angle) * leftCrossOrientations[0,1])
@@ -162,8 +314,8 @@ class NetworkOptimizer:
         leftCrossOrientations = np.matmul(leftCrossOrientations,rotationMat)
         #print(leftCrossOrientations)
 
-        rightCrossLConnPositions = stepLConnVec[rightEdges[:,0]]
-        rightCrossRConnPositions = stepLConnVec[rightEdges[:,1]]
+        rightCrossLConnPositions = stepLConnVec[rightEdges]
+        rightCrossRConnPositions = stepRConnVec[rightEdges]
         rightCrossOrientations, rightCrossLengths = self.calcOrientations(rightCrossLConnPositions,rightCrossRConnPositions)
         rightCrossOrientations = np.matmul(rightCrossOrientations,counterRotMat)
 
@@ -176,13 +328,14 @@ class NetworkOptimizer:
         #print(leftCrossLengths)
         lengths = np.concatenate((leftCrossLengths,rightCrossLengths))
 
-        globalindices = np.vstack((globalEdgePairIndices[:,0],globalEdgePairIndices[:,1]))
+        globalindices = np.vstack((self.edgeConns[leftEdges],self.edgeConns[rightEdges]))
         #print(lconns.shape)
         #print(rconns.shape)
         #print(orientations.shape)
         #print(lengths.shape)
-        return np.power(np.abs(lconns - rconns - orientations*lengths[:,None]),2), globalindices
+        return lconns - rconns - orientations*lengths[:,None], globalindices
 
+    @profiledPhase("overlapLoss")
     def calculateOverlapLoss(self,stepLConnVec,stepRConnVec):
         """Detects overlapping nodes in focal area and increases node loss if nodes are too close.
         Inserts virtual edge with minimum length to nudge nodes apart
@@ -191,16 +344,33 @@ class NetworkOptimizer:
         :param stepRConnVec: np.array((nodes,2)) Right hand side edgeconnection positions of step
         :return: edge losses at each node overlapping edge, indices to find edges in global context
         """
-        xm, xn = np.meshgrid(self.focalNodePositions[:,0], self.focalNodePositions[:,0])
-        ym, yn = np.meshgrid(self.focalNodePositions[:,1], self.focalNodePositions[:,1])
-        distanceMatrix = np.sqrt(np.power(xm - xn,2) + np.power(ym - yn,2)) + np.identity(self.focalNodePositions.shape[0])*100000
-        #print("distanceMatrix")
-        #print(distanceMatrix)
+        return self.calcOverlapEdgeLoss(self.newNodePositions,self.focalNodeIndices)
+
+    def calcOverlapEdgeLoss(self,nodePositions,focalNodeIndices):
+        """Detects overlapping nodes among the given nodes and calculates the loss of virtual edges nudging them apart
+
+        :param nodePositions: np.array((nodes,2)) node positions of step
+        :param focalNodeIndices: np.array((focalnodes)) indices of the nodes to be checked for overlaps
+        :return: edge losses at each node overlapping edge, indices to find edges in global context
+        """
+        residuals, globalOverlappingIndices = self.calcOverlapResiduals(nodePositions,focalNodeIndices)
+        return np.power(np.abs(residuals),2), globalOverlappingIndices
+
+    def calcOverlapResiduals(self,nodePositions,focalNodeIndices):
+        """Detects overlapping nodes among the given nodes and calculates how far the virtual edges between them
+        differ from the minimum distance (the loss is the square of the residuals)
+
+        :param nodePositions: np.array((nodes,2)) node positions of step
+        :param focalNodeIndices: np.array((focalnodes)) indices of the nodes to be checked for overlaps
+        :return: np.array((overlaps,2)) residuals of each node overlapping edge, indices to find edges in global context
+        """
         noderadius = 10
         mindistance = 10
 
-        focalOverlappingIndices = np.argwhere(distanceMatrix < noderadius)
-        globalOverlappingIndices = self.focalNodeIndices[focalOverlappingIndices]
+        #Only compare nodes in neighboring grid cells instead of building a full distance matrix
+        overlapGrid = SpatialGrid(nodePositions[focalNodeIndices],noderadius)
+        focalOverlappingIndices = overlapGrid.findPairsWithin(noderadius)
+        globalOverlappingIndices = focalNodeIndices[focalOverlappingIndices]
         #print("overlappingIndices")
         #print(overlappingIndices)
 
@@ -208,18 +378,17 @@ class NetworkOptimizer:
         #self.newNodePositions[globalOverlappingIndices[:,0]] = np.array([0,0])
         #self.newNodePositions[globalOverlappingIndices[:,1]] = np.array([0,0])
         
-        readLConnPositions = stepLConnVec[globalOverlappingIndices[:,0]]
-        readRConnPositions = stepLConnVec[globalOverlappingIndices[:,1]]
+        readLConnPositions = nodePositions[globalOverlappingIndices[:,0]]
+        readRConnPositions = nodePositions[globalOverlappingIndices[:,1]]
 
         readOrientations,_ = self.calcOrientations(readLConnPositions,readRConnPositions)
 
         #Nudges nodes to the other direction as long as they overlap
         length = noderadius + noderadius + mindistance
 
-        overLappingEdgeLoss = np.power(np.abs(readLConnPositions - readRConnPositions - readOrientations*length),2)
-
-        return overLappingEdgeLoss, globalOverlappingIndices
+        return readLConnPositions - readRConnPositions - readOrientations*length, globalOverlappingIndices
 
+    @profiledPhase("structuralLoss")
     def calculateStructuralLoss(self,stepLConnVec,stepRConnVec):
         """Incentivised the overall structure of the layout, by incentivising the edge orientations to follow the
         original layouts orientations, while letting the edge lengths follow the lengths of the 
@@ -233,6 +402,14 @@ class NetworkOptimizer:
         if(self.optimizeToFisheye):
             orientations = self.fisheyeOrientations
 
+        if(self.reuseStepBuffers):
+            structuralLoss = self.structuralLossBuffer
+            np.multiply(orientations,self.fisheyeLengths[:,None],out=self.structuralTargetBuffer)
+            np.subtract(stepLConnVec,stepRConnVec,out=structuralLoss)
+            np.subtract(structuralLoss,self.structuralTargetBuffer,out=structuralLoss)
+            np.square(structuralLoss,out=structuralLoss)
+            return structuralLoss, self.edgeConns
+
         return np.power(np.abs(stepLConnVec - stepRConnVec - orientations*self.fisheyeLengths[:,None]),2), self.edgeConns
     
     def calculateNodeLoss(self,stepLConnVec,stepRConnVec,rConnVecOriginal):
@@ -252,7 +429,7 @@ class NetworkOptimizer:
         #Calculate Loss at each node
         
         constaintEdgesLossResults = []
-        constaintEdgeConns = []
+        constaintEdgeStartIndices = []
 
         if(self.structuralConstraintsEnabled):
             rconnvec = stepRConnVec
@@ -261,34 +438,59 @@ class NetworkOptimizer:
             structureEdgeLoss, structureEdgeConns = self.calculateStructuralLoss(stepLConnVec,rconnvec)
             structureEdgeLoss *= self.structuralweight
             constaintEdgesLossResults.append(structureEdgeLoss)
-            constaintEdgeConns.append(structureEdgeConns)
+            constaintEdgeStartIndices.append(self.edgeStartIndices)
 
         if(self.overlapPreventionEnabled or self.crossingMaximEnabled):
             self.extractFocalEdges(stepLConnVec,stepRConnVec)
+            self.profiler.count("focalNodes",self.focalNodeIndices.shape[0])
+            self.profiler.count("focalEdges",self.focalEdgeIndices.shape[0])
 
         if(self.overlapPreventionEnabled):
             readEdgeLoss, readEdgeConns = self.calculateOverlapLoss(stepLConnVec,stepRConnVec)
             readEdgeLoss *= self.readabilityweight
             constaintEdgesLossResults.append(readEdgeLoss)
-            constaintEdgeConns.append(readEdgeConns)
+            constaintEdgeStartIndices.append(readEdgeConns[:,0])
+            self.profiler.count("overlaps",readEdgeConns.shape[0])
 
         if(self.crossingMaximEnabled):
             crossEdgeLoss, crossEdgeConns = self.calculateEdgeCrossLoss(stepLConnVec,stepRConnVec)
             constaintEdgesLossResults.append(crossEdgeLoss)
-            constaintEdgeConns.append(crossEdgeConns)
+            constaintEdgeStartIndices.append(crossEdgeConns[:,0])
+            self.profiler.count("crossings",crossEdgeConns.shape[0])
 
         #self.edgeLoss =  + self.readabilityweight * self.calculateReadAbilityLoss(stepLConnVec,stepRConnVec)
 
-        nodeLoss = np.zeros((self.nodeCnt,2))
         #Partial Summation term
-        for edgeLossRes, edgeConnsRes  in zip(constaintEdgesLossResults,constaintEdgeConns):
+        return self.accumulateNodeLoss(constaintEdgesLossResults,constaintEdgeStartIndices)
 
-            for i in range(0,edgeLossRes.shape[0]):
-                selEdge = int(edgeConnsRes[i][0])
-                nodeLoss[selEdge] += edgeLossRes[i]
+    @profiledPhase("summation")
+    def accumulateNodeLoss(self,edgeLossResults,edgeStartIndices,binCnt=None):
+        """Sums the edge losses of all constraint terms onto the start node of each edge in one fused reduction.
+        Losses are added in the same order as the terms are passed, so the result matches a sequential summation exactly.
 
+        :param edgeLossResults: [np.array((edges,2))] x, y losses of each constraint term
+        :param edgeStartIndices: [np.array((edges))] node index each loss row of the matching term is summed onto
+        :param binCnt: (int) amount of nodes to sum onto if not the nodes of the network (e.g. flattened lens batches)
+        :return: x,y loss at each node
+        """
+        if(binCnt is not None):
+            nodeLoss = np.zeros((binCnt,2),dtype=self.dtype)
+        elif(self.reuseStepBuffers):
+            nodeLoss = self.nodeLossBuffers[self.bufferSlot]
+            nodeLoss.fill(0)
+        else:
+            nodeLoss = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+        if(len(edgeLossResults) == 0):
+            return nodeLoss
+
+        edgeLoss = np.concatenate(edgeLossResults)
+        startIndices = np.concatenate(edgeStartIndices).astype(np.intp)
+
+        nodeLoss[:,0] = np.bincount(startIndices,weights=edgeLoss[:,0],minlength=nodeLoss.shape[0])
+        nodeLoss[:,1] = np.bincount(startIndices,weights=edgeLoss[:,1],minlength=nodeLoss.shape[0])
         return nodeLoss
     
+    @profiledPhase("step")
     def step(self):
         """ Perform a gradient descent step: \n
         1) Move last node positions by gradient * velocity value \n
@@ -296,9 +498,23 @@ class NetworkOptimizer:
         3) Update Velocity and gradient direction based on if loss increased or decreased \n
         4) Set last positions to updated positions \n
         5) Repeat until optimized
-        """
 
-        self.newNodePositions = self.lastNodePositions + self.grad * self.gradvelocity
+        :return: new node positions as list, or if reuseStepBuffers is enabled a view into the workspace buffers
+        which stays valid until the step after the next one
+        """
+        if(self.solver != "heuristic"):
+            return self.gradientStep()
+
+        self.stepCnt += 1
+
+        if(self.reuseStepBuffers):
+            #Alternate between the two workspace slots, so the last positions are not overwritten while being read
+            self.bufferSlot = 1 - self.bufferSlot
+            self.newNodePositions = self.nodePositionBuffers[self.bufferSlot]
+            np.multiply(self.grad,self.gradvelocity,out=self.gradStepBuffer)
+            np.add(self.lastNodePositions,self.gradStepBuffer,out=self.newNodePositions)
+        else:
+            self.newNodePositions = self.lastNodePositions + self.grad * self.gradvelocity
         #print("CURR Grad: ")
         #print(self.grad)
         #print("LASTPOS:")
@@ -307,7 +523,10 @@ class NetworkOptimizer:
         #print(self.newNodePositions)
 
         #lconnVec = []
-        updatedConnPositions = self.getEdgeConnPositions(self.newNodePositions,self.edgeConns)
+        connPositionBuffers = None
+        if(self.reuseStepBuffers):
+            connPositionBuffers = self.connPositionBuffers[self.bufferSlot]
+        updatedConnPositions = self.getEdgeConnPositions(self.newNodePositions,self.edgeConns,out=connPositionBuffers)
         #print(updatedConnPositions)
 
         #newLoss = self.calculateNodeLoss(updatedConnPositions[0],self.lastConnPositions[1],self.network["edges"])
@@ -320,21 +539,24 @@ class NetworkOptimizer:
 
         #print("LossDIFF")
         #print(newLoss - self.nodeLoss)
-        lossDiff = newLoss - self.nodeLoss
-
-        self.gradvelocity[lossDiff <= 0] *= self.velocityFactor
-        self.gradvelocity[lossDiff > 0] = 1.0
-
-        self.gradvelocity[newLoss < 400] = 0.6
-        self.gradvelocity[newLoss < 80] = 0.4
-        self.gradvelocity[newLoss < 40] = 0.2
-        self.gradvelocity[newLoss < self.lossThreshold] = 0
-
-
-        switchGrad = ((newLoss < self.nodeLoss).astype(int) *2) - 1
-        #print("switchGrad")
-        #print(switchGrad)
-        self.grad = self.grad * switchGrad#* 0.8
+        if(self.reuseStepBuffers):
+            lossDiff = np.subtract(newLoss,self.nodeLoss,out=self.lossDiffBuffer)
+        else:
+            lossDiff = newLoss - self.nodeLoss
+
+        self.updateVelocity(self.gradvelocity,lossDiff,newLoss)
+        if(self.frozenNodeIndices is not None):
+            self.gradvelocity[self.frozenNodeIndices] = 0
+
+
+        if(self.reuseStepBuffers):
+            #Flip gradient direction in place where the loss did not decrease
+            switchMask = np.less(newLoss,self.nodeLoss,out=self.lossMaskBuffer)
+            np.logical_not(switchMask,out=switchMask)
+            np.negative(self.grad,out=self.grad,where=switchMask)
+        else:
+            #Flip gradient direction where the loss did not decrease (keeps the float type of the gradient)
+            self.grad = np.where(newLoss < self.nodeLoss,self.grad,-self.grad)#* 0.8
         #print("NewGrad:")
         #print(self.grad)
 
@@ -344,21 +566,407 @@ class NetworkOptimizer:
         self.lastConnPositions[1] = updatedConnPositions[1]
         self.lastNodePositions = self.newNodePositions
 
+        if(self.reuseStepBuffers):
+            return self.newNodePositions
+
         return self.newNodePositions.tolist()
 
         ##network["nodes"] = out_node_positions.tolist()
 
+    def gradientStep(self):
+        """Perform a step along the analytic gradient of the total loss (see calculateLossGradient) with momentum or Adam.
+        The step size is halved until the total loss decreases and grows after each accepted step,
+        if no step size decreases the loss the positions are kept and the momentum is reset.
+
+        :return: new node positions (see step)
+        """
+        self.stepCnt += 1
+        nodePositions = self.lastNodePositions
+        if(self.lossGradient is None):
+            self.nodeLoss, self.lossGradient, _ = self.calculateLossGradient(nodePositions)
+        if(self.gradMoment is None):
+            self.gradMoment = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+            self.gradSquareMoment = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+        if(self.stepSize is None):
+            self.stepSize = self.learningRate if self.learningRate is not None else self.defaultLearningRates[self.solver]
+
+        gradient = self.lossGradient
+        if(self.solver == "momentum"):
+            self.gradMoment *= self.momentum
+            self.gradMoment += gradient
+            direction = self.gradMoment
+        elif(self.solver == "adam"):
+            self.adamStepCnt += 1
+            self.gradMoment *= self.adamBeta1
+            self.gradMoment += (1 - self.adamBeta1) * gradient
+            self.gradSquareMoment *= self.adamBeta2
+            self.gradSquareMoment += (1 - self.adamBeta2) * gradient * gradient
+            firstMoment = self.gradMoment / (1 - self.adamBeta1 ** self.adamStepCnt)
+            secondMoment = self.gradSquareMoment / (1 - self.adamBeta2 ** self.adamStepCnt)
+            direction = firstMoment / (np.sqrt(secondMoment) + self.adamEpsilon)
+        else:
+            raise ValueError("Unknown solver: " + str(self.solver))
+        if(self.frozenNodeIndices is not None):
+            direction[self.frozenNodeIndices] = 0
+
+        currentLoss = np.nansum(self.nodeLoss,dtype=np.float64)
+        for attempt in range(0,self.lineSearchSteps):
+            newNodePositions = nodePositions - self.stepSize * direction
+            newLoss, newGradient, connPositions = self.calculateLossGradient(newNodePositions)
+            if(np.nansum(newLoss,dtype=np.float64) < currentLoss):
+                self.stepSize *= self.stepSizeGrowth
+                break
+            self.stepSize *= 0.5
+        else:
+            #No step size decreased the loss, stay and restart the momentum
+            self.gradMoment.fill(0)
+            newNodePositions = nodePositions
+            self.newNodePositions = nodePositions
+            return newNodePositions if self.reuseStepBuffers else newNodePositions.tolist()
+
+        self.nodeLoss = newLoss
+        self.lossGradient = newGradient
+        self.lastConnPositions[0] = connPositions[0]
+        self.lastConnPositions[1] = connPositions[1]
+        self.lastNodePositions = newNodePositions
+
+        if(self.reuseStepBuffers):
+            return newNodePositions
+        return newNodePositions.tolist()
+
+    def calculateLossGradient(self,nodePositions):
+        """Calculate the loss at each node (see calculateNodeLoss) and the analytic gradient of the total loss.
+        Every loss term is the square of the residuals r of (virtual) edges with the edge vector d = p_start - p_end,
+        its gradient with respect to d is 2 * r * J^T with the Jacobian J of r: the identity for structural residuals
+        (constant targets), for overlap residuals (targets of fixed length along d) J^T * r = r as well and
+        for crossing residuals (targets of d rotated by M) J = I - M.
+
+        :param nodePositions: np.array((nodes,2)) positions to evaluate
+        :return: np.array((nodes,2)) x,y loss at each node, np.array((nodes,2)) gradient of the total loss,
+        [np.array((edges,2)),np.array((edges,2))] edge connection positions
+        """
+        self.newNodePositions = nodePositions
+        connPositions = self.getEdgeConnPositions(nodePositions,self.edgeConns)
+        stepLConnVec, stepRConnVec = connPositions
+
+        #Residuals, node index pairs, weight, gradient with respect to the edge vectors, gradient applies to the end nodes
+        terms = []
+        if(self.structuralConstraintsEnabled):
+            rconnvec = stepRConnVec
+            if(self.useOriginalAsLossRef):
+                rconnvec = self.origRConnPositions
+            orientations = self.origOrientations
+            if(self.optimizeToFisheye):
+                orientations = self.fisheyeOrientations
+            residuals = stepLConnVec - rconnvec - orientations*self.fisheyeLengths[:,None]
+            terms.append((residuals,self.edgeConns,self.structuralweight,2 * residuals,not self.useOriginalAsLossRef))
+
+        if(self.overlapPreventionEnabled or self.crossingMaximEnabled):
+            #Nodes moved by the step size instead of their velocities, the incremental update does not apply
+            self.focalStateStep = None
+            self.extractFocalEdges(stepLConnVec,stepRConnVec)
+
+        if(self.overlapPreventionEnabled):
+            residuals, overlappingIndices = self.calcOverlapResiduals(nodePositions,self.focalNodeIndices)
+            terms.append((residuals,overlappingIndices,self.readabilityweight,2 * residuals,True))
+
+        if(self.crossingMaximEnabled):
+            residuals, crossingIndices = self.calcCrossingResiduals(stepLConnVec,stepRConnVec,self.focalEdgeIndices)
+            rotationMat, counterRotMat = self.getCrossingRotations(residuals.dtype)
+            crossingCnt = residuals.shape[0] // 2
+            firstResiduals = residuals[:crossingCnt]
+            secondResiduals = residuals[crossingCnt:]
+            residualGradients = 2 * np.concatenate((firstResiduals - np.matmul(firstResiduals,rotationMat.T),secondResiduals - np.matmul(secondResiduals,counterRotMat.T)))
+            terms.append((residuals,crossingIndices,1.0,residualGradients,True))
+
+        nodeLoss = self.accumulateNodeLoss([np.power(np.abs(residuals),2) * weight for residuals, _, weight, _, _ in terms],
+            [indices[:,0] for _, indices, _, _, _ in terms],binCnt=self.nodeCnt)
+
+        gradient = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+        for _, indices, weight, residualGradients, endMoves in terms:
+            residualGradients = residualGradients * weight
+            #Zero length edges and coincident nodes have undefined orientations
+            residualGradients[~np.isfinite(residualGradients)] = 0
+            startIndices = indices[:,0].astype(np.intp)
+            endIndices = indices[:,1].astype(np.intp)
+            for axis in range(0,2):
+                gradient[:,axis] += np.bincount(startIndices,weights=residualGradients[:,axis],minlength=self.nodeCnt)
+                if(endMoves):
+                    gradient[:,axis] -= np.bincount(endIndices,weights=residualGradients[:,axis],minlength=self.nodeCnt)
+        return nodeLoss, gradient, connPositions
+
+    def initWindowOptimization(self,graphStore,focalPoint,radius,windowScale=1.5):
+        """Initializes the optimization (see initOptimization) of the part of a GraphStore around the lens,
+        only the nodes within windowScale * radius of the focal point (and the edges between them) are loaded into memory
+
+        :param graphStore: GraphStore holding the network
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        :param windowScale: (float) half width of the loaded window relative to the radius
+        :return: np.array((nodes),dtype=int) store indices of the optimized nodes (rows of the positions returned by step)
+        """
+        extent = radius * windowScale
+        window = graphStore.window([focalPoint[0] - extent,focalPoint[1] - extent],[focalPoint[0] + extent,focalPoint[1] + extent])
+        self.initOptimization(window,focalPoint,radius)
+        return window["nodeIndices"]
+
+    def initActiveSetOptimization(self,network,focalPoint,radius,activeMargin=1.25,frozenAtFisheye=False):
+        """Initializes the optimization (see initOptimization) of only the nodes around the lens: nodes within
+        activeMargin * radius of the focal point and their direct neighbors are optimized, the other ends of their edges
+        are included but frozen at their original (or fisheye target) position and all other nodes are left out,
+        so the cost of a step depends on the lens population instead of the network size.
+
+        :param network: {"nodes"=[],"edges"=[]} Network to be optimized/approximated
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        :param activeMargin: (float) radius of the optimized area relative to the lens radius
+        :param frozenAtFisheye: (bool) freeze the nodes outside the optimized area at their fisheye target positions
+        instead of their original positions
+        :return: np.array((nodes),dtype=int) network indices of the included nodes (rows of the positions returned by step)
+        """
+        nodes = np.asarray(network["nodes"],dtype=self.dtype)
+        edges = np.asarray(network["edges"],dtype=np.intp).reshape(-1,2)
+
+        lensMask = self.calcLenghts(nodes,np.asarray(focalPoint,dtype=self.dtype)) < radius * activeMargin
+        activeMask = lensMask.copy()
+        activeMask[edges[lensMask[edges[:,0]],1]] = True
+        activeMask[edges[lensMask[edges[:,1]],0]] = True
+
+        #Edges touching an active node, with the frozen nodes at their other end
+        activeEdges = edges[activeMask[edges[:,0]] | activeMask[edges[:,1]]]
+        includedMask = activeMask.copy()
+        includedMask[activeEdges.reshape(-1)] = True
+        nodeIndices = np.flatnonzero(includedMask)
+        localIndices = np.full(nodes.shape[0],-1,dtype=np.intp)
+        localIndices[nodeIndices] = np.arange(nodeIndices.shape[0])
+
+        subnetwork = {"nodes": nodes[nodeIndices],"edges": localIndices[activeEdges]}
+        if(network.get("nodeclusters") is not None):
+            subnetwork["nodeclusters"] = np.asarray(network["nodeclusters"])[nodeIndices]
+        self.initOptimization(subnetwork,focalPoint,radius)
+
+        self.activeSetIndices = nodeIndices
+        self.activeSetLayout = nodes
+        frozenNodeIndices = np.flatnonzero(~activeMask[nodeIndices])
+        if(frozenAtFisheye):
+            self.activeSetLayout = self.calcFisheyePositions(nodes,focalPoint,radius).astype(self.dtype,copy=False)
+            startPositions = np.array(self.lastNodePositions)
+            startPositions[frozenNodeIndices] = self.fisheyePositions[frozenNodeIndices]
+            self.setStartPositions(startPositions)
+
+        self.frozenNodeIndices = frozenNodeIndices
+        self.gradvelocity[frozenNodeIndices] = 0
+        return nodeIndices
+
+    def getActiveSetLayout(self,nodePositions):
+        """Get the positions of all nodes of the network of initActiveSetOptimization, the nodes left out of the
+        optimization keep their original (or fisheye target) position
+
+        :param nodePositions: np.array((nodes,2)) positions returned by step
+        :return: np.array((network nodes,2)) positions of all nodes
+        """
+        layout = np.array(self.activeSetLayout)
+        layout[self.activeSetIndices] = nodePositions
+        return layout
+
+    def optimize(self,maxSteps=None,stepCallback=None,cancelCallback=None):
+        """Perform steps until the optimization converged: either the total loss stopped improving
+        or almost all node coordinates stopped moving (their loss fell below lossThreshold).
+        Records the total loss of each step in lossHistory and the per node loss of the last steps in nodeLossHistory.
+
+        :param maxSteps: (int) max amount of steps, defaults to self.maxSteps
+        :param stepCallback: (nodePositions,stepCnt)=>None called after each step, e.g. to stream intermediate layouts
+        :param cancelCallback: ()=>bool called before each step, the optimization is aborted if it returns True
+        :return: node positions of the last step (see step), amount of steps performed
+        """
+        if(maxSteps is None):
+            maxSteps = self.maxSteps
+
+        nodePositions = None
+        for stepIndex in range(0,maxSteps):
+            if(cancelCallback is not None and cancelCallback()):
+                return nodePositions, stepIndex
+            nodePositions = self.step()
+            if(stepCallback is not None):
+                stepCallback(nodePositions,stepIndex + 1)
+            if(self.hasConverged()):
+                return nodePositions, stepIndex + 1
+
+        return nodePositions, maxSteps
+
+    def hasConverged(self):
+        """Record the loss of the last step and check the convergence criteria of optimize"""
+        #Zero length edges have undefined orientations, ignore their loss.
+        #Accumulated in float64, a float32 total is too coarse for the relative improvement thresholds on large networks
+        nodeLoss = np.nansum(self.nodeLoss,axis=1,dtype=np.float64)
+        self.lossHistory.append(np.sum(nodeLoss))
+        self.nodeLossHistory.append(nodeLoss)
+
+        #Frozen nodes never move and do not count as converged coordinates
+        coordinateCnt = self.gradvelocity.size
+        if(self.frozenNodeIndices is not None):
+            coordinateCnt -= self.frozenNodeIndices.shape[0] * 2
+        return self.checkConvergence(lambda: np.count_nonzero(self.gradvelocity),coordinateCnt)
+
+    def checkConvergence(self,countMoving,coordinateCnt):
+        """Check the convergence criteria of optimize on the recorded lossHistory
+
+        :param countMoving: ()=>int amount of node coordinates still moving (only counted once enough steps were recorded)
+        :param coordinateCnt: (int) amount of node coordinates that can move
+        """
+        minSteps, convergenceWindow = self.minSteps, self.convergenceWindow
+        if(self.warmStarted):
+            minSteps, convergenceWindow = self.warmStartMinSteps, self.warmStartWindow
+        if(len(self.lossHistory) < max(minSteps,convergenceWindow + 1)):
+            return False
+
+        activeFraction = countMoving() / max(coordinateCnt,1)
+        if(activeFraction < self.minActiveFraction):
+            return True
+
+        #The loss oscillates between steps, compare the best loss of the window to the best loss before
+        bestBefore = np.min(self.lossHistory[:-convergenceWindow])
+        bestRecent = np.min(self.lossHistory[-convergenceWindow:])
+        if(bestBefore <= 0):
+            return True
+        return (bestBefore - bestRecent) / bestBefore < self.minLossImprovement
+
+    def initBatchOptimization(self,network,focalPoints,radii,magnificationFactors=None):
+        """Initializes the optimization of K lenses over the same network at once.
+        The state of all lenses is stacked along a leading lens axis, so batchStep advances them in one vectorized step.
+
+        :param network: {"nodes"=[],"edges"=[]} Network to be optimized/approximated
+        :param focalPoints: [[x,y]] focal points of the K target fisheye distortions
+        :param radii: [int] radius of each fisheye distortion boundary (or one radius for all lenses)
+        :param magnificationFactors: [float] magnification of each lens (or one for all), defaults to self.magnificationFactor
+        """
+        self.batchFocalPoints = np.asarray(focalPoints,dtype=float).reshape(-1,2)
+        self.lensCnt = self.batchFocalPoints.shape[0]
+        self.batchRadii = np.broadcast_to(np.asarray(radii,dtype=float),(self.lensCnt,)).copy()
+
+        self.nodes = np.asarray(network["nodes"],dtype=self.dtype)
+        self.edgeConns = np.asarray(network["edges"])
+        self.edgesCnt = self.edgeConns.shape[0]
+        self.nodeCnt = self.nodes.shape[0]
+        self.edgeStartIndices = self.edgeConns[:,0].astype(np.intp)
+        self.edgeEndIndices = self.edgeConns[:,1].astype(np.intp)
+        self.network = network
+        #The single lens state is not continued after batches
+        self.lastLens = None
+
+        # -------- Variable Initializations (K,nodes,2)
+        self.batchGrad = (((np.random.randint(0,2,size=(self.lensCnt,self.nodeCnt,2)) * 2) - 1) * self.gradFactor).astype(self.dtype)
+        self.batchGradvelocity = np.ones((self.lensCnt,self.nodeCnt,2),dtype=self.dtype)
+        self.batchNodeLoss = np.zeros((self.lensCnt,self.nodeCnt,2),dtype=self.dtype)
+
+        self.origLConnPositions, self.origRConnPositions = self.getEdgeConnPositions(self.nodes,self.edgeConns)
+        self.origOrientations,_ = self.calcOrientations(self.origLConnPositions,self.origRConnPositions)
+
+        self.batchFisheyePositions = self.calcBatchFisheyePositions(self.nodes,self.batchFocalPoints,self.batchRadii,magnificationFactors).astype(self.dtype,copy=False)
+        lFisheyeConnPositions = self.batchFisheyePositions[:,self.edgeStartIndices]
+        rFisheyeConnPositions = self.batchFisheyePositions[:,self.edgeEndIndices]
+        self.batchFisheyeOrientations, self.batchFisheyeLengths = self.calcOrientations(lFisheyeConnPositions,rFisheyeConnPositions)
+
+        self.batchLastNodePositions = np.broadcast_to(self.nodes,(self.lensCnt,self.nodeCnt,2))
+        if(self.startAtFisheye):
+            self.batchLastNodePositions = self.batchFisheyePositions
+
+    def batchStep(self):
+        """Perform a gradient descent step (see step) for all lenses initialized by initBatchOptimization
+
+        :return: np.array((K,nodes,2)) new node positions of each lens
+        """
+        newNodePositions = self.batchLastNodePositions + self.batchGrad * self.batchGradvelocity
+        lConnPositions = newNodePositions[:,self.edgeStartIndices]
+        rConnPositions = newNodePositions[:,self.edgeEndIndices]
+
+        newLoss = self.calculateBatchNodeLoss(newNodePositions,lConnPositions,rConnPositions)
+        lossDiff = newLoss - self.batchNodeLoss
+
+        self.updateVelocity(self.batchGradvelocity,lossDiff,newLoss)
+
+        self.batchGrad = np.where(newLoss < self.batchNodeLoss,self.batchGrad,-self.batchGrad)
+
+        self.batchNodeLoss = newLoss
+        self.batchLastNodePositions = newNodePositions
+
+        return newNodePositions
+
+    def calculateBatchNodeLoss(self,nodePositions,stepLConnVec,stepRConnVec):
+        """Calculates the x, y loss at each node of each lens (see calculateNodeLoss).
+        The losses of all lenses are summed in one reduction over the flattened (K * nodes) lens/node index.
+
+        :param nodePositions: np.array((K,nodes,2)) node positions of step
+        :param stepLConnVec: np.array((K,edges,2)) Left hand side edgeconnection positions of step
+        :param stepRConnVec: np.array((K,edges,2)) Right hand side edgeconnection positions of step
+        :return: np.array((K,nodes,2)) x,y loss at each node of each lens
+        """
+        constaintEdgesLossResults = []
+        constaintEdgeStartIndices = []
+
+        if(self.structuralConstraintsEnabled):
+            orientations = self.origOrientations
+            if(self.optimizeToFisheye):
+                orientations = self.batchFisheyeOrientations
+            rconnvec = stepRConnVec
+            if(self.useOriginalAsLossRef):
+                rconnvec = self.origRConnPositions
+
+            structureEdgeLoss = np.power(np.abs(stepLConnVec - rconnvec - orientations*self.batchFisheyeLengths[...,None]),2)
+            structureEdgeLoss *= self.structuralweight
+            lensStartIndices = np.arange(self.lensCnt)[:,None] * self.nodeCnt + self.edgeStartIndices
+            constaintEdgesLossResults.append(structureEdgeLoss.reshape(-1,2))
+            constaintEdgeStartIndices.append(lensStartIndices.reshape(-1))
+
+        if(self.overlapPreventionEnabled or self.crossingMaximEnabled):
+            #Focal regions differ in size between lenses
+            for lens in range(0,self.lensCnt):
+                lensOffset = lens * self.nodeCnt
+                focalDistances = self.calcLenghts(nodePositions[lens],self.batchFocalPoints[lens])
+                focalNodeMask = focalDistances < self.batchRadii[lens]
+
+                if(self.overlapPreventionEnabled):
+                    readEdgeLoss, readEdgeConns = self.calcOverlapEdgeLoss(nodePositions[lens],np.flatnonzero(focalNodeMask))
+                    readEdgeLoss *= self.readabilityweight
+                    constaintEdgesLossResults.append(readEdgeLoss)
+                    constaintEdgeStartIndices.append(readEdgeConns[:,0] + lensOffset)
+
+                if(self.crossingMaximEnabled):
+                    focalEdgeIndices = np.flatnonzero(focalNodeMask[self.edgeStartIndices] & focalNodeMask[self.edgeEndIndices])
+                    crossEdgeLoss, crossEdgeConns = self.calcCrossingEdgeLoss(stepLConnVec[lens],stepRConnVec[lens],focalEdgeIndices)
+                    constaintEdgesLossResults.append(crossEdgeLoss)
+                    constaintEdgeStartIndices.append(crossEdgeConns[:,0] + lensOffset)
+
+        nodeLoss = self.accumulateNodeLoss(constaintEdgesLossResults,constaintEdgeStartIndices,binCnt=self.lensCnt * self.nodeCnt)
+        return nodeLoss.reshape(self.lensCnt,self.nodeCnt,2)
+
+    @profiledPhase("velocityUpdate")
+    def updateVelocity(self,gradvelocity,lossDiff,newLoss):
+        """Speed up coordinates whose loss decreased, reset the others and slow down coordinates close to their optimum
+
+        :param gradvelocity: np.array((nodes,2)) gradient velocities to be updated in place
+        :param lossDiff: np.array((nodes,2)) change of loss during the step
+        :param newLoss: np.array((nodes,2)) loss after the step
+        """
+        gradvelocity[lossDiff <= 0] *= self.velocityFactor
+        gradvelocity[lossDiff > 0] = 1.0
+
+        gradvelocity[newLoss < 400] = 0.6
+        gradvelocity[newLoss < 80] = 0.4
+        gradvelocity[newLoss < 40] = 0.2
+        gradvelocity[newLoss < self.lossThreshold] = 0
+
     def calcOrientations(self,startPositions,endPositions):
         """ Calculate the nomalized orientations between 2 Position Vectors"""
         lengths = self.calcLenghts(startPositions,endPositions)
         #return (rconnVec - lconnVec)/lengths
         dirVector =(startPositions - endPositions)
-        return np.divide(dirVector,lengths[:,None]), lengths
+        return np.divide(dirVector,lengths[...,None]), lengths
 
     def calcLenghts(self,startPositions,endPositions):
         """ Calculate vector lengths between 2 position vectors"""
         powermat = np.power(startPositions - endPositions,2)
-        summat = np.sum(powermat,axis=1)
+        summat = np.sum(powermat,axis=-1)
         #print(summat)
         lengths = np.sqrt(summat)
         #print(lengths)
@@ -374,30 +982,57 @@ class NetworkOptimizer:
         #print(lengths)
         return lengths
 
-    def getEdgeConnPositions(self,nodeVec,edgeConns):
+    @profiledPhase("connPositions")
+    def getEdgeConnPositions(self,nodeVec,edgeConns,out=None):
         """Get a matrix where each index of a connection table was replaced by the corresponding position of the nodes table
         :param nodeVec: the vector of node positions to get the position values from
         :param edgeConns: rows of connected edge indices
+        :param out: [np.array((edges,2)),np.array((edges,2))] optional buffers the positions are gathered into
         """
-        connPositions = [np.zeros((edgeConns.shape[0],2)),np.zeros((edgeConns.shape[0],2))]
-        cnt = 0
-        for edge in edgeConns:
-            startNodeId = int(edge[0])
-            endNodeId = int(edge[1])
-            connPositions[0][cnt,:] = nodeVec[startNodeId]
-            connPositions[1][cnt,:] = nodeVec[endNodeId]
-            cnt += 1
+        nodeVec = np.asarray(nodeVec)
+        connPositions = out
+        if(connPositions is None):
+            connPositions = [np.zeros((edgeConns.shape[0],2),dtype=self.dtype),np.zeros((edgeConns.shape[0],2),dtype=self.dtype)]
+
+        for side in range(0,2):
+            if(connPositions[side].dtype == nodeVec.dtype):
+                #clip mode writes straight into the buffer (raise mode buffers the output)
+                np.take(nodeVec,edgeConns[:,side],axis=0,out=connPositions[side],mode='clip')
+            else:
+                connPositions[side][:] = nodeVec[edgeConns[:,side]]
 
         return connPositions
 
-    def calcFisheyePositions(self,nodes,focalPoint,radius):
+    def allocateStepBuffers(self):
+        """Allocate the workspace reused by each step if reuseStepBuffers is enabled.
+        Node positions, edge connection positions and node losses have two slots the steps alternate between,
+        so the results of the last step stay valid while the next step is written.
+        """
+        self.bufferSlot = 0
+        self.nodePositionBuffers = [np.zeros((self.nodeCnt,2),dtype=self.dtype),np.zeros((self.nodeCnt,2),dtype=self.dtype)]
+        self.nodeLossBuffers = [np.zeros((self.nodeCnt,2),dtype=self.dtype),np.zeros((self.nodeCnt,2),dtype=self.dtype)]
+        self.connPositionBuffers = [
+            [np.zeros((self.edgesCnt,2),dtype=self.dtype),np.zeros((self.edgesCnt,2),dtype=self.dtype)],
+            [np.zeros((self.edgesCnt,2),dtype=self.dtype),np.zeros((self.edgesCnt,2),dtype=self.dtype)]
+        ]
+
+        self.gradStepBuffer = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+        self.lossDiffBuffer = np.zeros((self.nodeCnt,2),dtype=self.dtype)
+        self.lossMaskBuffer = np.zeros((self.nodeCnt,2),dtype=bool)
+        self.structuralTargetBuffer = np.zeros((self.edgesCnt,2),dtype=self.dtype)
+        self.structuralLossBuffer = np.zeros((self.edgesCnt,2),dtype=self.dtype)
+
+    def calcFisheyePositions(self,nodes,focalPoint,radius,magnificationFactor=None):
         """Calculate the new node positions distorted by a fishey lens
         :param nodes: original positions of the nodes
         :param focalPoint: [x,y] focal Point of the fisheye lens (center)
         :param radius: radius of the fisheye lens/distortion
+        :param magnificationFactor: magnification of the lens, defaults to self.magnificationFactor
         """
         #self.fisheyePositions = np.zeros((nodeCnt,2))
         m = self.magnificationFactor
+        if(magnificationFactor is not None):
+            m = magnificationFactor
 
         nodePositions = np.asarray(nodes)
         orientations,_ = self.calcOrientations(nodePositions,focalPoint)
@@ -408,27 +1043,123 @@ class NetworkOptimizer:
 
         focalDistanceRatios = nodeDistances/boundaryDistances
         distortedRatios = ((m + 1) * focalDistanceRatios)/(m * focalDistanceRatios + 1)
-        return focalPoint + (boundaryPoints - focalPoint) * distortedRatios[:,None]
+        return focalPoint + (boundaryPoints - focalPoint) * distortedRatios[...,None]
+
+    def calcBatchFisheyePositions(self,nodes,focalPoints,radii,magnificationFactors=None):
+        """Calculate the node positions distorted by K fisheye lenses at once
+        :param nodes: np.array((nodes,2)) original positions of the nodes
+        :param focalPoints: np.array((K,2)) focal points of the lenses
+        :param radii: np.array((K)) radii of the lenses
+        :param magnificationFactors: np.array((K)) magnifications of the lenses, defaults to self.magnificationFactor
+        :return: np.array((K,nodes,2)) distorted node positions of each lens
+        """
+        focalPoints = np.asarray(focalPoints,dtype=float).reshape(-1,1,2)
+        lensCnt = focalPoints.shape[0]
+        radii = np.broadcast_to(np.asarray(radii,dtype=float),(lensCnt,)).reshape(-1,1,1)
+        if(magnificationFactors is None):
+            magnificationFactors = self.magnificationFactor
+        magnificationFactors = np.broadcast_to(np.asarray(magnificationFactors,dtype=float),(lensCnt,)).reshape(-1,1)
+
+        return self.calcFisheyePositions(np.asarray(nodes)[None,:,:],focalPoints,radii,magnificationFactors)
+
+    def buildAdjacency(self):
+        """Build a CSR node to edge adjacency of the current edge connections:
+        the edges touching node n are nodeEdgeIndices[nodeEdgeOffsets[n]:nodeEdgeOffsets[n+1]]
+        """
+        endpoints = np.concatenate((self.edgeStartIndices,self.edgeEndIndices))
+        edgeIds = np.concatenate((np.arange(self.edgesCnt),np.arange(self.edgesCnt)))
+        order = np.argsort(endpoints,kind='stable')
+
+        self.nodeEdgeIndices = edgeIds[order]
+        self.nodeEdgeOffsets = np.zeros(self.nodeCnt + 1,dtype=np.intp)
+        self.nodeEdgeOffsets[1:] = np.cumsum(np.bincount(endpoints,minlength=self.nodeCnt))
 
+    def getIncidentEdges(self,nodeIndices):
+        """Get the indices of all edges touching the given nodes from the CSR adjacency (self loops are listed twice)
+
+        :param nodeIndices: np.array((nodes)) indices of the nodes
+        """
+        starts = self.nodeEdgeOffsets[nodeIndices]
+        _, entries = expandRanges(starts,self.nodeEdgeOffsets[nodeIndices + 1] - starts)
+        return self.nodeEdgeIndices[entries]
+
+    @profiledPhase("focalExtraction")
     def extractFocalEdges(self,lConnPositions,rConnPositions):
-        """Extract the nodes and edges inside the focal area of the fisheye lens
+        """Extract the nodes and edges inside the focal area of the fisheye lens.
+        On consecutive steps only nodes that might have crossed the lens boundary are checked again
+        and focal edges are updated from the adjacency of the nodes that entered or left.
         
         :param lConnPositions: np.array((nodes,2)) Left hand side edgeconnection positions of step
         :param rConnPositions: np.array((nodes,2)) Right hand side edgeconnection positions of step
         """
-        #Extract edges and nodes inside focal area
-        nodesFocalDistances = self.calcLenghts(self.newNodePositions,self.focalPoint)
-        nodeinsidecondition = nodesFocalDistances < self.radius
-        self.focalNodeIndices = np.argwhere(nodeinsidecondition).flatten()
+        #Check all nodes if more nodes than that might have crossed the boundary
+        maxIncrementalFraction = 0.25
+
+        if(self.focalStateStep != self.stepCnt - 1):
+            self.rebuildFocalRegion()
+        else:
+            #Upper bound of how far any node moved during this step
+            self.focalDrift += np.max(np.abs(self.grad)) * np.max(self.gradvelocity) * np.sqrt(2)
+            candidateIndices = np.flatnonzero(self.focalSlack <= self.focalDrift)
+            if(candidateIndices.shape[0] > self.nodeCnt * maxIncrementalFraction):
+                candidateIndices = None
+            self.updateFocalRegion(candidateIndices)
+        self.focalStateStep = self.stepCnt
 
         self.focalNodePositions = self.newNodePositions[self.focalNodeIndices]
-       
-        edgeConnChecker = np.isin(self.edgeConns,self.focalNodeIndices)
-        #and
-        condition = np.all(edgeConnChecker, axis=1)
+        self.focalConnPositions = np.array([lConnPositions[self.focalEdgeIndices],rConnPositions[self.focalEdgeIndices]])
+        self.focalConnIndices = self.edgeConns[self.focalEdgeIndices]
 
-        self.focalConnPositions = np.array([lConnPositions[condition],rConnPositions[condition]])
-        self.focalConnIndices = self.edgeConns[condition]
+    def rebuildFocalRegion(self):
+        """Evaluate the focal distance of all nodes and the focal state of all edges"""
+        nodesFocalDistances = self.calcLenghts(self.newNodePositions,self.focalPoint)
+        self.focalNodeMask = nodesFocalDistances < self.radius
+        self.focalNodeIndices = np.flatnonzero(self.focalNodeMask)
+
+        #Amount of focal endpoints of each edge, edges are focal if both endpoints are inside
+        self.focalEndpointCnts = self.focalNodeMask[self.edgeStartIndices].astype(np.int8) + self.focalNodeMask[self.edgeEndIndices]
+        self.focalEdgeIndices = np.flatnonzero(self.focalEndpointCnts == 2)
 
+        #Distance of each node to the lens boundary, only nodes closer than the accumulated drift can cross it
+        self.focalSlack = np.abs(nodesFocalDistances - self.radius)
+        self.focalDrift = 0.0
 
-    
\ No newline at end of file
+    def updateFocalRegion(self,candidateIndices=None):
+        """Check if nodes entered or left the focal area and update the focal nodes and edges accordingly
+
+        :param candidateIndices: np.array((nodes)) sorted indices of the nodes which might have crossed the lens boundary,
+        all nodes are checked (and their boundary distances refreshed) if None
+        """
+        if(candidateIndices is None):
+            nodesFocalDistances = self.calcLenghts(self.newNodePositions,self.focalPoint)
+            self.focalSlack = np.abs(nodesFocalDistances - self.radius)
+            self.focalDrift = 0.0
+            insideCondition = nodesFocalDistances < self.radius
+            changedNodes = np.flatnonzero(insideCondition != self.focalNodeMask)
+            changedInside = insideCondition[changedNodes]
+        else:
+            candidateDistances = self.calcLenghts(self.newNodePositions[candidateIndices],self.focalPoint)
+            insideCondition = candidateDistances < self.radius
+            changedCondition = insideCondition != self.focalNodeMask[candidateIndices]
+            changedNodes = candidateIndices[changedCondition]
+            changedInside = insideCondition[changedCondition]
+
+        if(changedNodes.shape[0] == 0):
+            return
+
+        enteringNodes = changedNodes[changedInside]
+        leavingNodes = changedNodes[~changedInside]
+        self.focalNodeMask[changedNodes] = changedInside
+        self.focalNodeIndices = np.union1d(np.setdiff1d(self.focalNodeIndices,leavingNodes,assume_unique=True),enteringNodes)
+
+        enteringEdges = self.getIncidentEdges(enteringNodes)
+        leavingEdges = self.getIncidentEdges(leavingNodes)
+        affectedEdges = np.unique(np.concatenate((enteringEdges,leavingEdges)))
+
+        wasFocal = self.focalEndpointCnts[affectedEdges] == 2
+        np.add.at(self.focalEndpointCnts,enteringEdges,1)
+        np.subtract.at(self.focalEndpointCnts,leavingEdges,1)
+        isFocal = self.focalEndpointCnts[affectedEdges] == 2
+
+        remainingEdges = np.setdiff1d(self.focalEdgeIndices,affectedEdges[wasFocal & ~isFocal],assume_unique=True)
+        self.focalEdgeIndices = np.union1d(remainingEdges,affectedEdges[~wasFocal & isFocal])
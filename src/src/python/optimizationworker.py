@@ -0,0 +1,117 @@
+from multiprocessing import shared_memory
+import time
+import numpy as np
+from networkoptimizer import NetworkOptimizer
+from sharednetwork import SharedNetwork
+
+class OptimizationWorker:
+    """Optimizing lens requests of any client session inside a process pool worker, reading the network from shared memory"""
+
+    def __init__(self,generationsName,sessionCnt,frameQueue,streamFrameSteps,streamFrameMsec):
+        """Attach to the shared request generation counters of the sessions
+
+        :param generationsName: (str) name of the shared memory block holding the latest request generation of each session slot
+        :param sessionCnt: (int) amount of session slots
+        :param frameQueue: (multiprocessing.Queue) queue intermediate layouts are put into, None to disable streaming
+        :param streamFrameSteps: (int) put an intermediate layout every streamFrameSteps steps ...
+        :param streamFrameMsec: (int) ... or streamFrameMsec milliseconds
+        """
+        self.generationsBlock = shared_memory.SharedMemory(name=generationsName)
+        self.generations = np.ndarray((sessionCnt,),dtype=np.int64,buffer=self.generationsBlock.buf)
+        self.frameQueue = frameQueue
+        self.streamFrameSteps = streamFrameSteps
+        self.streamFrameMsec = streamFrameMsec
+
+        self.sharedNetwork = None
+        self.networkDescriptor = None
+        self.networkoptimizer = None
+        #Session and mode of the last optimization, the optimizer state is continued for the next request of the same lens drag
+        self.lastRequestKey = None
+
+    def attachNetwork(self,descriptor):
+        """Attach to the shared network if it changed since the last request (the optimizer keeps its adjacency otherwise)
+
+        :param descriptor: (dict) see SharedNetwork.descriptor
+        """
+        if(descriptor == self.networkDescriptor):
+            return
+
+        if(self.sharedNetwork is not None):
+            #The optimizer holds views into the old blocks
+            self.networkoptimizer = None
+            self.sharedNetwork.close()
+        self.sharedNetwork = SharedNetwork.attach(descriptor)
+        self.networkDescriptor = descriptor
+        self.networkoptimizer = NetworkOptimizer()
+        self.networkoptimizer.reuseStepBuffers = True
+        self.lastRequestKey = None
+
+    def isOutdated(self,request):
+        """Check if a newer request of the same session was received by the server"""
+        return self.generations[request["slot"]] != request["generation"]
+
+    def optimize(self,request):
+        """Optimize the layout of a lens request
+
+        :param request: (dict) "session", "slot", "generation", "network" (shared network descriptor), "startPositions"
+        (np.array((nodes,2)) or None to start at the shared network layout), "focusPoint", "radius", "magnification",
+        "optimizeToFisheye", "maxSteps", "dtype" (float type of the optimizer arrays), "profile" (profiling enabled, memory tracked)
+        :return: generation of the request, np.array((nodes,2)) optimized positions or None if the request was outdated, amount of steps,
+        optimizer profiler statistics of the request (see PhaseProfiler.snapshot) or None if profiling is disabled
+        """
+        if(self.isOutdated(request)):
+            return request["generation"], None, 0, None
+
+        self.attachNetwork(request["network"])
+        profiler = self.networkoptimizer.profiler
+        profiler.configure(*request["profile"])
+        network = self.sharedNetwork.network
+        if(request["startPositions"] is not None):
+            network = dict(network)
+            network["nodes"] = request["startPositions"]
+
+        self.networkoptimizer.magnificationFactor = request["magnification"]
+        self.networkoptimizer.optimizeToFisheye = request["optimizeToFisheye"]
+        self.networkoptimizer.dtype = np.dtype(request["dtype"])
+        #Requests starting at the original layout (after "up") or of another session start over, as requests starting
+        #at another layout than the last result of this worker (see NetworkOptimizer.canWarmStart)
+        requestKey = (request["session"],request["mode"])
+        self.networkoptimizer.warmStartEnabled = request["startPositions"] is not None and requestKey == self.lastRequestKey
+        self.lastRequestKey = requestKey
+        self.networkoptimizer.initOptimization(network,request["focusPoint"],request["radius"])
+
+        self.lastFrameStep = 0
+        self.lastFrameTime = time.time()
+
+        def streamFrame(nodePositions,stepCnt):
+            now = time.time()
+            if(stepCnt - self.lastFrameStep < self.streamFrameSteps and (now - self.lastFrameTime) * 1000 < self.streamFrameMsec):
+                return
+            self.lastFrameStep = stepCnt
+            self.lastFrameTime = now
+            #Positions are pickled later by the queue feeder thread, after the step buffers were overwritten
+            self.frameQueue.put((request["session"],request["generation"],np.array(nodePositions)))
+
+        stepCallback = streamFrame if self.frameQueue is not None else None
+        nodePositions, stepCnt = self.networkoptimizer.optimize(request["maxSteps"],stepCallback,lambda: self.isOutdated(request))
+
+        stats = None
+        if(profiler.enabled):
+            stats = profiler.snapshot()
+            profiler.reset()
+
+        if(self.isOutdated(request)):
+            return request["generation"], None, stepCnt, stats
+        return request["generation"], np.array(nodePositions), stepCnt, stats
+
+#Worker instance of this pool process
+worker = None
+
+def initWorker(generationsName,sessionCnt,frameQueue,streamFrameSteps,streamFrameMsec):
+    """Process pool initializer, see OptimizationWorker"""
+    global worker
+    worker = OptimizationWorker(generationsName,sessionCnt,frameQueue,streamFrameSteps,streamFrameMsec)
+
+def runOptimization(request):
+    """Process pool task, see OptimizationWorker.optimize"""
+    return worker.optimize(request)
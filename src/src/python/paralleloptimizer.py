@@ -0,0 +1,268 @@
+import os
+import multiprocessing
+import numpy as np
+from networkoptimizer import NetworkOptimizer
+from generationpipeline import ChunkArrays, attachArray
+
+class ParallelOptimizer:
+    """Optimization of large networks on several processes. The nodes are split into spatial tiles of balanced size,
+    each tile is optimized by its own NetworkOptimizer, which also holds the nodes of other tiles connected to the tile or
+    close to it (halo) frozen at their latest positions. Positions are exchanged through two shared memory buffers:
+    step k reads the halo positions from buffer k % 2 and writes the positions of the owned nodes into the other one,
+    so every tile sees the positions of the previous step of all other tiles, independent of the process timing.
+    Crossings between edges of which no end is owned by a tile are not seen by it."""
+
+    def __init__(self,optimizer=None,processCnt=None,tileCnt=None,haloMargin=30.0):
+        """
+        :param optimizer: NetworkOptimizer whose settings apply to the tiles, its lossHistory records the total loss
+        :param processCnt: (int) amount of worker processes, 1 to optimize all tiles in this process, defaults to the amount of cores
+        :param tileCnt: (int) amount of tiles, defaults to processCnt (tiles are distributed evenly over the processes)
+        :param haloMargin: (float) nodes of other tiles within this distance of the bounding box of a tile are part of its halo,
+        so overlaps across the tile boundary are seen
+        """
+        self.optimizer = optimizer if optimizer is not None else NetworkOptimizer()
+        self.processCnt = processCnt if processCnt is not None else (os.cpu_count() or 1)
+        self.tileCnt = tileCnt if tileCnt is not None else self.processCnt
+        self.haloMargin = haloMargin
+
+        #PartitionWorkers (in process) or (process, connection) of each worker process
+        self.workers = []
+        self.arrays = None
+
+    def getSettings(self):
+        """Get the settings of the template optimizer copied to the optimizers of the tiles (numbers, flags, names and the dtype)"""
+        return {name: value for name, value in vars(self.optimizer).items() if isinstance(value,(bool,int,float,str)) or name == "dtype"}
+
+    def partitionNodes(self,nodePositions):
+        """Split the nodes into tileCnt spatial tiles of balanced size by recursively splitting along the longer side
+
+        :param nodePositions: np.array((nodes,2)) positions of the nodes
+        :return: np.array((nodes),dtype=int) tile of each node
+        """
+        labels = np.zeros(nodePositions.shape[0],dtype=np.int64)
+
+        def split(indices,tileCnt,firstTile):
+            if(tileCnt <= 1 or indices.shape[0] == 0):
+                labels[indices] = firstTile
+                return
+            positions = nodePositions[indices]
+            axis = int(np.argmax(np.ptp(positions,axis=0)))
+            lowerTileCnt = tileCnt // 2
+            splitIndex = indices.shape[0] * lowerTileCnt // tileCnt
+            order = np.argsort(positions[:,axis],kind='stable')
+            split(indices[order[:splitIndex]],lowerTileCnt,firstTile)
+            split(indices[order[splitIndex:]],tileCnt - lowerTileCnt,firstTile + lowerTileCnt)
+
+        split(np.arange(nodePositions.shape[0]),self.tileCnt,0)
+        return labels
+
+    def buildTile(self,nodePositions,edges,labels,tile):
+        """Build the network of a tile: its owned nodes followed by its halo nodes and all edges touching an owned node
+
+        :param nodePositions: np.array((nodes,2)) positions of all nodes
+        :param edges: np.array((edges,2),dtype=int) start, end node indices of all edges
+        :param labels: np.array((nodes),dtype=int) tile of each node (see partitionNodes)
+        :param tile: (int) tile to build
+        :return: (dict) "network" of the tile, "nodeIndices" network indices of its nodes, "ownedCnt" amount of owned nodes
+        """
+        ownedMask = labels == tile
+        ownedIndices = np.flatnonzero(ownedMask)
+        tileEdges = edges[ownedMask[edges[:,0]] | ownedMask[edges[:,1]]]
+
+        haloMask = np.zeros(nodePositions.shape[0],dtype=bool)
+        haloMask[tileEdges.reshape(-1)] = True
+        if(ownedIndices.shape[0] > 0):
+            lowerBound = nodePositions[ownedIndices].min(axis=0) - self.haloMargin
+            upperBound = nodePositions[ownedIndices].max(axis=0) + self.haloMargin
+            haloMask |= np.all((nodePositions >= lowerBound) & (nodePositions <= upperBound),axis=1)
+        haloMask &= ~ownedMask
+
+        nodeIndices = np.concatenate((ownedIndices,np.flatnonzero(haloMask)))
+        localIndices = np.full(nodePositions.shape[0],-1,dtype=np.int64)
+        localIndices[nodeIndices] = np.arange(nodeIndices.shape[0])
+        network = {"nodes": nodePositions[nodeIndices],"edges": localIndices[tileEdges]}
+        return {"network": network,"nodeIndices": nodeIndices,"ownedCnt": ownedIndices.shape[0]}
+
+    def initOptimization(self,network,focalPoint,radius):
+        """Partition the network, allocate the shared position buffers and initialize the optimizers of all tiles
+        (see NetworkOptimizer.initOptimization). Worker processes are started here and kept until close.
+
+        :param network: {"nodes"=[],"edges"=[]} Network to be optimized/approximated
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        """
+        self.close()
+        nodePositions = np.asarray(network["nodes"],dtype=float)
+        edges = np.asarray(network["edges"],dtype=np.int64).reshape(-1,2)
+        self.nodeCnt = nodePositions.shape[0]
+        labels = self.partitionNodes(nodePositions)
+
+        self.arrays = ChunkArrays(shared=self.processCnt > 1)
+        dtype = np.dtype(self.optimizer.dtype)
+        self.positionBuffers = [self.arrays.create("positions0",(self.nodeCnt,2),dtype),self.arrays.create("positions1",(self.nodeCnt,2),dtype)]
+        self.positionBuffers[0][:] = nodePositions
+        if(self.optimizer.startAtFisheye):
+            self.positionBuffers[0][:] = self.optimizer.calcFisheyePositions(nodePositions,focalPoint,radius)
+
+        self.stepCnt = 0
+        self.optimizer.lossHistory = []
+        self.optimizer.warmStarted = False
+
+        settings = self.getSettings()
+        descriptors = self.arrays.descriptors()
+        #Initial gradients of the tiles follow the global random state, as those of NetworkOptimizer
+        seeds = np.random.randint(0,2**31 - 1,size=self.tileCnt)
+        tasks = [(self.buildTile(nodePositions,edges,labels,tile),settings,focalPoint,radius,descriptors,int(seeds[tile]))
+            for tile in range(0,self.tileCnt)]
+
+        if(self.processCnt <= 1):
+            self.workers = [PartitionWorker(*task) for task in tasks]
+            return
+
+        #Same start method as the optimization pool, workers import this module fresh
+        context = multiprocessing.get_context("spawn")
+        for processIndex in range(0,min(self.processCnt,self.tileCnt)):
+            connection, workerConnection = context.Pipe()
+            process = context.Process(target=runPartitionWorker,args=(workerConnection,),daemon=True)
+            process.start()
+            workerConnection.close()
+            connection.send(("init",tasks[processIndex::self.processCnt]))
+            self.workers.append((process,connection))
+        self.collectResults()
+
+    def collectResults(self):
+        """Receive the answer of every worker process, raising the first error of a worker
+
+        :return: [list] results of the tiles of each worker process
+        """
+        results = [connection.recv() for process, connection in self.workers]
+        for result in results:
+            if(isinstance(result,Exception)):
+                raise result
+        return results
+
+    def step(self):
+        """Perform a step (see NetworkOptimizer.step) on all tiles at once
+
+        :return: np.array((nodes,2)) view into the shared buffer with the new node positions of all nodes,
+        which stays valid until the step after the next one
+        """
+        if(self.processCnt <= 1):
+            tileResults = [worker.step(self.stepCnt) for worker in self.workers]
+        else:
+            for process, connection in self.workers:
+                connection.send(("step",self.stepCnt))
+            tileResults = [tileResult for results in self.collectResults() for tileResult in results]
+        self.stepCnt += 1
+
+        self.lastLoss = sum(loss for loss, movingCnt, coordinateCnt in tileResults)
+        self.movingCnt = sum(movingCnt for loss, movingCnt, coordinateCnt in tileResults)
+        self.coordinateCnt = sum(coordinateCnt for loss, movingCnt, coordinateCnt in tileResults)
+        return self.positionBuffers[self.stepCnt % 2]
+
+    def optimize(self,maxSteps=None,stepCallback=None,cancelCallback=None):
+        """Perform steps until the optimization converged (see NetworkOptimizer.optimize), the total loss of each step
+        is recorded in optimizer.lossHistory
+
+        :param maxSteps: (int) max amount of steps, defaults to optimizer.maxSteps
+        :param stepCallback: (nodePositions,stepCnt)=>None called after each step
+        :param cancelCallback: ()=>bool called before each step, the optimization is aborted if it returns True
+        :return: node positions of the last step (see step), amount of steps performed
+        """
+        if(maxSteps is None):
+            maxSteps = self.optimizer.maxSteps
+
+        nodePositions = None
+        for stepIndex in range(0,maxSteps):
+            if(cancelCallback is not None and cancelCallback()):
+                return nodePositions, stepIndex
+            nodePositions = self.step()
+            if(stepCallback is not None):
+                stepCallback(nodePositions,stepIndex + 1)
+            self.optimizer.lossHistory.append(self.lastLoss)
+            if(self.optimizer.checkConvergence(lambda: self.movingCnt,self.coordinateCnt)):
+                return nodePositions, stepIndex + 1
+
+        return nodePositions, maxSteps
+
+    def close(self):
+        """Stop the worker processes and free the shared position buffers"""
+        for process, connection in self.workers if self.processCnt > 1 else []:
+            try:
+                connection.send(("close",))
+            except (BrokenPipeError,OSError):
+                pass
+            process.join()
+            connection.close()
+        self.workers = []
+        if(self.arrays is not None):
+            self.positionBuffers = None
+            self.arrays.release()
+            self.arrays = None
+
+class PartitionWorker:
+    """Optimizer of one tile of a ParallelOptimizer, halo nodes are frozen and moved to the positions the other tiles
+    wrote before each step"""
+
+    def __init__(self,tile,settings,focalPoint,radius,descriptors,seed):
+        """
+        :param tile: (dict) see ParallelOptimizer.buildTile
+        :param settings: (dict) NetworkOptimizer attributes (see ParallelOptimizer.getSettings)
+        :param focalPoint: [int,int] focal point of target fisheye distortion
+        :param radius: (int) radius of fisheye distortion boundary
+        :param descriptors: (dict) "positions0", "positions1" shared position buffers (see ChunkArrays.descriptors)
+        :param seed: (int) seed of the initial gradients
+        """
+        self.positionBuffers = [descriptors[name] if isinstance(descriptors[name],np.ndarray) else attachArray(descriptors[name])
+            for name in ("positions0","positions1")]
+        self.ownedCnt = tile["ownedCnt"]
+        self.ownedIndices = tile["nodeIndices"][:self.ownedCnt]
+        self.haloIndices = tile["nodeIndices"][self.ownedCnt:]
+
+        self.optimizer = NetworkOptimizer()
+        for name, value in settings.items():
+            setattr(self.optimizer,name,value)
+        self.optimizer.warmStartEnabled = False
+        np.random.seed(seed)
+        self.optimizer.initOptimization(tile["network"],focalPoint,radius)
+        #Copied, so halo updates do not write into the fisheye targets (startAtFisheye)
+        self.optimizer.setStartPositions(self.positionBuffers[0][tile["nodeIndices"]])
+        self.optimizer.frozenNodeIndices = np.arange(self.ownedCnt,tile["nodeIndices"].shape[0])
+        self.optimizer.gradvelocity[self.optimizer.frozenNodeIndices] = 0
+
+    def step(self,stepIndex):
+        """Move the halo nodes to the positions of the last step of their tiles, perform a step and write the owned positions
+
+        :param stepIndex: (int) index of the step, selects the buffer to read and the buffer to write
+        :return: total loss of the owned nodes, amount of moving owned coordinates, amount of owned coordinates
+        """
+        optimizer = self.optimizer
+        optimizer.lastNodePositions[self.ownedCnt:] = self.positionBuffers[stepIndex % 2][self.haloIndices]
+        #Halo nodes moved without velocity, so the incremental focal update and the last gradient do not apply
+        optimizer.focalStateStep = None
+        optimizer.lossGradient = None
+
+        nodePositions = np.asarray(optimizer.step())
+        self.positionBuffers[(stepIndex + 1) % 2][self.ownedIndices] = nodePositions[:self.ownedCnt]
+
+        ownedLoss = float(np.nansum(optimizer.nodeLoss[:self.ownedCnt],dtype=np.float64))
+        return ownedLoss, int(np.count_nonzero(optimizer.gradvelocity[:self.ownedCnt])), self.ownedCnt * 2
+
+def runPartitionWorker(connection):
+    """Worker process main loop, answers ("init", tasks) by creating a PartitionWorker per task, ("step", stepIndex)
+    by the step results of its tiles and stops at ("close",). Errors are sent back instead of a result."""
+    workers = []
+    while(True):
+        message = connection.recv()
+        if(message[0] == "close"):
+            break
+        try:
+            if(message[0] == "init"):
+                workers = [PartitionWorker(*task) for task in message[1]]
+                result = None
+            else:
+                result = [worker.step(message[1]) for worker in workers]
+        except Exception as error:
+            result = error
+        connection.send(result)
+    connection.close()
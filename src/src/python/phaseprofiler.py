@@ -0,0 +1,212 @@
+import time
+import functools
+import threading
+import collections
+import tracemalloc
+
+class PhaseProfiler:
+    """Optional timers, counters and value samples of named phases (e.g. steps, loss terms, serialization), with
+    tracemalloc peak memory per phase. While disabled, instrumented code only checks the enabled flag."""
+
+    #Amount of recent samples kept per recorded value
+    sampleCnt = 100
+
+    def __init__(self,enabled=False,trackMemory=False):
+        """
+        :param enabled: (bool) collect timings, counters and samples
+        :param trackMemory: (bool) additionally trace allocations with tracemalloc (slows allocations down)
+        """
+        self.enabled = False
+        self.trackMemory = False
+        self.lock = threading.Lock()
+        #Phases currently running on each thread, for nested peak memory
+        self.threadState = threading.local()
+        self.reset()
+        self.configure(enabled,trackMemory)
+
+    def configure(self,enabled,trackMemory=False):
+        """Enable or disable collection, tracemalloc is started and stopped as needed
+
+        :param enabled: (bool) collect timings, counters and samples
+        :param trackMemory: (bool) additionally trace allocations with tracemalloc
+        """
+        trackMemory = enabled and trackMemory
+        if(trackMemory and not self.trackMemory and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+        elif(not trackMemory and self.trackMemory and tracemalloc.is_tracing()):
+            tracemalloc.stop()
+        self.trackMemory = trackMemory
+        self.enabled = enabled
+
+    def reset(self):
+        """Discard all collected statistics"""
+        with self.lock:
+            #Phase name -> [calls, total seconds, max seconds, peak memory bytes]
+            self.phases = {}
+            self.counters = collections.Counter()
+            #Value name -> [amount, sum, max, recent samples]
+            self.values = {}
+
+    def phase(self,name):
+        """Context manager measuring a phase, e.g. with profiler.phase("serialize"): ...
+
+        :param name: (str) phase name
+        """
+        if(not self.enabled):
+            return disabledPhase
+        return ProfiledPhase(self,name)
+
+    def count(self,name,amount=1):
+        """Add amount to a counter (only while enabled)"""
+        if(self.enabled):
+            with self.lock:
+                self.counters[name] += amount
+
+    def record(self,name,value):
+        """Record a sample of a value, e.g. the amount of steps of a request (only while enabled)"""
+        if(not self.enabled):
+            return
+        with self.lock:
+            entry = self.values.get(name)
+            if(entry is None):
+                entry = self.values[name] = [0,0.0,value,collections.deque(maxlen=self.sampleCnt)]
+            entry[0] += 1
+            entry[1] += value
+            entry[2] = max(entry[2],value)
+            entry[3].append(value)
+
+    def addPhase(self,name,calls,seconds,maxSeconds,peakMemory):
+        """Add measured calls of a phase"""
+        with self.lock:
+            entry = self.phases.get(name)
+            if(entry is None):
+                entry = self.phases[name] = [0,0.0,0.0,0]
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] = max(entry[2],maxSeconds)
+            entry[3] = max(entry[3],peakMemory)
+
+    def snapshot(self):
+        """Get the collected statistics
+
+        :return: (dict) {"enabled","trackMemory","phases": {name: {"calls","total","mean","max","peakMemory"}},
+        "counters": {name: amount}, "values": {name: {"count","mean","max","recent"}}, "memory": {"current","peak"} (if tracked)}
+        """
+        with self.lock:
+            stats = {
+                "enabled": self.enabled,
+                "trackMemory": self.trackMemory,
+                "phases": {name: {"calls": calls,"total": total,"mean": total / max(calls,1),"max": maxSeconds,"peakMemory": peakMemory}
+                    for name, (calls, total, maxSeconds, peakMemory) in self.phases.items()},
+                "counters": dict(self.counters),
+                "values": {name: {"count": cnt,"mean": total / max(cnt,1),"max": maxValue,"recent": list(samples)}
+                    for name, (cnt, total, maxValue, samples) in self.values.items()}
+            }
+        if(self.trackMemory and tracemalloc.is_tracing()):
+            current, peak = getTracedMemory()
+            stats["memory"] = {"current": current,"peak": peak}
+        return stats
+
+    def merge(self,stats):
+        """Add the statistics of a snapshot of another profiler (e.g. of an optimization process)
+
+        :param stats: (dict) see snapshot
+        """
+        for name, phase in stats["phases"].items():
+            self.addPhase(name,phase["calls"],phase["total"],phase["max"],phase["peakMemory"])
+        with self.lock:
+            self.counters.update(stats["counters"])
+            for name, value in stats["values"].items():
+                entry = self.values.get(name)
+                if(entry is None):
+                    entry = self.values[name] = [0,0.0,value["max"],collections.deque(maxlen=self.sampleCnt)]
+                entry[0] += value["count"]
+                entry[1] += value["mean"] * value["count"]
+                entry[2] = max(entry[2],value["max"])
+                entry[3].extend(value["recent"])
+
+class ProfiledPhase:
+    """Measurement of one running phase (see PhaseProfiler.phase)"""
+
+    def __init__(self,profiler,name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.startMemory = 0
+        #Peak of nested phases, tracemalloc only keeps one peak that is reset at each phase start
+        self.childPeak = 0
+        if(self.profiler.trackMemory and tracemalloc.is_tracing()):
+            stack = self.getStack()
+            current, peak = getTracedMemory()
+            if(len(stack) > 0):
+                stack[-1].childPeak = max(stack[-1].childPeak,peak)
+            resetPeakMemory()
+            self.startMemory = current
+            stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        seconds = time.perf_counter() - self.start
+        peakMemory = 0
+        stack = self.getStack()
+        if(len(stack) > 0 and stack[-1] is self):
+            stack.pop()
+            peak = max(getTracedMemory()[1],self.childPeak) if tracemalloc.is_tracing() else self.childPeak
+            peakMemory = peak - self.startMemory
+            if(len(stack) > 0):
+                stack[-1].childPeak = max(stack[-1].childPeak,peak)
+        self.profiler.addPhase(self.name,1,seconds,seconds,peakMemory)
+        return False
+
+    def getStack(self):
+        """Get the phases running on the current thread"""
+        state = self.profiler.threadState
+        if(not hasattr(state,"stack")):
+            state.stack = []
+        return state.stack
+
+class DisabledPhase:
+    """Context manager doing nothing, returned by disabled profilers"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        return False
+
+disabledPhase = DisabledPhase()
+
+#Bytes traced before the traces were cleared in place of tracemalloc.reset_peak (see resetPeakMemory)
+clearedMemory = 0
+
+def getTracedMemory():
+    """Get the current and peak traced bytes (see tracemalloc.get_traced_memory), including cleared traces"""
+    current, peak = tracemalloc.get_traced_memory()
+    return current + clearedMemory, peak + clearedMemory
+
+def resetPeakMemory():
+    """Start a new traced peak at the current traced memory. tracemalloc.reset_peak needs Python 3.9, older versions
+    clear the traces and keep counting the cleared bytes (blocks allocated before and freed afterwards are not subtracted)"""
+    global clearedMemory
+    if(hasattr(tracemalloc,"reset_peak")):
+        tracemalloc.reset_peak()
+        return
+    clearedMemory += tracemalloc.get_traced_memory()[0]
+    tracemalloc.clear_traces()
+
+def profiledPhase(name):
+    """Method decorator measuring each call as phase of the profiler in the "profiler" attribute of the instance
+
+    :param name: (str) phase name
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self,*args,**kwargs):
+            if(not self.profiler.enabled):
+                return method(self,*args,**kwargs)
+            with self.profiler.phase(name):
+                return method(self,*args,**kwargs)
+        return wrapper
+    return decorator
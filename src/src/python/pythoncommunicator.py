@@ -1,131 +1,396 @@
 import sys
+import os
 import random
+import threading
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
 import numpy as np
 from networkgenerator import NetworkGenerator
 from pythonmessenger import PythonMessenger
-from networkoptimizer import NetworkOptimizer
-import json
+from layoutcache import LayoutCache
+from sharednetwork import SharedNetwork
+from phaseprofiler import PhaseProfiler
+import optimizationworker
 import time
 
 
 class PythonCommunicator:
-    """Handling events sent to this process by writing to its stdin and sending data updates to stdout"""
+    """Handling events of many client sessions sent to this process by writing to its stdin and sending data updates to stdout.
+    All sessions share one network placed in shared memory, optimizations run on a process pool."""
 
-    def __init__(self):
-        """Generate Initial Nework and setup stdin stdout messaging"""
+    def __init__(self,binaryProtocol=False,processCnt=None,sessionCnt=1024):
+        """Generate Initial Nework and setup stdin stdout messaging
+
+        :param binaryProtocol: (bool) send networks as binary frames with raw float32/int32 buffers instead of json
+        :param processCnt: (int) amount of optimization processes, defaults to the amount of cpus - 1
+        :param sessionCnt: (int) max amount of concurrently connected client sessions
+        """
 
         self.running = True
         self.communicate = True
         self.debugging = False
+        #Show a blend of nearby cached layouts on cache misses until the optimization of the request finished
+        self.blendCachedLayouts = True
+        #Send intermediate layouts ("fframe") every streamFrameSteps steps or streamFrameMsec milliseconds while optimizing
+        self.streamFrames = True
+        self.streamFrameSteps = 10
+        self.streamFrameMsec = 100
+        self.binaryProtocol = binaryProtocol
+        #Float type of the optimizations in the pool workers (see the "precision" message)
+        self.dtype = np.dtype(np.float64)
+        self.processCnt = processCnt if processCnt is not None else max(1,(os.cpu_count() or 2) - 1)
+        self.sessionCnt = sessionCnt
+
+        #Session id -> per session state (see getSession), guarded by sessionLock
+        self.sessions = {}
+        self.freeSlots = list(range(sessionCnt - 1,-1,-1))
+        self.sessionLock = threading.RLock()
+        #Latest request generation of each session slot, pool workers abort requests of older generations
+        self.generationsBlock = shared_memory.SharedMemory(create=True,size=8 * sessionCnt)
+        self.generations = np.ndarray((sessionCnt,),dtype=np.int64,buffer=self.generationsBlock.buf)
+        self.generations[:] = 0
 
+        #Per phase timings and counters of the server and (merged) of the optimization processes, see the "stats" message
+        self.profiler = PhaseProfiler()
+
+        self.sharedNetwork = None
+        self.processPool = None
+        self.layoutCache = LayoutCache()
         self.networkGenerator = NetworkGenerator()
-        self.networkoptimizer = NetworkOptimizer()
         if(not self.debugging):
             self.createNewNetwork(500,500)
         else:
             self.createNewNetwork(30,100)
 
-        #self.networkoptimizer = NetworkOptimizer(len(network["nodes"]),len(network["edges"]))
-
-        if(self.debugging):
-            #print("BEFORE: ")
-            #print(self.network)
-            self.networkoptimizer.initOptimization(self.network,[400,400],400)
-            for x in range(0,1):
-                self.network["nodes"] = self.networkoptimizer.step()
-            #print("AFTER: ")
-            #print(self.network)
-
         if self.communicate and not self.debugging:
             self.pythonmessenger = None
+            self.startProcessPool()
             self.setupMessageHandlers()
+            self.shutdown()
 
 
-    def sendBackNetwork(self,updateType,positionsonly=False):
+    def sendBackNetwork(self,updateType,positionsonly=False,sequence=None,sessionId=None,nodePositions=None):
         """Serialize network and send to stdout
-        
+
         :param updateType: (str) prefix to send data with, spaces not allowed in this name
         :param positionsonly: (bool) only send back network node positions (omit edges and clusterids data)
+        :param sequence: (int) sequence number to be sent with the network, so the client can order layouts
+        :param sessionId: (str) client session the network is sent to, None for all sessions
+        :param nodePositions: (np.array((nodes,2))) layout of the session to be sent instead of the original node positions
         """
         tempnetwork = self.network
+        if(nodePositions is not None):
+            tempnetwork = dict(tempnetwork)
+            tempnetwork["nodes"] = nodePositions
         if(positionsonly):
             tempnetwork = {
                 "nodes": tempnetwork["nodes"]
             }
+        if(sequence is not None):
+            tempnetwork = dict(tempnetwork)
+            tempnetwork["seq"] = sequence
+
+        self.sendData(updateType,tempnetwork,sessionId)
+
+    def sendData(self,updateType,data,sessionId=None):
+        """Serialize data (json or binary frame, depending on the messenger) and send to stdout
 
-        networkjson = json.dumps(tempnetwork)
-        networkjson = networkjson.replace(" ","")
-        networkjson = updateType + " " + networkjson
-        self.pythonmessenger.sendMessage(networkjson)
-        sys.stdout.flush()
+        :param updateType: (str) prefix to send data with, spaces not allowed in this name
+        :param data: (dict) json serializable data, values may also be np.arrays
+        :param sessionId: (str) client session the data is sent to, None for all sessions
+        """
+        self.pythonmessenger.sendData(updateType,data,sessionId)
 
     def createNewNetwork(self,nodeCnt,edgesCnt,clustersCnt=4):
-        """Generate Network and initialize NetworkOptimizer with new network
-        
+        """Generate Network, place it in shared memory for the optimization processes and reset all sessions to it
+
         :param nodeCnt: (int) Amount of nodes to be generated
         :param edgesCnt: (int) Amount of edges to be generated
         :param clusterCenters: (int) Amount of clusters centers to be generated
         """
 
-        self.network = self.networkGenerator.generateNetwork(nodeCnt,edgesCnt,0,900,0,900,closerSamplingIterations=30,clusterCenters=clustersCnt)
-        self.originalNodesPos = self.network["nodes"]
+        network = self.networkGenerator.generateNetwork(nodeCnt,edgesCnt,0,900,0,900,closerSamplingIterations=30,clusterCenters=clustersCnt)
+        with self.sessionLock:
+            self.network = network
+            #Processes still optimizing on the old network keep their mapping until they attach to the new one
+            if(self.sharedNetwork is not None):
+                self.sharedNetwork.unlink()
+            self.sharedNetwork = SharedNetwork.create(self.network)
+            self.layoutCache.clear()
 
-    def setupMessageHandlers(self):
-        """Setup callbacks for specific stdin string events ("fishdown","strucdown","up","generate")
+            for session in self.sessions.values():
+                self.resetSession(session)
+
+    def startProcessPool(self):
+        """Start the optimization processes, and the thread forwarding their intermediate layouts to the sessions"""
+        #Forking a process with running threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        self.frameQueue = context.Queue() if self.streamFrames else None
+        self.processPool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processCnt,
+            mp_context=context,
+            initializer=optimizationworker.initWorker,
+            initargs=(self.generationsBlock.name,self.sessionCnt,self.frameQueue,self.streamFrameSteps,self.streamFrameMsec)
+        )
+        if(self.frameQueue is not None):
+            threading.Thread(target=self.forwardFrames,daemon=True).start()
+
+    def shutdown(self):
+        """Wait for running optimizations and free the process pool and shared memory"""
+        if(self.processPool is not None):
+            self.processPool.shutdown(wait=True)
+        self.sharedNetwork.unlink()
+        self.generations = None
+        self.generationsBlock.close()
+        self.generationsBlock.unlink()
+
+    def getSession(self,sessionId):
+        """Get the state of a client session, create it on the first request of the session
+
+        :param sessionId: (str) id of the client session
+        :return: (dict) "slot": index into the shared generations, "generation": id of the latest request,
+        "layout": current node positions (None for the original layout), "running": optimization in progress,
+        "pending": request waiting for the running optimization to stop, "frameSequence": sequence number of the sent layouts,
+        "lastStepCnt": amount of steps the last optimization needed to converge,
+        "blendedGeneration": generation of the request a blended layout was shown for, None if all sessionCnt slots are taken
+        (the client is told by a "sessionfull" message)
         """
+        session = self.sessions.get(sessionId)
+        if(session is None):
+            if(len(self.freeSlots) == 0):
+                self.profiler.count("rejectedSessions")
+                self.sendData("sessionfull",{"sessions": self.sessionCnt},sessionId)
+                return None
+            slot = self.freeSlots.pop()
+            session = {
+                "slot": slot,
+                #Continue counting, so requests of a previous session of this slot are outdated
+                "generation": int(self.generations[slot]),
+                "layout": None,
+                "running": False,
+                "pending": None,
+                "frameSequence": 0,
+                "lastStepCnt": 0,
+                "blendedGeneration": None
+            }
+            self.sessions[sessionId] = session
+        return session
 
-        self.pythonmessenger = PythonMessenger(sys.stdout,sys.stdin)
+    def closeSession(self,sessionId):
+        """Abort the optimizations of a session and free its slot"""
+        session = self.sessions.pop(sessionId,None)
+        if(session is not None):
+            self.resetSession(session)
+            self.freeSlots.append(session["slot"])
 
-        self.sendBackNetwork("create")
+    def resetSession(self,session):
+        """Outdate all requests of a session (aborting its running optimization) and reset it to the original layout"""
+        self.advanceGeneration(session)
+        session["layout"] = None
 
-        #Perform optimization to fisheye target
-        def handleDown(data):
-            pos = data.split(",")
-            focusPoint = [float(pos[0]),float(pos[1])]
+    def advanceGeneration(self,session):
+        """Start a new request generation of the session, outdating its running and pending requests"""
+        session["generation"] += 1
+        session["pending"] = None
+        self.generations[session["slot"]] = session["generation"]
 
-            self.networkoptimizer.initOptimization(self.network,focusPoint,int(pos[2]))
-            self.networkoptimizer.magnificationFactor = float(pos[3])
-            self.networkoptimizer.optimizeToFisheye = True
+    def handleOptimizationRequest(self,mode,data,optimizeToFisheye,sessionId,maxSteps=None):
+        """Optimize the layout of a session for a lens request and send back the new node positions.
+        Layouts optimized from the original network are cached (for all sessions), so repeated requests are answered without optimizing,
+        other requests near cached focal points are answered with a blend of their layouts while optimizing.
+        A running optimization of the session is aborted, the request is started as soon as it stopped.
 
-            for x in range(0,50):
-                #if(x > 40):
-                #    self.networkoptimizer.overlapPreventionEnabled = True
+        :param mode: (str) name of the request, part of the cache key
+        :param data: (str) "x,y,radius,magnification" of the lens
+        :param optimizeToFisheye: (bool) optimize towards the fisheye layout instead of the structure aware layout
+        :param sessionId: (str) id of the requesting client session
+        :param maxSteps: (int) max amount of optimization steps, the optimization stops earlier if it converged
+        """
+        pos = data.split(",")
+        focusPoint = [float(pos[0]),float(pos[1])]
+        radius = int(pos[2])
+        magnification = float(pos[3])
 
-                self.network["nodes"] = self.networkoptimizer.step()
+        with self.sessionLock:
+            session = self.getSession(sessionId)
+            if(session is None):
+                return
+            self.advanceGeneration(session)
 
-            self.sendBackNetwork("fupdate",positionsonly=True)
+            #Cached layouts are only valid for optimizations starting at the original layout
+            if(session["layout"] is None):
+                nodePositions = self.layoutCache.get(focusPoint,radius,magnification,mode)
+                if(nodePositions is not None):
+                    self.profiler.count("cachedLayouts")
+                    session["layout"] = nodePositions
+                    self.sendLayout(sessionId,session)
+                    return
 
-        #Perform optimization to structure aware fisheye layout
-        def handleStrucDown(data):
-            pos = data.split(",")
-            focusPoint = [float(pos[0]),float(pos[1])]
+                #A blend only approximates the lens, it is sent as provisional frame and the request is still optimized
+                #(from the original layout, so its result is cached)
+                blendedPositions = None
+                if(self.blendCachedLayouts):
+                    blendedPositions = self.layoutCache.blend(focusPoint,radius,magnification,mode)
+                if(blendedPositions is not None):
+                    self.profiler.count("blendedLayouts")
+                    session["blendedGeneration"] = session["generation"]
+                    session["frameSequence"] += 1
+                    self.sendData("fframe",{"seq": session["frameSequence"],"nodes": blendedPositions},sessionId)
 
-            self.networkoptimizer.initOptimization(self.network,focusPoint,int(pos[2]))
-            self.networkoptimizer.magnificationFactor = float(pos[3])
-            self.networkoptimizer.optimizeToFisheye = False
+            request = {
+                "session": sessionId,
+                "slot": session["slot"],
+                "generation": session["generation"],
+                "mode": mode,
+                "focusPoint": focusPoint,
+                "radius": radius,
+                "magnification": magnification,
+                "optimizeToFisheye": optimizeToFisheye,
+                "maxSteps": maxSteps,
+                "dtype": self.dtype.str,
+                "profile": (self.profiler.enabled,self.profiler.trackMemory)
+            }
+            if(session["running"]):
+                self.profiler.count("pendingRequests")
+                session["pending"] = request
+            else:
+                self.submitOptimization(sessionId,session,request)
+
+    def submitOptimization(self,sessionId,session,request):
+        """Start the optimization of a request on the process pool, starting at the current layout of the session"""
+        request["startPositions"] = session["layout"]
+        request["network"] = self.sharedNetwork.descriptor()
+        request["submitTime"] = time.perf_counter()
+        session["running"] = True
+        self.profiler.count("optimizations")
+        future = self.processPool.submit(optimizationworker.runOptimization,request)
+        future.add_done_callback(lambda future: self.finishOptimization(sessionId,request,future))
+
+    def finishOptimization(self,sessionId,request,future):
+        """Send back the optimized layout if the request is still the latest of its session, then start the pending request"""
+        try:
+            generation, nodePositions, stepCnt, stats = future.result()
+        except Exception as error:
+            sys.stderr.write("Optimization failed: " + repr(error) + "\n")
+            generation, nodePositions, stepCnt, stats = request["generation"], None, 0, None
+
+        if(stats is not None):
+            self.profiler.merge(stats)
+        self.profiler.record("requestSteps",stepCnt)
+        self.profiler.record("requestSeconds",time.perf_counter() - request["submitTime"])
+
+        with self.sessionLock:
+            session = self.sessions.get(sessionId)
+            #Session was closed meanwhile
+            if(session is None or session["slot"] != request["slot"]):
+                return
+
+            session["running"] = False
+            if(nodePositions is not None and generation == session["generation"]):
+                session["layout"] = nodePositions
+                session["lastStepCnt"] = stepCnt
+                if(request["startPositions"] is None):
+                    self.layoutCache.put(request["focusPoint"],request["radius"],request["magnification"],request["mode"],nodePositions)
+                self.sendLayout(sessionId,session)
+            else:
+                self.profiler.count("outdatedOptimizations")
 
-            for x in range(0,100):
-                self.network["nodes"] = self.networkoptimizer.step()
+            if(session["pending"] is not None):
+                pendingRequest = session["pending"]
+                session["pending"] = None
+                self.submitOptimization(sessionId,session,pendingRequest)
+
+    def sendLayout(self,sessionId,session):
+        """Send the current layout of a session as "fupdate" """
+        session["frameSequence"] += 1
+        self.sendBackNetwork("fupdate",positionsonly=True,sequence=session["frameSequence"],sessionId=sessionId,nodePositions=session["layout"])
+
+    def forwardFrames(self):
+        """Thread loop sending the intermediate layouts of the optimization processes as "fframe" to their sessions,
+        dropping layouts of outdated or finished requests and of requests a blended layout is shown for"""
+        while True:
+            sessionId, generation, nodePositions = self.frameQueue.get()
+            with self.sessionLock:
+                session = self.sessions.get(sessionId)
+                if(session is None or not session["running"] or session["generation"] != generation):
+                    continue
+                #The first frames would be further from the lens layout than the blend shown for the request
+                if(session["blendedGeneration"] == generation):
+                    continue
+                session["frameSequence"] += 1
+                self.profiler.count("frames")
+                self.sendData("fframe",{"seq": session["frameSequence"],"nodes": nodePositions},sessionId)
+
+    def setupMessageHandlers(self):
+        """Setup callbacks for specific stdin string events ("open","close","fishdown","strucdown","up","generate","stats","precision")
+        """
 
-            self.sendBackNetwork("fupdate",positionsonly=True)
+        self.pythonmessenger = PythonMessenger(sys.stdout,sys.stdin,binaryOutput=self.binaryProtocol,threaded=True,profiler=self.profiler)
+
+        self.sendBackNetwork("create")
+
+        #Client connected, send the network to its session
+        def handleOpen(data,sessionId):
+            with self.sessionLock:
+                if(self.getSession(sessionId) is not None):
+                    self.sendBackNetwork("create",sessionId=sessionId)
+
+        #Client disconnected
+        def handleClose(data,sessionId):
+            with self.sessionLock:
+                self.closeSession(sessionId)
+
+        #Perform optimization to fisheye target
+        def handleDown(data,sessionId):
+            self.handleOptimizationRequest("fishdown",data,True,sessionId)
+
+        #Perform optimization to structure aware fisheye layout
+        def handleStrucDown(data,sessionId):
+            self.handleOptimizationRequest("strucdown",data,False,sessionId)
 
         #Reset to original layout
-        def handleUp(data):
-            self.network["nodes"] = self.originalNodesPos
-            self.sendBackNetwork("fupdate",positionsonly=False)
+        def handleUp(data,sessionId):
+            with self.sessionLock:
+                session = self.getSession(sessionId)
+                if(session is not None):
+                    self.resetSession(session)
+                    self.sendBackNetwork("fupdate",positionsonly=False,sessionId=sessionId)
 
-        #Generate new Network
-        def handleGenRequest(data):
+        #Generate new Network (shared by all sessions)
+        def handleGenRequest(data,sessionId):
             splitdata = pos = data.split(",")
             self.createNewNetwork(int(pos[0]),int(pos[0]),int(pos[1]))
             self.sendBackNetwork("create")
 
-        self.pythonmessenger.registerMessageHandler("fishdown",handleDown)
-        self.pythonmessenger.registerMessageHandler("strucdown",handleStrucDown)
+        self.pythonmessenger.registerMessageHandler("open",handleOpen)
+        self.pythonmessenger.registerMessageHandler("close",handleClose)
+        #Lens requests of a session queued while dragging collapse to the latest one
+        self.pythonmessenger.registerMessageHandler("fishdown",handleDown,coalesceGroup="lens")
+        self.pythonmessenger.registerMessageHandler("strucdown",handleStrucDown,coalesceGroup="lens")
         self.pythonmessenger.registerMessageHandler("up",handleUp)
+        #Profiling: "on", "memory" (on and trace allocations), "off", "reset" or "get", answered with the collected statistics
+        def handleStats(data,sessionId):
+            if(data == "on" or data == "memory"):
+                self.profiler.configure(True,data == "memory")
+            elif(data == "off"):
+                self.profiler.configure(False)
+            elif(data == "reset"):
+                self.profiler.reset()
+            self.sendData("stats",self.profiler.snapshot(),sessionId)
+
+        #Float type of the optimizations started afterwards: "float32" (large networks) or "float64" (validation)
+        def handlePrecision(data,sessionId):
+            if(data in ("float32","float64")):
+                self.dtype = np.dtype(data)
+
         self.pythonmessenger.registerMessageHandler("generate",handleGenRequest)
+        self.pythonmessenger.registerMessageHandler("stats",handleStats)
+        self.pythonmessenger.registerMessageHandler("precision",handlePrecision)
 
         self.pythonmessenger.startInputReading()
 
 
-pythonCommunicator = PythonCommunicator()
+#Guarded, as the optimization processes import this module on start
+if __name__ == "__main__":
+    pythonCommunicator = PythonCommunicator(binaryProtocol="--binary" in sys.argv)
@@ -1,60 +1,227 @@
 import json
+import struct
+import threading
+import collections
+import numpy as np
+from phaseprofiler import PhaseProfiler
 
 class PythonMessenger:
     """Writing messages to stdout and reading messages from stdin and executing registered callbacks based on those messages"""
 
-    def __init__(self,stdout,stdin):
+    #First byte of a binary frame, text messages never start with it
+    binaryFrameMarker = b"\x00"
+
+    def __init__(self,stdout,stdin,binaryOutput=False,readSize=65536,threaded=False,profiler=None):
         """Setting target/subject stdout, stdin streams
 
         :param stdout: writable python stream
         :param stdin: readable python stream
+        :param binaryOutput: (bool) send data as length prefixed binary frames with raw array buffers instead of json text
+        :param readSize: (int) max amount of bytes read from stdin at once
+        :param threaded: (bool) execute callbacks on a worker thread, so new messages are read (and can replace
+        queued ones) while a callback is running
+        :param profiler: (PhaseProfiler) profiler timing parsing, callbacks ("handle.<keyword>"), serialization and writing
         """
 
         self.stdout = stdout
         self.stdin = stdin
+        self.binaryOutput = binaryOutput
+        self.readSize = readSize
 
         self.selfcallbackdict = {}
 
+        self.threaded = threaded
+        #Keyword -> group of messages replacing each other while queued
+        self.coalesceGroups = {}
+        #Queued (coalesce group, message) tuples waiting for the worker thread
+        self.pendingMessages = collections.deque()
+        self.pendingCondition = threading.Condition()
+        self.workerThread = None
+        #Callbacks may send from other threads (e.g. when pool results arrive)
+        self.sendLock = threading.Lock()
+        self.profiler = profiler if profiler is not None else PhaseProfiler()
+
         self.inReading = True
 
     def sendMessage(self,message):
-        """Write message to subject stdout
+        """Write message to subject stdout, messages are terminated by a newline
 
-        :param message: (str) message to be written
+        :param message: (str) message to be written (without newlines)
         """
-        self.stdout.write(message)
-        self.stdout.flush()
+        with self.sendLock, self.profiler.phase("write"):
+            self.stdout.write(message + "\n")
+            self.stdout.flush()
+        self.profiler.count("bytesSent",len(message) + 1)
 
-    def registerMessageHandler(self,keyword,callback):
+    def sendData(self,keyword,data,sessionId=None):
+        """Send data as binary frame if binaryOutput is set, otherwise as json text message
+
+        :param keyword: (str) message type, spaces not allowed in this name
+        :param data: (dict) json serializable data, values may also be np.arrays
+        :param sessionId: (str) client session the data is addressed to, None for all sessions
+        """
+        if(self.binaryOutput):
+            self.sendBinaryMessage(keyword,data,sessionId)
+        else:
+            self.sendJSONMessage(keyword,data,sessionId)
+
+    def sendJSONMessage(self,keyword,data,sessionId=None):
+        """Send data serialized to json without spaces as "keyword json [sessionId]" text message
+
+        :param keyword: (str) message type, spaces not allowed in this name
+        :param data: (dict) json serializable data, values may also be np.arrays
+        :param sessionId: (str) client session the data is addressed to (spaces not allowed), None for all sessions
+        """
+        with self.profiler.phase("serialize"):
+            datajson = json.dumps(data,separators=(",",":"),default=lambda value: value.tolist())
+        message = keyword + " " + datajson
+        if(sessionId is not None):
+            message += " " + sessionId
+        self.sendMessage(message)
+
+    def sendBinaryMessage(self,keyword,data,sessionId=None):
+        """Send data as binary frame, numeric lists and np.arrays are sent as raw little endian
+        float32/int32 buffers, all other values as json header.
+
+        Frame layout (little endian):
+        marker (1 byte), payload length (uint32), keyword length (uint16), keyword (utf-8),
+        header length (uint32), header json (utf-8) {"data":{...},"arrays":[{"name","dtype","shape"}],"session":id}, array buffers
+
+        :param keyword: (str) message type
+        :param data: (dict) data to be sent, values may be np.arrays
+        :param sessionId: (str) client session the data is addressed to, None for all sessions
+        """
+        with self.profiler.phase("serialize"):
+            header = {"data": {},"arrays": []}
+            if(sessionId is not None):
+                header["session"] = sessionId
+            buffers = []
+            for name, value in data.items():
+                if(isinstance(value,(list,np.ndarray))):
+                    value = np.asarray(value)
+                if(not isinstance(value,np.ndarray) or value.dtype.kind not in "iuf"):
+                    header["data"][name] = value
+                    continue
+
+                dtype = "int32" if value.dtype.kind in "iu" else "float32"
+                value = np.ascontiguousarray(value,dtype="<" + ("i4" if dtype == "int32" else "f4"))
+                header["arrays"].append({"name": name,"dtype": dtype,"shape": list(value.shape)})
+                buffers.append(memoryview(value).cast("B"))
+
+            keywordBytes = keyword.encode("utf-8")
+            headerBytes = json.dumps(header,separators=(",",":")).encode("utf-8")
+            payloadLength = 2 + len(keywordBytes) + 4 + len(headerBytes) + sum(len(buffer) for buffer in buffers)
+        self.profiler.count("bytesSent",1 + 4 + payloadLength)
+
+        with self.sendLock, self.profiler.phase("write"):
+            #Flush pending text output, before writing to the underlying binary stream
+            self.stdout.flush()
+            outputStream = getattr(self.stdout,"buffer",self.stdout)
+            outputStream.write(self.binaryFrameMarker + struct.pack("<IH",payloadLength,len(keywordBytes)) + keywordBytes)
+            outputStream.write(struct.pack("<I",len(headerBytes)) + headerBytes)
+            for buffer in buffers:
+                outputStream.write(buffer)
+            outputStream.flush()
+
+    def registerMessageHandler(self,keyword,callback,coalesceGroup=None):
         """Register callback method in internal dict for use from input reader
 
-        :param callback: (data)=>None with parameter containing data from stdin (spaces not allowed) 
+        :param callback: (data,sessionId)=>None with parameter containing data from stdin (spaces not allowed) and
+        the session id of "keyword data sessionId" messages (None if the message has no session id)
+        :param coalesceGroup: (str) (threaded only) a queued message is replaced by a newer message of the same group
+        and session, if no other message was queued in between (e.g. lens requests while dragging)
         """
         self.selfcallbackdict[keyword] = callback
+        if(coalesceGroup is not None):
+            self.coalesceGroups[keyword] = coalesceGroup
 
     def startInputReading(self):
-        """Start loop which continuously reads new available bytes from stdin, and calls callback based on
-        first message part (callback name) with message payload
+        """Start loop which continuously reads new available bytes from stdin (up to readSize at once), and calls callback based on
+        first message part (callback name) with message payload, stops if stdin was closed
         """
-        buff = ''
-        while self.inReading:
-            self.stdout.flush()
+        inputStream = getattr(self.stdin,"buffer",self.stdin)
+        #read1 returns as soon as any bytes are available, instead of waiting for readSize bytes
+        readAvailable = getattr(inputStream,"read1",inputStream.read)
 
-            buff += self.stdin.read(1)
-            #print(buff[:-1])
-            if buff.endswith('\n'):
+        if(self.threaded):
+            self.workerThread = threading.Thread(target=self.processMessages)
+            self.workerThread.start()
 
-                message = "" + buff[:-1]
-                messageParts = message.split(" ")
-                #print(message)
-                if(len(messageParts) > 1):
-                    if(messageParts[0] in self.selfcallbackdict):
-                        self.selfcallbackdict[messageParts[0]](messageParts[1])
+        buff = b''
+        while self.inReading:
+            if(not self.threaded):
+                self.stdout.flush()
 
+            chunk = readAvailable(self.readSize)
+            if(len(chunk) == 0):
+                break
+            if(isinstance(chunk,str)):
+                chunk = chunk.encode("utf-8")
+
+            with self.profiler.phase("parse"):
+                messages = (buff + chunk).split(b"\n")
+                #Last part is an incomplete message (empty if chunk ended with a newline)
+                buff = messages.pop()
+                messages = [message.decode("utf-8") for message in messages]
+            self.profiler.count("messagesReceived",len(messages))
+            for message in messages:
+                if(self.threaded):
+                    self.queueMessage(message)
+                else:
+                    self.handleMessage(message)
+
+            if(not self.threaded):
                 self.stdout.flush()
 
-                buff = ''
+        #Let the worker finish the queued messages
+        if(self.threaded):
+            self.stop()
+            self.workerThread.join()
+
+    def queueMessage(self,message):
+        """Queue message for the worker thread, replace the last queued message if it belongs to the same coalesce group
+
+        :param message: (str) "keyword payload [sessionId]" message without trailing newline
+        """
+        messageParts = message.split(" ")
+        group = self.coalesceGroups.get(messageParts[0])
+        if(group is not None and len(messageParts) > 2):
+            group = (group,messageParts[2])
+        with self.pendingCondition:
+            if(group is not None and len(self.pendingMessages) > 0 and self.pendingMessages[-1][0] == group):
+                self.pendingMessages.pop()
+                self.profiler.count("messagesCoalesced")
+            self.pendingMessages.append((group,message))
+            self.pendingCondition.notify()
+
+    def processMessages(self):
+        """Worker thread loop, handling queued messages in order until stopped and the queue is empty"""
+        while True:
+            with self.pendingCondition:
+                while len(self.pendingMessages) == 0 and self.inReading:
+                    self.pendingCondition.wait()
+                if(len(self.pendingMessages) == 0):
+                    return
+
+                _, message = self.pendingMessages.popleft()
+
+            self.handleMessage(message)
+
+    def handleMessage(self,message):
+        """Call the callback registered for the first message part with the message payload and session id
+
+        :param message: (str) "keyword payload [sessionId]" message without trailing newline
+        """
+        messageParts = message.split(" ")
+        #print(message)
+        if(len(messageParts) > 1):
+            sessionId = messageParts[2] if len(messageParts) > 2 else None
+            if(messageParts[0] in self.selfcallbackdict):
+                with self.profiler.phase("handle." + messageParts[0]):
+                    self.selfcallbackdict[messageParts[0]](messageParts[1],sessionId)
 
     def stop(self):
-        self.inReading = False
+        with self.pendingCondition:
+            self.inReading = False
+            self.pendingCondition.notify()
 
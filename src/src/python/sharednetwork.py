@@ -0,0 +1,71 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+class SharedNetwork:
+    """Network arrays (nodes, edges, nodeclusters) placed once in shared memory, so any process can read them without copying"""
+
+    #Network entries stored in shared memory
+    arrayNames = ("nodes","edges","nodeclusters")
+
+    def __init__(self,blocks,arrays):
+        """Use create or attach to construct a SharedNetwork
+
+        :param blocks: (dict) name -> shared_memory.SharedMemory block holding the array
+        :param arrays: (dict) name -> np.array view into the shared memory block
+        """
+        self.blocks = blocks
+        self.network = arrays
+
+    @classmethod
+    def create(cls,network):
+        """Copy network arrays into newly created shared memory blocks
+
+        :param network: ({"nodes":[],"edges":[],"nodeclusters":[]}) network as created by NetworkGenerator
+        :return: SharedNetwork owning the created blocks (call unlink when no longer needed)
+        """
+        blocks = {}
+        arrays = {}
+        for name in cls.arrayNames:
+            array = np.asarray(network[name])
+            #Size 0 blocks are not allowed
+            block = shared_memory.SharedMemory(create=True,size=max(array.nbytes,1))
+            arrays[name] = np.ndarray(array.shape,dtype=array.dtype,buffer=block.buf)
+            arrays[name][...] = array
+            arrays[name].flags.writeable = False
+            blocks[name] = block
+        return cls(blocks,arrays)
+
+    @classmethod
+    def attach(cls,descriptor):
+        """Attach to the shared memory blocks of a network created in another process
+
+        :param descriptor: (dict) see descriptor
+        :return: SharedNetwork with read only views into the shared blocks
+        """
+        blocks = {}
+        arrays = {}
+        for name, (blockName, shape, dtype) in descriptor.items():
+            block = shared_memory.SharedMemory(name=blockName)
+            arrays[name] = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+            arrays[name].flags.writeable = False
+            blocks[name] = block
+        return cls(blocks,arrays)
+
+    def descriptor(self):
+        """Get the picklable description needed to attach to the shared blocks
+
+        :return: (dict) name -> (shared memory name, shape, dtype string)
+        """
+        return {name: (self.blocks[name].name,self.network[name].shape,self.network[name].dtype.str) for name in self.network}
+
+    def close(self):
+        """Release the views and detach from the shared blocks of this process"""
+        self.network = {}
+        for block in self.blocks.values():
+            block.close()
+
+    def unlink(self):
+        """Detach and free the shared blocks (by the creating process, attached processes keep their mapping until close)"""
+        self.close()
+        for block in self.blocks.values():
+            block.unlink()
@@ -0,0 +1,160 @@
+import numpy as np
+
+def expandRanges(starts,counts):
+    """Expand a range [start,start+count) per entry into flat index pairs
+
+    :param starts: np.array((entries)) first index of each range
+    :param counts: np.array((entries)) length of each range
+    :return: index of the entry each range element belongs to, index of each range element
+    """
+    owners = np.repeat(np.arange(starts.shape[0]),counts)
+    rangeOffsets = np.arange(owners.shape[0]) - np.repeat(np.cumsum(counts) - counts,counts)
+    return owners, np.repeat(starts,counts) + rangeOffsets
+
+class SpatialGrid:
+    """Uniform grid index over 2d positions, for finding close position pairs without comparing all pairs"""
+
+    def __init__(self,positions,cellSize):
+        """Sort positions into the grid cells they are located in
+
+        :param positions: np.array((positions,2)) positions to be indexed
+        :param cellSize: (float) width and height of a grid cell
+        """
+        self.positions = np.asarray(positions)
+        self.cellSize = cellSize
+        self.positionCnt = self.positions.shape[0]
+
+        if(self.positionCnt == 0):
+            return
+
+        cells = np.floor(self.positions / cellSize).astype(np.int64)
+        self.cells = cells - cells.min(axis=0)
+        self.rowCnt = int(self.cells[:,1].max()) + 1
+
+        #Sort order of positions by cell, identical for any key stride larger than the amount of rows
+        self.cellOrder = np.lexsort((self.cells[:,1],self.cells[:,0]))
+
+    def cellKeys(self,reach):
+        """Flatten cell coordinates to keys, padded so neighbor cells up to reach cells away do not wrap around rows
+
+        :param reach: (int) amount of neighboring cells in each direction that keys are queried for
+        :return: keys of each position, key stride between columns
+        """
+        stride = self.rowCnt + 2 * reach
+        return (self.cells[:,0] + reach) * stride + (self.cells[:,1] + reach), stride
+
+    def findPairsWithin(self,radius,queryIndices=None):
+        """Find all index pairs of positions closer than radius to each other
+
+        :param radius: (float) distance below which positions are paired
+        :param queryIndices: np.array((queries),dtype=int) only find pairs (i,j) with i in queryIndices, None for all positions
+        :return: np.array((pairs,2),dtype=int) index pairs (i,j) with i != j, containing both (i,j) and (j,i),
+        sorted by i and then by j
+        """
+        if(self.positionCnt == 0):
+            return np.zeros((0,2),dtype=np.intp)
+
+        reach = int(np.ceil(radius / self.cellSize))
+        keys, stride = self.cellKeys(reach)
+        sortedKeys = keys[self.cellOrder]
+        if(queryIndices is None):
+            queryIndices = np.arange(self.positionCnt)
+        queryKeys = keys[queryIndices]
+
+        leftIndices = []
+        rightIndices = []
+        for xOffset in range(-reach,reach + 1):
+            for yOffset in range(-reach,reach + 1):
+                neighborKeys = queryKeys + xOffset * stride + yOffset
+                starts = np.searchsorted(sortedKeys,neighborKeys,side='left')
+                counts = np.searchsorted(sortedKeys,neighborKeys,side='right') - starts
+
+                left, right = expandRanges(starts,counts)
+                leftIndices.append(queryIndices[left])
+                rightIndices.append(self.cellOrder[right])
+
+        left = np.concatenate(leftIndices)
+        right = np.concatenate(rightIndices)
+
+        differences = self.positions[right] - self.positions[left]
+        distances = np.sqrt(np.power(differences[:,0],2) + np.power(differences[:,1],2))
+        condition = (distances < radius) & (left != right)
+        left = left[condition]
+        right = right[condition]
+
+        #Pairs are unique, sorting a single combined key is faster than lexsort
+        order = np.argsort(left.astype(np.int64) * self.positionCnt + right)
+        return np.stack((left[order],right[order]),axis=1)
+
+class BoxGrid:
+    """Uniform grid index over axis aligned bounding boxes, for finding overlapping boxes without comparing all pairs"""
+
+    def __init__(self,minCorners,maxCorners,cellSize=None):
+        """Insert each box into every grid cell it covers
+
+        :param minCorners: np.array((boxes,2)) lower x, y bounds of the boxes
+        :param maxCorners: np.array((boxes,2)) upper x, y bounds of the boxes
+        :param cellSize: (float) width and height of a grid cell, defaults to the mean box extent
+        """
+        self.minCorners = np.asarray(minCorners)
+        self.maxCorners = np.asarray(maxCorners)
+        self.boxCnt = self.minCorners.shape[0]
+
+        if(self.boxCnt == 0):
+            return
+
+        if(cellSize is None):
+            cellSize = np.mean(self.maxCorners - self.minCorners)
+        #Degenerate boxes (points) would otherwise all fall into cells of size 0
+        self.cellSize = max(float(cellSize),1e-6)
+
+        self.gridOrigin = self.minCorners.min(axis=0)
+        minCells = self.cellCoordinates(self.minCorners)
+        maxCells = self.cellCoordinates(self.maxCorners)
+        self.rowCnt = int(maxCells[:,1].max()) + 1
+
+        #Replicate each box into all of its covered cells
+        cellSpans = maxCells - minCells + 1
+        boxes, cellOffsets = expandRanges(np.zeros(self.boxCnt,dtype=np.int64),cellSpans[:,0] * cellSpans[:,1])
+        columns = minCells[boxes,0] + cellOffsets // cellSpans[boxes,1]
+        rows = minCells[boxes,1] + cellOffsets % cellSpans[boxes,1]
+
+        keys = columns * self.rowCnt + rows
+        order = np.argsort(keys,kind='stable')
+        self.entryBoxes = boxes[order]
+        self.entryKeys = keys[order]
+
+    def cellCoordinates(self,positions):
+        """Get the column, row of the grid cell each position lies in"""
+        return np.floor((positions - self.gridOrigin) / self.cellSize).astype(np.int64)
+
+    def findOverlappingPairs(self):
+        """Find all index pairs of boxes that overlap each other
+
+        :return: np.array((pairs,2),dtype=int) index pairs (i,j) with i < j, sorted by i and then by j
+        """
+        if(self.boxCnt == 0):
+            return np.zeros((0,2),dtype=np.intp)
+
+        #Pair every entry with the entries after it in the same cell
+        groupEnds = np.searchsorted(self.entryKeys,self.entryKeys,side='right')
+        entryPositions = np.arange(self.entryKeys.shape[0])
+        leftEntries, rightEntries = expandRanges(entryPositions + 1,groupEnds - entryPositions - 1)
+
+        left = self.entryBoxes[leftEntries]
+        right = self.entryBoxes[rightEntries]
+        cellKeys = self.entryKeys[leftEntries]
+
+        overlapMin = np.maximum(self.minCorners[left],self.minCorners[right])
+        overlapMax = np.minimum(self.maxCorners[left],self.maxCorners[right])
+        condition = np.all(overlapMin <= overlapMax,axis=1)
+
+        #Boxes sharing several cells are reported only in the cell holding the lower corner of their overlap
+        overlapCells = self.cellCoordinates(overlapMin)
+        condition &= (overlapCells[:,0] * self.rowCnt + overlapCells[:,1]) == cellKeys
+
+        left = left[condition]
+        right = right[condition]
+        pairs = np.stack((np.minimum(left,right),np.maximum(left,right)),axis=1)
+        order = np.lexsort((pairs[:,1],pairs[:,0]))
+        return pairs[order]
@@ -0,0 +1,31 @@
+import numpy as np
+from networkgenerator import NetworkGenerator
+from networkoptimizer import NetworkOptimizer
+from multileveloptimizer import MultilevelOptimizer
+
+def optimizeShifted(multilevelOptimizer,network,shift):
+    """Optimize the network moved by shift (same edges array) with the lens moved along"""
+    shiftedNetwork = dict(network)
+    shiftedNetwork["nodes"] = np.asarray(network["nodes"],dtype=float) + shift
+    np.random.seed(1)
+    nodePositions, stepCnts = multilevelOptimizer.optimize(shiftedNetwork,[450.0 + shift,450.0 + shift],200,maxSteps=30)
+    return nodePositions, shiftedNetwork
+
+def test_optimizeTwiceWithNewPositions():
+    network = NetworkGenerator().generateNetwork(400,600,0,900,0,900,seed=1)
+    multilevelOptimizer = MultilevelOptimizer(NetworkOptimizer(),minCoarseNodes=50)
+
+    firstPositions, firstNetwork = optimizeShifted(multilevelOptimizer,network,0.0)
+    secondPositions, secondNetwork = optimizeShifted(multilevelOptimizer,network,500.0)
+
+    #The finest level is the network of the call, the coarse levels are placed from its positions
+    levels = multilevelOptimizer.coarsen(secondNetwork)
+    assert len(levels) > 1
+    assert levels[0]["network"] is secondNetwork
+    coarsePositions = levels[1]["network"]["nodes"]
+    expectedPositions = multilevelOptimizer.calcCoarsePositions(secondNetwork["nodes"],levels[1]["mapping"],coarsePositions.shape[0])
+    assert np.allclose(coarsePositions,expectedPositions)
+
+    #The layout follows the moved input instead of the positions of the first call
+    shift = np.mean(np.asarray(secondPositions) - np.asarray(firstPositions),axis=0)
+    assert np.allclose(shift,[500.0,500.0],atol=5.0)